@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+import json
+import random
+import resource
+import threading
+from base64 import b32encode
+from time import monotonic, process_time, sleep, time
+
+from commander import Commander
+from test_framework.messages import (
+    NODE_NETWORK,
+    NODE_WITNESS,
+    CAddress,
+    msg_generic,
+    ser_compact_size,
+    sha3,
+)
+from test_framework.p2p import MAGIC_BYTES, P2P_SUBVERSION, P2PConnection, P2PInterface
+
+# Bitcoin Core disconnects peers that send more entries than this in one addr message
+MAX_ADDR_TO_SEND = 1000
+
+
+def random_ipv4(rng):
+    # Stay out of private, loopback, link-local, CGNAT and multicast ranges
+    # so the tank's addrman treats every entry as routable.
+    while True:
+        first = rng.randrange(1, 224)
+        if first not in (10, 100, 127, 169, 172, 192, 198):
+            return f"{first}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def random_ipv6(rng):
+    # 2600::/8 is plain global unicast (no 6to4, Teredo or documentation prefixes)
+    groups = [0x2600 + rng.randrange(0x100)] + [rng.randrange(0x10000) for _ in range(7)]
+    return ":".join(f"{g:x}" for g in groups)
+
+
+def random_torv3(rng):
+    pubkey = rng.randbytes(32)
+    version = bytes([3])
+    checksum = sha3(b".onion checksum" + pubkey + version)[:2]
+    return b32encode(pubkey + checksum + version).decode("ascii").lower() + ".onion"
+
+
+NETWORKS = {
+    "ipv4": (CAddress.NET_IPV4, random_ipv4),
+    "ipv6": (CAddress.NET_IPV6, random_ipv6),
+    "torv3": (CAddress.NET_TORV3, random_torv3),
+}
+
+
+def build_addr_messages(framer, rng, *, count, batch_size, networks, addrv2):
+    """Pre-serialize `count` random addresses into fully framed addr or addrv2 messages.
+
+    Every entry is serialized exactly once and every message is framed (header and
+    checksum) exactly once, so streaming them later is just a socket write.
+    Returns a list of (number of addresses, raw message bytes) tuples."""
+    msgtype = b"addrv2" if addrv2 else b"addr"
+    now = int(time())
+    messages = []
+    for start in range(0, count, batch_size):
+        n = min(batch_size, count - start)
+        entries = []
+        for _ in range(n):
+            addr = CAddress()
+            addr.net, random_ip = NETWORKS[rng.choice(networks)]
+            addr.ip = random_ip(rng)
+            addr.port = 8333
+            addr.nServices = NODE_NETWORK | NODE_WITNESS
+            # Recently seen, but never in the future (which would get the entry penalized)
+            addr.time = now - rng.randrange(3 * 60 * 60)
+            entries.append(addr.serialize_v2() if addrv2 else addr.serialize())
+        payload = ser_compact_size(n) + b"".join(entries)
+        messages.append((n, framer.build_message(msg_generic(msgtype, payload))))
+    return messages
+
+
+def rss_bytes():
+    """Current resident set size of this process (peak RSS if /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class AddrFlooder(P2PInterface):
+    def __init__(self, node, offset):
+        super().__init__(support_addrv2=True)
+        self.node = node
+        # Each flooder starts at a different point of the shared message pool
+        # so tanks don't all receive the exact same sequence of addresses.
+        self.offset = offset
+        self.sent_msgs = 0
+        self.sent_addrs = 0
+        self.sent_bytes = 0
+
+
+class AddrmanStress(Commander):
+    def set_test_params(self):
+        self.num_nodes = 0
+        self.flooders = []
+        self.samples = []
+
+    def add_options(self, parser):
+        parser.description = (
+            "Stream pre-serialized addr/addrv2 messages to tanks at a controlled rate "
+            "and measure the cost on both ends"
+        )
+        parser.usage = "warnet run /path/to/addrman_stress.py [options]"
+        parser.add_argument(
+            "--tanks",
+            dest="tanks",
+            default="",
+            type=str,
+            help="Comma-separated tank names to target (default: all tanks)",
+        )
+        parser.add_argument(
+            "--rate",
+            dest="rate",
+            default=1000,
+            type=float,
+            help="Addresses per second sent to each tank (default 1000)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            dest="batch_size",
+            default=MAX_ADDR_TO_SEND,
+            type=int,
+            help=f"Addresses per message, at most {MAX_ADDR_TO_SEND} (default {MAX_ADDR_TO_SEND})",
+        )
+        parser.add_argument(
+            "--pool-size",
+            dest="pool_size",
+            default=100000,
+            type=int,
+            help="Number of distinct addresses pre-generated before streaming (default 100000)",
+        )
+        parser.add_argument(
+            "--addrv2",
+            dest="addrv2",
+            action="store_true",
+            help="Send BIP155 addrv2 messages instead of legacy addr messages",
+        )
+        parser.add_argument(
+            "--networks",
+            dest="networks",
+            default="ipv4",
+            type=str,
+            help="Comma-separated address networks: ipv4, ipv6, torv3 (non-ipv4 needs --addrv2)",
+        )
+        parser.add_argument(
+            "--duration",
+            dest="duration",
+            default=300,
+            type=int,
+            help="Seconds to stream addresses, 0 runs forever (default 300)",
+        )
+        parser.add_argument(
+            "--report-interval",
+            dest="report_interval",
+            default=10,
+            type=int,
+            help="Seconds between resource usage samples (default 10)",
+        )
+        parser.add_argument(
+            "--output",
+            dest="output",
+            default=None,
+            type=str,
+            help="Append every resource usage sample to this file as JSON lines",
+        )
+
+    def sample_tank(self, flooder, sample):
+        node = flooder.node
+        try:
+            start = monotonic()
+            peers = node.getpeerinfo()
+            addrman_size = len(node.getnodeaddresses(0))
+            locked = node.getmemoryinfo()["locked"]
+            # There is no RPC for a tank's CPU load, but RPC latency
+            # under flood is a good proxy for how busy its threads are.
+            latency = monotonic() - start
+        except Exception as e:
+            self.log.error(f"Couldn't sample tank {node.tank}: {e}")
+            return
+        ours = [p for p in peers if p["inbound"] and p["subver"] == P2P_SUBVERSION]
+        sample["tanks"][node.tank] = {
+            "connected": flooder.is_connected,
+            "sent_addrs": flooder.sent_addrs,
+            "addr_processed": sum(p.get("addr_processed", 0) for p in ours),
+            "addr_rate_limited": sum(p.get("addr_rate_limited", 0) for p in ours),
+            "addrman_size": addrman_size,
+            "peers": len(peers),
+            "locked_memory_used": locked["used"],
+            "rpc_latency": round(latency, 4),
+        }
+
+    def report(self, stop, start, pool_bytes):
+        last_wall = monotonic()
+        last_cpu = process_time()
+        while not stop.wait(self.options.report_interval):
+            wall = monotonic()
+            cpu = process_time()
+            sent = sum(f.sent_addrs for f in self.flooders)
+            sample = {
+                "time": int(time()),
+                "elapsed": round(wall - start, 1),
+                "sender": {
+                    "cpu_percent": round(100 * (cpu - last_cpu) / (wall - last_wall), 1),
+                    "rss_bytes": rss_bytes(),
+                    "pool_bytes": pool_bytes,
+                    "sent_addrs": sent,
+                    "sent_bytes": sum(f.sent_bytes for f in self.flooders),
+                    "addr_rate": round(sent / (wall - start), 1),
+                },
+                "tanks": {},
+            }
+            last_wall = wall
+            last_cpu = cpu
+
+            sample_threads = [
+                threading.Thread(target=self.sample_tank, args=(flooder, sample))
+                for flooder in self.flooders
+            ]
+            for thread in sample_threads:
+                thread.start()
+            all(thread.join() is None for thread in sample_threads)
+
+            sender = sample["sender"]
+            self.log.info(
+                f"sender: {sender['addr_rate']} addr/s, cpu {sender['cpu_percent']}%, "
+                f"rss {sender['rss_bytes'] // 2**20} MiB"
+            )
+            for tank, stats in sorted(sample["tanks"].items()):
+                self.log.info(
+                    f"  {tank}: addrman {stats['addrman_size']}, "
+                    f"processed {stats['addr_processed']}, "
+                    f"rate-limited {stats['addr_rate_limited']}, "
+                    f"locked mem {stats['locked_memory_used']}, "
+                    f"rpc {stats['rpc_latency']}s"
+                )
+            self.samples.append(sample)
+            if self.options.output:
+                with open(self.options.output, "a") as f:
+                    f.write(json.dumps(sample) + "\n")
+
+    def run_test(self):
+        networks = [n.strip() for n in self.options.networks.split(",") if n.strip()]
+        for network in networks:
+            assert network in NETWORKS, f"Unknown address network {network}"
+        if not self.options.addrv2:
+            assert networks == ["ipv4"], "Legacy addr messages can only carry ipv4 addresses"
+        batch_size = self.options.batch_size
+        assert 0 < batch_size <= MAX_ADDR_TO_SEND, f"--batch-size must be 1..{MAX_ADDR_TO_SEND}"
+
+        if self.options.tanks:
+            targets = [self.tanks[name.strip()] for name in self.options.tanks.split(",")]
+        else:
+            targets = self.nodes
+
+        self.log.info(f"Connecting to {len(targets)} tanks over p2p...")
+        for i, node in enumerate(targets):
+            host, port = self.p2p_target(node)
+            flooder = AddrFlooder(node, offset=i)
+            flooder.peer_connect(dstaddr=host, dstport=port, net=node.chain, timeout_factor=1)()
+            self.flooders.append(flooder)
+        for flooder in self.flooders:
+            flooder.wait_for_verack()
+
+        self.log.info(f"Pre-generating {self.options.pool_size} addresses ({','.join(networks)})")
+        framer = P2PConnection()
+        framer.magic_bytes = MAGIC_BYTES[targets[0].chain]
+        gen_start = monotonic()
+        messages = build_addr_messages(
+            framer,
+            random.Random(self.options.randomseed),
+            count=self.options.pool_size,
+            batch_size=batch_size,
+            networks=networks,
+            addrv2=self.options.addrv2,
+        )
+        pool_bytes = sum(len(raw) for _, raw in messages)
+        self.log.info(
+            f"Built {len(messages)} {'addrv2' if self.options.addrv2 else 'addr'} messages "
+            f"({pool_bytes // 1024} KiB) in {monotonic() - gen_start:.2f}s"
+        )
+
+        msgs_per_sec = self.options.rate / batch_size
+        self.log.info(
+            f"Streaming {self.options.rate} addr/s ({msgs_per_sec:.2f} msg/s) "
+            f"to each of {len(self.flooders)} tanks"
+        )
+        stop = threading.Event()
+        start = monotonic()
+        reporter = threading.Thread(target=self.report, args=(stop, start, pool_bytes))
+        reporter.start()
+
+        # One pacing loop drives every connection: sends are handed to the
+        # shared network event loop, so no thread per tank is needed.
+        try:
+            while self.options.duration == 0 or monotonic() - start < self.options.duration:
+                due = int((monotonic() - start) * msgs_per_sec) + 1
+                for flooder in self.flooders:
+                    if not flooder.is_connected:
+                        continue
+                    while flooder.sent_msgs < due:
+                        n, raw = messages[(flooder.offset + flooder.sent_msgs) % len(messages)]
+                        flooder.send_raw_message(raw)
+                        flooder.sent_msgs += 1
+                        flooder.sent_addrs += n
+                        flooder.sent_bytes += len(raw)
+                sleep(max(0, start + due / msgs_per_sec - monotonic()))
+        finally:
+            stop.set()
+            reporter.join()
+
+        for flooder in self.flooders:
+            if not flooder.is_connected:
+                self.log.warning(f"Tank {flooder.node.tank} disconnected us during the flood")
+            flooder.peer_disconnect()
+        total = sum(f.sent_addrs for f in self.flooders)
+        self.log.info(f"Sent {total} addresses in {monotonic() - start:.1f}s")
+
+
+def main():
+    AddrmanStress().main()
+
+
+if __name__ == "__main__":
+    main()
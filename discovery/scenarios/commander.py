@@ -28,11 +28,12 @@ from test_framework.messages import (
     CTxOut,
     from_binary,
     from_hex,
+    hash256,
     ser_string,
     ser_uint256,
     tx_from_hex,
 )
-from test_framework.p2p import NetworkThread
+from test_framework.p2p import MAGIC_BYTES, NetworkThread
 from test_framework.psbt import (
     PSBT,
     PSBT_GLOBAL_UNSIGNED_TX,
@@ -41,7 +42,10 @@ from test_framework.psbt import (
     PSBT_IN_NON_WITNESS_UTXO,
     PSBT_IN_SIGHASH_TYPE,
     PSBTMap,
+    combine_psbts,
+    finalize_input,
 )
+from test_framework.reward_cache import RewardCache
 from test_framework.script import CScriptOp
 from test_framework.test_framework import (
     TMPDIR_PREFIX,
@@ -174,6 +178,58 @@ class Commander(BitcoinTestFramework):
             node.createwallet("miner", descriptors=True)
         return node.get_wallet_rpc("miner")
 
+    @staticmethod
+    def sign_psbt(signers, psbt):
+        """Sign a base64 PSBT with the wallets of several tanks at once.
+
+        Every signer is asked for its partial signatures concurrently, so a multisig signet
+        challenge costs about one signing round trip. The signatures are combined and the
+        input finalized locally. Returns the signed PSBT object, or None if the signers'
+        signatures don't complete it."""
+        if len(signers) == 1:
+            signed = signers[0].walletprocesspsbt(psbt=psbt, sign=True, sighashtype="ALL")
+            return PSBT.from_base64(signed["psbt"]) if signed.get("complete", False) else None
+        partial = []
+
+        def sign(signer):
+            try:
+                signed = signer.walletprocesspsbt(
+                    psbt=psbt, sign=True, sighashtype="ALL", finalize=False
+                )
+                partial.append(PSBT.from_base64(signed["psbt"]))
+            except Exception as e:
+                logging.getLogger("Commander").warning(f"PSBT signer failed: {e}")
+
+        sign_threads = [threading.Thread(target=sign, args=(signer,)) for signer in signers]
+        for thread in sign_threads:
+            thread.start()
+        all(thread.join() is None for thread in sign_threads)
+        if not partial:
+            return None
+        combined = combine_psbts(partial)
+        return combined if all(finalize_input(combined, i) for i in range(len(combined.i))) else None
+
+    @staticmethod
+    def read_configmap(name):
+        """Return the data of a ConfigMap in the commander's namespace, or None if there is none."""
+        try:
+            return sclient.read_namespaced_config_map(name=name, namespace=NAMESPACE).data or {}
+        except client.exceptions.ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    @staticmethod
+    def write_configmap(name, data):
+        """Create or replace a ConfigMap in the commander's namespace."""
+        body = client.V1ConfigMap(metadata=client.V1ObjectMeta(name=name), data=data)
+        try:
+            sclient.replace_namespaced_config_map(name=name, namespace=NAMESPACE, body=body)
+        except client.exceptions.ApiException as e:
+            if e.status != 404:
+                raise
+            sclient.create_namespaced_config_map(namespace=NAMESPACE, body=body)
+
     @staticmethod
     def hex_to_b64(hex):
         return base64.b64encode(bytes.fromhex(hex)).decode()
@@ -185,6 +241,19 @@ class Commander(BitcoinTestFramework):
         else:
             return base64.b64decode(b64).hex()
 
+    @staticmethod
+    def p2p_target(node):
+        """Return the (host, port) of a tank's P2P listener.
+
+        On signet the network magic is derived from the tank's challenge
+        and registered in MAGIC_BYTES so P2PInterface can frame messages."""
+        if node.chain == "signet":
+            challenge = node.getblocktemplate({"rules": ["segwit", "signet"]})["signet_challenge"]
+            challenge_bytes = bytes.fromhex(challenge)
+            MAGIC_BYTES["signet"] = hash256(ser_string(challenge_bytes))[0:4]
+            return node.rpchost, 38333
+        return node.rpchost, 18444
+
     def wait_for_tanks_connected(self):
         def tank_connected(self, tank):
             while True:
@@ -233,6 +302,9 @@ class Commander(BitcoinTestFramework):
         ch.setFormatter(ColorFormatter())
         self.log.addHandler(ch)
 
+        # Reward scriptPubKeys for generatetoaddress on signet, by address
+        self.reward_caches = {}
+
         # Keep a separate index of tanks by pod name
         self.tanks: dict[str, TestNode] = {}
         self.lns: dict[str, LNNode] = {}
@@ -539,7 +611,7 @@ class Commander(BitcoinTestFramework):
             == to_num_peers
         )
 
-    def generatetoaddress(self, generator, n, addr, sync_fun=None, **kwargs):
+    def generatetoaddress(self, generator, n, addr, sync_fun=None, signers=None, **kwargs):
         if generator.chain == "regtest":
             blocks = generator.generatetoaddress(n, addr, invalid_call=False, **kwargs)
             sync_fun() if sync_fun else self.sync_all()
@@ -551,11 +623,13 @@ class Commander(BitcoinTestFramework):
             def bcli(method, *args, **kwargs):
                 return generator.__getattr__(method)(*args, **kwargs)
 
+            if addr not in self.reward_caches:
+                self.reward_caches[addr] = RewardCache(bcli, address=addr)
             while mined_blocks < n:
                 # gbt
                 tmpl = bcli("getblocktemplate", {"rules": ["signet", "segwit"]})
                 # address for reward
-                reward_spk = bytes.fromhex(bcli("getaddressinfo", addr)["scriptPubKey"])
+                _, reward_spk = self.reward_caches[addr].get(tmpl["height"])
                 # create coinbase tx
                 cbtx = CTransaction()
                 cbtx.vin = [
@@ -631,13 +705,11 @@ class Commander(BitcoinTestFramework):
                 ]
                 psbt.o = [PSBTMap()]
                 psbt = psbt.to_base64()
-                # sign PSBT
-                psbt_signed = bcli("walletprocesspsbt", psbt=psbt, sign=True, sighashtype="ALL")
-                if not psbt_signed.get("complete", False):
+                # sign PSBT, with every tank holding keys for the signet challenge
+                signed_psbt = self.sign_psbt(signers or [generator], psbt)
+                if signed_psbt is None:
                     self.log.error("PSBT signing failed, aborting...")
                     return block_hashes
-                # decode signed PSBT
-                signed_psbt = PSBT.from_base64(psbt_signed["psbt"])
                 scriptSig = signed_psbt.i[0].map.get(PSBT_IN_FINAL_SCRIPTSIG, b"")
                 scriptWitness = signed_psbt.i[0].map.get(PSBT_IN_FINAL_SCRIPTWITNESS, b"\x00")
                 signed_block = from_binary(CBlock, signed_psbt.g.map[PSBT_SIGNET_BLOCK])
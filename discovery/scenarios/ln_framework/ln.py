@@ -2,37 +2,65 @@ import base64
 import http.client
 import json
 import logging
+import queue
 import ssl
 from abc import ABC, abstractmethod
 from time import sleep
 
 import requests
+from ln_framework.params import (  # noqa: F401 (re-exported)
+    CHANNEL_OPEN_START_HEIGHT,
+    CHANNEL_OPENS_PER_BLOCK,
+    FEE_RATE_DECREMENT,
+    MAX_FEE_RATE,
+)
 
 # Don't worry about lnd's self-signed certificates
 INSECURE_CONTEXT = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
 INSECURE_CONTEXT.check_hostname = False
 INSECURE_CONTEXT.verify_mode = ssl.CERT_NONE
 
-# These values may need to be tweaked depending on the network being deployed.
-# Currently passes all tests and ln_init succeeds on these examples:
-#  test/data/LN_10.json
-#  test/data/LN_50.json
-#  test/data/LN_100.json
-# If any values are changed, you may need to re-build network.yaml with import-network.
-# Issues I encountered while setting on these values:
-# - Too many blocks generated, ln_init takes too long
-# - TX that distributes miner funds to LN wallets exceeds standard weight limit
-# - Too many miner distribution TXs result in too-long-mempool-chain
-# - Not enough UTXO value, forcing LN nodes to combine UTXOs to open large channels
-#   which results in the change output being too big which results in the tx
-#   outputs being ordered unexpectedly (which change at 0 and channel open at 1)
-# - LND actual fee rate ends up way off from the expected value
-# LN networks with more than 100 nodes and 500 channels may also need to tweak ln_init.py
-CHANNEL_OPEN_START_HEIGHT = 500
-CHANNEL_OPENS_PER_BLOCK = 200
-MAX_FEE_RATE = 80006  # s/vB
-FEE_RATE_DECREMENT = 400
-assert MAX_FEE_RATE - (FEE_RATE_DECREMENT * CHANNEL_OPENS_PER_BLOCK) > 1
+
+# Largest read from a REST response at once
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_chunks(res):
+    """Yield an HTTP response body in chunks, as soon as each one arrives.
+
+    Like reading byte by byte, this stops quietly when the connection times out or drops,
+    which is how streaming endpoints end."""
+    while True:
+        try:
+            data = res.read1(READ_CHUNK_SIZE)
+        except Exception:
+            break
+        if not data:
+            break
+        yield data
+
+
+def iter_lines(res):
+    """Yield the newline-delimited lines of an HTTP response body (without the newline)."""
+    pending = []
+    for data in iter_chunks(res):
+        start = 0
+        while (end := data.find(b"\n", start)) >= 0:
+            pending.append(data[start:end])
+            yield b"".join(pending)
+            pending = []
+            start = end + 1
+        pending.append(data[start:])
+    if any(pending):
+        yield b"".join(pending)
+
+
+def read_response(res, wait_for_completion=True):
+    """Return the response body as a string, or only its first line if not
+    wait_for_completion."""
+    if not wait_for_completion:
+        return next(iter_lines(res), b"").decode("utf8")
+    return b"".join(iter_chunks(res)).decode("utf8")
 
 
 # https://github.com/lightningcn/lightning-rfc/blob/master/07-routing-gossip.md#the-channel_update-message
@@ -100,11 +128,16 @@ class Policy:
 
 
 class LNNode(ABC):
+    # REST API port, set by the implementations
+    port = None
+
     @abstractmethod
     def __init__(self, pod_name, pod_namespace, ip_address):
         self.name = pod_name
         self.namespace = pod_namespace
         self.ip_address = ip_address
+        # Idle keep-alive connections, so requests don't pay for a TLS handshake each time
+        self.connections = queue.LifoQueue()
         self.log = logging.getLogger(pod_name)
         handler = logging.StreamHandler()
         formatter = logging.Formatter("%(name)-8s - %(levelname)s: %(message)s")
@@ -112,6 +145,61 @@ class LNNode(ABC):
         self.log.addHandler(handler)
         self.log.setLevel(logging.INFO)
 
+    def new_connection(self):
+        return http.client.HTTPSConnection(
+            host=f"{self.name}.{self.namespace}", port=self.port, timeout=60, context=INSECURE_CONTEXT
+        )
+
+    def reset_connection(self):
+        """Close the pooled connections, later requests open new ones."""
+        while True:
+            try:
+                self.connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def request(self, method, uri, body=None, headers=None, wait_for_completion=True):
+        """Send a request over a pooled connection and return (HTTP status, body).
+
+        Connections go back to the pool once their response has been read to the end. If a
+        reused connection turns out to have been closed by the node, the request is sent
+        again on another one, but only when the node can't have acted on it already: the
+        request failed to go out, or it is a GET that failed without timing out."""
+        while True:
+            try:
+                conn, reused = self.connections.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self.new_connection(), False
+            try:
+                conn.request(method=method, url=uri, body=body, headers=headers or {})
+            except (BrokenPipeError, ConnectionResetError):
+                # The request never reached the node
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+            try:
+                res = conn.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # A POST may have been acted on before the connection dropped
+                if reused and method == "GET" and not isinstance(e, TimeoutError):
+                    continue
+                raise
+            # Stream output, otherwise we get a timeout error
+            response = read_response(res, wait_for_completion)
+            if res.isclosed() or res.length == 0:
+                # read1() doesn't mark a response with a Content-Length as done at its end
+                res.close()
+                self.connections.put(conn)
+            else:
+                # The body wasn't read to the end, so the connection can't be reused
+                conn.close()
+            return res.status, response
+
     @staticmethod
     def hex_to_b64(hex):
         return base64.b64encode(bytes.fromhex(hex)).decode()
@@ -143,6 +231,12 @@ class LNNode(ABC):
     def channel(self, pk, capacity, push_amt, fee_rate) -> dict:
         pass
 
+    @abstractmethod
+    def pending_channels(self) -> list:
+        """Channels this node opened that are waiting for their funding transaction to
+        confirm, as dicts with the peer's "pk", "capacity", "txid" and "outpoint"."""
+        pass
+
     @abstractmethod
     def graph(self) -> dict:
         pass
@@ -153,58 +247,37 @@ class LNNode(ABC):
 
 
 class CLN(LNNode):
+    port = 3010
+
     def __init__(self, pod_name, pod_namespace, ip_address):
         super().__init__(pod_name, pod_namespace, ip_address)
-        self.conn = None
         self.headers = {}
         self.impl = "cln"
-        self.reset_connection()
-
-    def reset_connection(self):
-        self.conn = http.client.HTTPSConnection(
-            host=f"{self.name}.{self.namespace}", port=3010, timeout=60, context=INSECURE_CONTEXT
-        )
 
     def setRune(self, rune):
         self.headers = {"Rune": rune}
 
+    def rune_request(self, method, uri, body=None, headers=None):
+        """Send a request with the cached rune, fetching a new one only if there is none
+        yet or the node rejects it."""
+        if "Rune" not in self.headers:
+            self.createrune()
+        status, response = self.request(method, uri, body, {**self.headers, **(headers or {})})
+        if status in (401, 403):
+            self.log.info(f"Rune rejected by {self.name}, fetching a new one")
+            self.createrune()
+            _, response = self.request(method, uri, body, {**self.headers, **(headers or {})})
+        return response
+
     def get(self, uri):
-        self.reset_connection()
         self.log.info(f"CLN GET headers: {self.headers}")
-        self.conn.request(
-            method="GET",
-            url=uri,
-            headers=self.headers,
-        )
-        return self.conn.getresponse().read().decode("utf8")
+        return self.rune_request("GET", uri)
 
     def post(self, uri, data=None):
         if not data:
             data = {}
         body = json.dumps(data)
-        post_header = self.headers
-        post_header["Content-Length"] = str(len(body))
-        post_header["Content-Type"] = "application/json"
-        self.reset_connection()
-        self.conn.request(
-            method="POST",
-            url=uri,
-            body=body,
-            headers=post_header,
-        )
-        # Stream output, otherwise we get a timeout error
-        res = self.conn.getresponse()
-        stream = ""
-        while True:
-            try:
-                data = res.read(1)
-                if len(data) == 0:
-                    break
-                else:
-                    stream += data.decode("utf8")
-            except Exception:
-                break
-        return stream
+        return self.rune_request("POST", uri, body, {"Content-Type": "application/json"})
 
     def createrune(self):
         while True:
@@ -219,7 +292,6 @@ class CLN(LNNode):
             return
 
     def newaddress(self):
-        self.createrune()
         response = self.post("/v1/newaddr", data={"addresstype": "p2tr"})
         res = json.loads(response)
         if "p2tr" in res:
@@ -259,6 +331,20 @@ class CLN(LNNode):
         res = json.loads(response)
         return {"txid": res["txid"], "outpoint": f"{res['txid']}:{res['outnum']}"}
 
+    def pending_channels(self) -> list:
+        response = self.post("/v1/listpeerchannels")
+        res = json.loads(response)
+        return [
+            {
+                "pk": ch["peer_id"],
+                "capacity": ch["total_msat"] // 1000,
+                "txid": ch["funding_txid"],
+                "outpoint": f"{ch['funding_txid']}:{ch['funding_outnum']}",
+            }
+            for ch in res["channels"]
+            if ch.get("opener") == "local" and ch.get("state", "").endswith("AWAITING_LOCKIN")
+        ]
+
     def createinvoice(self, sats, label) -> str:
         response = self.post("invoice", {"amount_msat": sats * 1000, "label": label})
         res = json.loads(response)
@@ -286,56 +372,23 @@ class CLN(LNNode):
 
 
 class LND(LNNode):
+    port = 8080
+
     def __init__(self, pod_name, pod_namespace, ip_address, admin_macaroon_hex):
         super().__init__(pod_name, pod_namespace, ip_address)
-        self.conn = None
         self.admin_macaroon_hex = admin_macaroon_hex
         self.headers = {
             "Grpc-Metadata-macaroon": admin_macaroon_hex,
-            "Connection": "close",
         }
         self.impl = "lnd"
 
-    def reset_connection(self):
-        self.conn = http.client.HTTPSConnection(
-            host=f"{self.name}.{self.namespace}", port=8080, timeout=60, context=INSECURE_CONTEXT
-        )
-
     def get(self, uri):
-        self.reset_connection()
-        self.conn.request(
-            method="GET",
-            url=uri,
-            headers=self.headers,
-        )
-        return self.conn.getresponse().read().decode("utf8")
+        return self.request("GET", uri, headers=self.headers)[1]
 
     def post(self, uri, data, wait_for_completion=True):
         body = json.dumps(data)
-        post_header = self.headers
-        post_header["Content-Length"] = str(len(body))
-        post_header["Content-Type"] = "application/json"
-        self.reset_connection()
-        self.conn.request(
-            method="POST",
-            url=uri,
-            body=body,
-            headers=post_header,
-        )
-        # Stream output, otherwise we get a timeout error
-        res = self.conn.getresponse()
-        stream = ""
-        while True:
-            try:
-                data = res.read(1)
-                if len(data) == 0:
-                    break
-                if not wait_for_completion and data.decode("utf8") == "\n":
-                    break
-                stream += data.decode("utf8")
-            except Exception:
-                break
-        return stream
+        post_header = {**self.headers, "Content-Type": "application/json"}
+        return self.request("POST", uri, body, post_header, wait_for_completion)[1]
 
     def newaddress(self):
         # Taproot signatures are a fixed length which improves
@@ -387,6 +440,23 @@ class LND(LNNode):
         res["outpoint"] = f"{res['txid']}:{res['result']['chan_pending']['output_index']}"
         return res
 
+    def pending_channels(self) -> list:
+        res = json.loads(self.get("/v1/channels/pending"))
+        pending = []
+        for pending_open in res.get("pending_open_channels", []):
+            ch = pending_open["channel"]
+            if ch.get("initiator") != "INITIATOR_LOCAL":
+                continue
+            pending.append(
+                {
+                    "pk": ch["remote_node_pub"],
+                    "capacity": int(ch["capacity"]),
+                    "txid": ch["channel_point"].split(":")[0],
+                    "outpoint": ch["channel_point"],
+                }
+            )
+        return pending
+
     def update(self, txid_hex: str, policy: dict, capacity: int):
         ln_policy = Policy.from_dict(policy).to_lnd_chanpolicy(capacity)
         data = {"chan_point": {"funding_txid_str": txid_hex, "output_index": 0}, **ln_policy}
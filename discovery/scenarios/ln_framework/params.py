@@ -0,0 +1,60 @@
+# Channel open parameters shared by ln_init.py and tools that build networks for it.
+# Unlike ln.py, this doesn't need requests or the REST/HTTP stack, only the in-tree
+# test_framework on sys.path.
+from test_framework.blocktools import COINBASE_MATURITY
+from test_framework.messages import COIN
+
+# These values may need to be tweaked depending on the network being deployed.
+# Currently passes all tests and ln_init succeeds on these examples:
+#  test/data/LN_10.json
+#  test/data/LN_50.json
+#  test/data/LN_100.json
+# If any values are changed, you may need to re-build network.yaml with import-network.
+# Issues I encountered while setting on these values:
+# - Too many blocks generated, ln_init takes too long
+# - TX that distributes miner funds to LN wallets exceeds standard weight limit
+# - Too many miner distribution TXs result in too-long-mempool-chain
+# - Not enough UTXO value, forcing LN nodes to combine UTXOs to open large channels
+#   which results in the change output being too big which results in the tx
+#   outputs being ordered unexpectedly (which change at 0 and channel open at 1)
+# - LND actual fee rate ends up way off from the expected value
+# LN networks with more than 100 nodes and 500 channels may also need to tweak ln_init.py
+CHANNEL_OPEN_START_HEIGHT = 500
+CHANNEL_OPENS_PER_BLOCK = 200
+MAX_FEE_RATE = 80006  # s/vB
+FEE_RATE_DECREMENT = 400
+assert MAX_FEE_RATE - (FEE_RATE_DECREMENT * CHANNEL_OPENS_PER_BLOCK) > 1
+
+# More than the vsize of a channel open spending one taproot UTXO, with change (about 154)
+CHANNEL_OPEN_TX_VSIZE = 200
+# LND refuses to pay more than this share of a transaction's outputs in fees
+LND_MAX_FEE_RATIO = 0.2
+
+# ln_init.py mines up to this height, then spends the miner's coins to fund the LN wallets
+# in the next block and confirms them in the one after
+FUNDING_TIP_HEIGHT = CHANNEL_OPEN_START_HEIGHT - 3
+# The regtest block subsidy halves every 150 blocks
+REGTEST_HALVING_INTERVAL = 150
+
+
+def channel_fee_rate(index):
+    """Fee rate of the channel open at an index in its block, highest first so the opens
+    are mined in index order."""
+    return MAX_FEE_RATE - index * FEE_RATE_DECREMENT
+
+
+def channel_funding(ch):
+    """Sats for the UTXO a channel is opened from: enough to pay the open's fee within
+    LND's maxFeeRatio, and leave change larger than the capacity, so the channel output
+    sorts first and ends up at output 0."""
+    fee = CHANNEL_OPEN_TX_VSIZE * channel_fee_rate(ch["id"]["index"])
+    return max(2 * (ch["capacity"] + fee), int(fee / LND_MAX_FEE_RATIO) + 2 * fee)
+
+
+def mature_regtest_subsidy(tip_height):
+    """Sats of block subsidy a wallet can spend at a tip height, like getbalance counts
+    it, if the wallet mined every block of the regtest chain."""
+    last_mature = tip_height - COINBASE_MATURITY
+    return sum(
+        (50 * COIN) >> (block // REGTEST_HALVING_INTERVAL) for block in range(1, last_mature + 1)
+    )
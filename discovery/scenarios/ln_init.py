@@ -1,27 +1,393 @@
 #!/usr/bin/env python3
 
+import json
+import os
+import random
 import threading
-from time import sleep
+from heapq import heapify, heappop, heappush
+from time import monotonic
 
 from commander import Commander
-from ln_framework.ln import (
-    CHANNEL_OPEN_START_HEIGHT,
+from ln_framework.ln import Policy
+from ln_framework.params import (
     CHANNEL_OPENS_PER_BLOCK,
-    FEE_RATE_DECREMENT,
-    MAX_FEE_RATE,
-    Policy,
+    FUNDING_TIP_HEIGHT,
+    channel_fee_rate,
+    channel_funding,
 )
 from test_framework.address import address_to_scriptpubkey
 from test_framework.messages import (
     COIN,
+    MAX_BLOCK_WEIGHT,
+    COutPoint,
     CTransaction,
+    CTxIn,
     CTxOut,
 )
 
+# Policy limit on the weight of a transaction relayed by Bitcoin Core
+MAX_STANDARD_TX_WEIGHT = 400000
+# Room left in a funding transaction for its input, change output and the rest
+FUNDING_TX_RESERVED_WEIGHT = 1000
+# Room left in a block for the coinbase (Bitcoin Core's default -blockmaxweight)
+MAX_FUNDING_BLOCK_WEIGHT = MAX_BLOCK_WEIGHT - 4000
+
+
+def shard_outputs(outputs, max_weight=MAX_STANDARD_TX_WEIGHT):
+    """Split a list of CTxOut into lists small enough to each go in a transaction with one
+    input and a change output without exceeding max_weight."""
+    shards = [[]]
+    weight = FUNDING_TX_RESERVED_WEIGHT
+    for out in outputs:
+        out_weight = 4 * len(out.serialize())
+        if shards[-1] and weight + out_weight > max_weight:
+            shards.append([])
+            weight = FUNDING_TX_RESERVED_WEIGHT
+        shards[-1].append(out)
+        weight += out_weight
+    return shards
+
+
+class Progressing(Exception):
+    """Raised by a StageRunner task that isn't done yet, but got further than on its
+    previous attempt. It is retried with its backoff reset."""
+
+
+class StageProgress:
+    """Counters for one stage of a StageRunner."""
+
+    def __init__(self, stage, total):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.running = 0
+        self.retries = 0
+        self.start = monotonic()
+
+    def summary(self):
+        elapsed = monotonic() - self.start
+        return (
+            f"{self.stage}: {self.done}/{self.total} done, {self.running} running, "
+            f"{self.retries} retries, {elapsed:.1f}s elapsed"
+        )
+
+
+class StageRunner:
+    """Runs a stage's task on every item with a bounded pool of worker threads.
+
+    A task is done when it returns. If it raises, it is retried after an exponential
+    backoff with jitter, so a node that isn't ready isn't hammered while the others go
+    ahead. AssertionErrors are not retried: they cancel the stage and run() raises them.
+    cancel() stops the current and all later stages."""
+
+    def __init__(self, log, concurrency, min_backoff, max_backoff, report_interval):
+        self.log = log
+        self.concurrency = concurrency
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.report_interval = report_interval
+        self.cancelled = threading.Event()
+        self.rng = random.Random()
+        # stage name -> StageProgress
+        self.progress = {}
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def backoff(self, attempt):
+        # The delay stops growing at max_backoff, so stop the exponent from overflowing
+        delay = min(self.max_backoff, self.min_backoff * 2 ** min(attempt, 32))
+        return delay / 2 + self.rng.random() * delay / 2
+
+    def run(self, stage, task, items, describe=str, status=None):
+        """Run task(item) for every item. `status`, if given, returns a string that is
+        added to the progress reports."""
+        items = list(items)
+        progress = StageProgress(stage, len(items))
+        self.progress[stage] = progress
+        # (ready at, sequence number, item, attempt)
+        pending = [(0, seq, item, 0) for seq, item in enumerate(items)]
+        heapify(pending)
+        cond = threading.Condition()
+        failures = []
+
+        def next_task():
+            with cond:
+                while not self.cancelled.is_set():
+                    if pending:
+                        wait = pending[0][0] - monotonic()
+                        if wait <= 0:
+                            progress.running += 1
+                            return heappop(pending)
+                        cond.wait(min(wait, 1))
+                    elif progress.running:
+                        # A running task may still be put back for a retry
+                        cond.wait(1)
+                    else:
+                        return None
+                return None
+
+        def worker():
+            while (entry := next_task()) is not None:
+                _, seq, item, attempt = entry
+                try:
+                    task(item)
+                    error = None
+                except Progressing as e:
+                    error = e
+                    attempt = 0
+                except AssertionError as e:
+                    failures.append(e)
+                    self.cancel()
+                    error = None
+                except Exception as e:
+                    error = e
+                with cond:
+                    progress.running -= 1
+                    if error is None:
+                        progress.done += 1
+                    else:
+                        delay = self.backoff(attempt)
+                        progress.retries += 1
+                        self.log.info(
+                            f"{stage}: {describe(item)} failed because {error}, "
+                            f"retrying in {delay:.1f} seconds..."
+                        )
+                        heappush(pending, (monotonic() + delay, seq, item, attempt + 1))
+                    cond.notify_all()
+
+        num_workers = min(self.concurrency, len(items))
+        workers = [threading.Thread(target=worker) for _ in range(num_workers)]
+        for thread in workers:
+            thread.start()
+        next_report = monotonic() + self.report_interval
+        for thread in workers:
+            while thread.is_alive():
+                thread.join(max(0, next_report - monotonic()))
+                if monotonic() >= next_report:
+                    self.report(progress, status)
+                    next_report += self.report_interval
+        if failures:
+            raise failures[0]
+        if self.cancelled.is_set():
+            raise Exception(f"{stage} cancelled with {progress.done} of {progress.total} done")
+        self.report(progress, status)
+        return progress
+
+    def report(self, progress, status):
+        self.log.info(progress.summary() + (f", {status()}" if status else ""))
+
+
+def channel_key(edge):
+    """Return the (block, tx index) of a graph edge's channel, from LND's numeric
+    channel_id or CLN's short_channel_id."""
+    if "short_channel_id" in edge:
+        block, index, _ = edge["short_channel_id"].split("x")
+        return int(block), int(index)
+    channel_id = int(edge["channel_id"])
+    return channel_id >> 40, (channel_id >> 16) & 0xFFFFFF
+
+
+def policy_pair(policy1, policy2, capacity):
+    """Comparable form of a channel's two policies, regardless of their direction."""
+    return tuple(
+        sorted(tuple(sorted(p.to_lnd_chanpolicy(capacity).items())) for p in (policy1, policy2))
+    )
+
+
+class GossipTracker:
+    """Follows how far every LN node's channel graph has converged to the expected one.
+
+    The expected channels and policies are indexed once. Every node's edges are
+    fingerprinted, so a poll only parses and compares the policies of edges that changed
+    since the node's previous poll."""
+
+    def __init__(self, channels, log):
+        self.lock = threading.Lock()
+        self.log = log
+        # (block, index) -> (capacity, expected policy pair or None)
+        self.expected = {}
+        for ch in channels:
+            policies = None
+            if "source_policy" in ch and "target_policy" in ch:
+                policies = policy_pair(
+                    Policy(**ch["source_policy"]), Policy(**ch["target_policy"]), ch["capacity"]
+                )
+            self.expected[(ch["id"]["block"], ch["id"]["index"])] = (ch["capacity"], policies)
+        # node name -> {channel key: (edge fingerprint, policies match, or None if unchecked)}
+        self.edges = {}
+        # (node name, channel key) of channels that aren't expected, logged once each
+        self.unexpected = set()
+
+    def check(self, ln, policies):
+        """Poll a node's graph and return how many expected channels it has, or (with
+        `policies`) how many of them also have the expected policies."""
+        edges = ln.graph()["edges"]
+        with self.lock:
+            known = self.edges.setdefault(ln.name, {})
+        current = {}
+        for edge in edges:
+            key = channel_key(edge)
+            if key not in self.expected:
+                # Not counted, but it may be some other channel the node knows of,
+                # so keep waiting for the expected ones rather than abort the run
+                with self.lock:
+                    new = (ln.name, key) not in self.unexpected
+                    self.unexpected.add((ln.name, key))
+                if new:
+                    self.log.warning(f"LN {ln.name} has unexpected channel {key}\n{edge}")
+                continue
+            fingerprint = hash(
+                repr((edge.get("capacity"), edge.get("node1_policy"), edge.get("node2_policy")))
+            )
+            cached = known.get(key)
+            if cached and cached[0] == fingerprint and (cached[1] is not None or not policies):
+                current[key] = cached
+                continue
+            capacity, expected_policies = self.expected[key]
+            # We assert this because it isn't updated as part of policy.
+            # If this fails we have a bigger issue
+            assert int(edge["capacity"]) == capacity, (
+                f"LN {ln.name} graph capacity mismatch:\n"
+                f" actual: {edge['capacity']}\n expected: {capacity}"
+            )
+            # None until the policies are checked
+            matches = None
+            if policies:
+                # Policies not defined in network.yaml match anything
+                matches = True
+                if expected_policies is not None:
+                    actual_policies = policy_pair(
+                        Policy.from_lnd_describegraph(edge["node1_policy"]),
+                        Policy.from_lnd_describegraph(edge["node2_policy"]),
+                        capacity,
+                    )
+                    matches = actual_policies == expected_policies
+            current[key] = (fingerprint, matches)
+        with self.lock:
+            self.edges[ln.name] = current
+        if policies:
+            return sum(bool(matches) for _, matches in current.values())
+        return len(current)
+
+    def convergence(self, policies):
+        """Return the share of (node, expected channel) pairs seen so far, as a string."""
+        with self.lock:
+            total = len(self.expected) * len(self.edges)
+            found = sum(
+                sum(bool(matches) or not policies for _, matches in edges.values())
+                for edges in self.edges.values()
+            )
+        return f"{100 * found / total:.1f}% converged" if total else "no graphs yet"
+
+
+class InitJournal:
+    """What an ln_init run has done so far, saved after every step so that a rerun can skip
+    it. Kept as JSON in a local file, or in a ConfigMap in the commander's namespace when
+    the location is "configmap:<name>". Without a location nothing is saved.
+
+    Channel opens come in too fast to rewrite the journal for each one, so they are saved
+    at most every FLUSH_INTERVAL seconds, and by flush()."""
+
+    CONFIGMAP = "configmap:"
+    FLUSH_INTERVAL = 5
+
+    def __init__(self, location):
+        self.location = location
+        # Guards data, held only briefly so the channel open threads don't wait on saves
+        self.lock = threading.Lock()
+        # Serializes saves, so a newer copy of the journal is never overwritten by an older
+        self.save_lock = threading.Lock()
+        self.data = (self.load() if location else None) or self.empty()
+        self.dirty = False
+        self.saved_at = monotonic()
+
+    @staticmethod
+    def empty():
+        # chain: hash of block 1, mined by ln_init, to recognize the chain the journal is for
+        # txids: the miner's funding transactions
+        # channels: {"block:index": {"txid", "outpoint"}} for every channel open sent
+        return {"chain": None, "stages": [], "txids": {}, "channels": {}}
+
+    def load(self):
+        if self.location.startswith(self.CONFIGMAP):
+            data = Commander.read_configmap(self.location[len(self.CONFIGMAP) :])
+            text = data.get("journal") if data else None
+        elif os.path.exists(self.location):
+            with open(self.location) as f:
+                text = f.read()
+        else:
+            text = None
+        return json.loads(text) if text else None
+
+    def save(self):
+        if not self.location:
+            return
+        with self.save_lock:
+            with self.lock:
+                text = json.dumps(self.data)
+                self.dirty = False
+                self.saved_at = monotonic()
+            if self.location.startswith(self.CONFIGMAP):
+                Commander.write_configmap(self.location[len(self.CONFIGMAP) :], {"journal": text})
+            else:
+                # Never leave a half written journal behind
+                with open(self.location + ".tmp", "w") as f:
+                    f.write(text)
+                os.replace(self.location + ".tmp", self.location)
+
+    def flush(self):
+        if self.dirty:
+            self.save()
+
+    def reset(self, chain):
+        with self.lock:
+            self.data = self.empty()
+            self.data["chain"] = chain
+        self.save()
+
+    def done(self, stage):
+        return stage in self.data["stages"]
+
+    def complete(self, stage):
+        with self.lock:
+            if stage in self.data["stages"]:
+                return
+            self.data["stages"].append(stage)
+        self.save()
+
+    def txid(self, name):
+        return self.data["txids"].get(name)
+
+    def record_txid(self, name, txid):
+        with self.lock:
+            self.data["txids"][name] = txid
+        self.save()
+
+    @staticmethod
+    def channel_name(ch):
+        return f"{ch['id']['block']}:{ch['id']['index']}"
+
+    def channel(self, ch):
+        return self.data["channels"].get(self.channel_name(ch))
+
+    def record_channel(self, ch):
+        with self.lock:
+            self.data["channels"][self.channel_name(ch)] = {
+                "txid": ch["txid"],
+                "outpoint": ch["outpoint"],
+            }
+            self.dirty = True
+            due = monotonic() - self.saved_at >= self.FLUSH_INTERVAL
+        if due:
+            self.save()
+
 
 class LNInit(Commander):
     def set_test_params(self):
         self.num_nodes = None
+        self.runner = None
+        self.journal = None
 
     def add_options(self, parser):
         parser.description = "Fund LN wallets and open channels"
@@ -32,8 +398,101 @@ class LNInit(Commander):
             type=str,
             help="Select one tank by name as the blockchain miner",
         )
+        parser.add_argument(
+            "--concurrency",
+            dest="concurrency",
+            default=32,
+            type=int,
+            help="Maximum number of LN node requests in flight in each stage (default 32)",
+        )
+        parser.add_argument(
+            "--min-backoff",
+            dest="min_backoff",
+            default=1,
+            type=float,
+            help="Seconds before the first retry of a failed request, doubling on each "
+            "retry (default 1)",
+        )
+        parser.add_argument(
+            "--max-backoff",
+            dest="max_backoff",
+            default=30,
+            type=float,
+            help="Longest wait in seconds between retries (default 30)",
+        )
+        parser.add_argument(
+            "--report-interval",
+            dest="report_interval",
+            default=30,
+            type=float,
+            help="Seconds between progress reports of a running stage (default 30)",
+        )
+        parser.add_argument(
+            "--journal",
+            dest="journal",
+            type=str,
+            help="Save progress to this file, or to a ConfigMap given as configmap:<name>, "
+            "and resume from it if it already holds the progress of an earlier run",
+        )
+
+    def handle_sigterm(self, signum, frame):
+        if self.runner:
+            self.runner.cancel()
+        if self.journal:
+            self.journal.flush()
+        super().handle_sigterm(signum, frame)
+
+    def run_stage(self, stage, task, items, **kwargs):
+        if self.journal.done(stage):
+            self.log.info(f"Skipping {stage}, already done according to the journal")
+            return
+        self.runner.run(stage, task, items, **kwargs)
+        self.journal.complete(stage)
+
+    def adopt_pending_opens(self, target_block, ch_jobs, mempool, ln_uris):
+        """Match channels about to be opened with their sources' pending channel opens
+        whose funding transaction is in the mempool. Records the matches in the journal
+        and returns the jobs of the channels that still need to be opened."""
+        pending = {}
+
+        def get_pending(source):
+            pending[source] = [
+                p for p in self.lns[source].pending_channels() if p["txid"] in mempool
+            ]
+
+        sources = sorted({ch["source"] for ch, _ in ch_jobs})
+        self.runner.run(f"pending channel opens before block {target_block}", get_pending, sources)
+        jobs = []
+        for ch, fee_rate in ch_jobs:
+            tgt_pk = ln_uris[ch["target"]].split("@")[0]
+            match = next(
+                (
+                    p
+                    for p in pending[ch["source"]]
+                    if p["pk"] == tgt_pk and p["capacity"] == ch["capacity"]
+                ),
+                None,
+            )
+            if match is None:
+                jobs.append((ch, fee_rate))
+                continue
+            pending[ch["source"]].remove(match)
+            ch["txid"] = match["txid"]
+            ch["outpoint"] = match["outpoint"]
+            self.journal.record_channel(ch)
+            self.log.info(f"Channel open {match['txid']} was sent but not journaled, keeping it")
+        self.journal.flush()
+        return jobs
 
     def run_test(self):
+        self.runner = StageRunner(
+            self.log,
+            self.options.concurrency,
+            self.options.min_backoff,
+            self.options.max_backoff,
+            self.options.report_interval,
+        )
+
         ##
         # L1 P2P
         ##
@@ -63,108 +522,156 @@ class LNInit(Commander):
             mining_tank.rpc_timeout = 6000
             return self.generatetoaddress(mining_tank, n, miner_addr, sync_fun=self.no_op)
 
-        self.log.info("Locking out of IBD...")
-        gen(1)
+        self.journal = InitJournal(self.options.journal)
+        if self.journal.data["chain"]:
+            if (
+                mining_tank.getblockcount() >= 1
+                and mining_tank.getblockhash(1) == self.journal.data["chain"]
+            ):
+                self.log.info(f"Resuming from journal, done: {self.journal.data['stages']}")
+            else:
+                self.log.warning("Journal is from another chain, starting over")
+                self.journal.reset(None)
 
-        ##
-        # WALLET ADDRESSES
-        ##
-        self.log.info("Getting LN wallet addresses...")
-        ln_addrs = {}
+        if not self.journal.data["chain"]:
+            self.log.info("Locking out of IBD...")
+            gen(1)
+            self.journal.reset(mining_tank.getblockhash(1))
 
-        def get_ln_addr(self, ln):
-            while True:
-                try:
-                    address = ln.newaddress()
-                    ln_addrs[ln.name] = address
-                    self.log.info(f"Got wallet address {address} from {ln.name}")
-                    break
-                except Exception as e:
-                    self.log.info(
-                        f"Couldn't get wallet address from {ln.name} because {e}, retrying in 5 seconds..."
-                    )
-                    sleep(5)
-
-        addr_threads = [
-            threading.Thread(target=get_ln_addr, args=(self, ln)) for ln in self.lns.values()
-        ]
-        for thread in addr_threads:
-            thread.start()
+        def confirmed(txid):
+            return miner.gettransaction(txid)["confirmations"] > 0
 
-        all(thread.join() is None for thread in addr_threads)
-        self.log.info(f"Got {len(ln_addrs)} addresses from {len(self.lns)} LN nodes")
-
-        ##
-        # FUNDS
-        ##
-        self.log.info("Funding LN wallets...")
-        # One past block generated already to lock out IBD
-        # One next block to consolidate the miner's coins
-        # One next block to confirm the distributed coins
-        # Then the channel open TXs go in the expected block height
-        gen(CHANNEL_OPEN_START_HEIGHT - 4)
-        # divvy up the goods, except fee.
-        # Multiple UTXOs per LN wallet so multiple channels can be opened per block
-        miner_balance = int(miner.getbalance())
-        # To reduce individual TX weight, consolidate all outputs before distribution
-        miner.sendtoaddress(miner_addr, miner_balance - 1)
-        gen(1)
-        helicopter = CTransaction()
-
-        # Provide the source LN node for each channel with a UTXO just big enough
-        # to open that channel with its capacity plus fee.
+        # The source LN node of each channel needs a UTXO to open it with
         channel_openers = []
         for ch in self.channels:
             if ch["source"] not in channel_openers:
                 channel_openers.append(ch["source"])
-            addr = ln_addrs[ch["source"]]
-            # More than enough to open the channel plus fee and cover LND's "maxFeeRatio"
-            # As long as all channel capacities are < 4 BTC the change output will be
-            # larger and occupy tx output 1, leaving the actual channel open at output 0
-            sat_amt = 10 * COIN
-            helicopter.vout.append(CTxOut(sat_amt, address_to_scriptpubkey(addr)))
-        rawtx = miner.fundrawtransaction(helicopter.serialize().hex())
-        signed_tx = miner.signrawtransactionwithwallet(rawtx["hex"])["hex"]
-        txid = miner.sendrawtransaction(signed_tx)
-        # confirm funds in last block before channel opens
-        gen(1)
-
-        txstats = miner.gettransaction(txid)
-        self.log.info(
-            "Funds distribution from miner:\n  "
-            + f"txid: {txid}\n  "
-            + f"# outputs: {len(txstats['details'])}\n  "
-            + f"total amount: {txstats['amount']}\n  "
-            + f"remaining miner balance: {miner.getbalance()}"
-        )
 
-        self.log.info("Waiting for funds to be spendable by channel-openers")
+        if not self.journal.done("funding"):
+            ##
+            # WALLET ADDRESSES
+            ##
+            self.log.info("Getting LN wallet addresses...")
+            ln_addrs = {}
 
-        def confirm_ln_balance(self, ln_name):
-            ln = self.lns[ln_name]
-            while True:
-                try:
-                    bal = ln.walletbalance()
-                    if bal >= 0:
-                        self.log.info(f"LN node {ln_name} confirmed funds")
-                        break
-                    else:
-                        self.log.info(f"Got 0 balance from {ln_name} retrying in 5 seconds...")
-                        sleep(5)
-                except Exception as e:
-                    self.log.info(
-                        f"Couldn't get balance from {ln_name} because {e}, retrying in 5 seconds..."
+            def get_ln_addr(ln):
+                address = ln.newaddress()
+                ln_addrs[ln.name] = address
+                self.log.info(f"Got wallet address {address} from {ln.name}")
+
+            self.runner.run(
+                "wallet addresses", get_ln_addr, self.lns.values(), describe=lambda ln: ln.name
+            )
+            self.log.info(f"Got {len(ln_addrs)} addresses from {len(self.lns)} LN nodes")
+
+            ##
+            # FUNDS
+            ##
+            self.log.info("Funding LN wallets...")
+            # One past block generated already to lock out IBD
+            # One next block to consolidate the miner's coins
+            # One next block to confirm the distributed coins
+            # Then the channel open TXs go in the expected block height
+            # Count from the current height, a resumed run may have mined some already
+            need = FUNDING_TIP_HEIGHT - mining_tank.getblockcount()
+            if need > 0:
+                gen(need)
+            # Provide the source LN node for each channel with a UTXO just big enough
+            # to open that channel with its capacity plus fee (see channel_funding).
+            # A node's channel opens may pick any of its UTXOs, so they are all as big
+            # as the node's largest one needs to be.
+            sat_amts = {}
+            for ch in self.channels:
+                sat_amts[ch["source"]] = max(sat_amts.get(ch["source"], 0), channel_funding(ch))
+            outputs = [
+                CTxOut(sat_amts[ch["source"]], address_to_scriptpubkey(ln_addrs[ch["source"]]))
+                for ch in self.channels
+            ]
+            # Too many outputs for one standard transaction are split over several
+            shards = shard_outputs(outputs)
+            # They are all confirmed in the one block before the channel opens
+            weight = sum(
+                FUNDING_TX_RESERVED_WEIGHT + sum(4 * len(out.serialize()) for out in shard)
+                for shard in shards
+            )
+            if weight > MAX_FUNDING_BLOCK_WEIGHT:
+                raise Exception(
+                    f"Funding {len(outputs)} channels takes {weight} WU, "
+                    f"more than fits in one block ({MAX_FUNDING_BLOCK_WEIGHT} WU)"
+                )
+
+            if not self.journal.txid("consolidation"):
+                # To reduce individual TX weight, consolidate the miner's coins before
+                # distribution, into one output to fund each shard (except fee)
+                total = sum(out.nValue for out in outputs) + len(shards) * COIN
+                miner_balance = miner.getbalance()
+                if total > miner_balance * COIN:
+                    raise Exception(
+                        f"Funding {len(outputs)} channels takes {total / COIN} BTC, "
+                        f"the miner only has {miner_balance} BTC"
                     )
-                    sleep(5)
+                miner_spk = address_to_scriptpubkey(miner_addr)
+                consolidation = CTransaction()
+                for shard in shards:
+                    amount = sum(out.nValue for out in shard) + COIN
+                    consolidation.vout.append(CTxOut(amount, miner_spk))
+                rawtx = miner.fundrawtransaction(
+                    consolidation.serialize().hex(), {"changePosition": len(shards)}
+                )
+                signed_tx = miner.signrawtransactionwithwallet(rawtx["hex"])["hex"]
+                txid = miner.sendrawtransaction(signed_tx)
+                self.journal.record_txid("consolidation", txid)
+            consolidation_txid = self.journal.txid("consolidation")
+            if not confirmed(consolidation_txid):
+                gen(1)
+
+            def send_shard(index):
+                name = f"helicopter {index}"
+                if self.journal.txid(name):
+                    return
+                # Each shard spends its own consolidated output, so they can all be
+                # funded, signed and broadcast at once without conflicting
+                helicopter = CTransaction()
+                helicopter.vin.append(CTxIn(COutPoint(int(consolidation_txid, 16), index)))
+                helicopter.vout = shards[index]
+                rawtx = miner.fundrawtransaction(
+                    helicopter.serialize().hex(),
+                    {"add_inputs": False, "changePosition": len(shards[index])},
+                )
+                signed_tx = miner.signrawtransactionwithwallet(rawtx["hex"])["hex"]
+                txid = miner.sendrawtransaction(signed_tx)
+                self.journal.record_txid(name, txid)
+                self.log.info(f"Sent {name} with {len(shards[index])} outputs: {txid}")
+
+            self.runner.run(
+                "funding transactions",
+                send_shard,
+                range(len(shards)),
+                describe=lambda index: f"helicopter {index}",
+            )
+            txids = [self.journal.txid(f"helicopter {index}") for index in range(len(shards))]
+            if not all(confirmed(txid) for txid in txids):
+                # confirm funds in last block before channel opens
+                gen(1)
+
+            self.log.info(
+                "Funds distribution from miner:\n  "
+                + f"# transactions: {len(txids)}\n  "
+                + f"# outputs: {len(outputs)}\n  "
+                + f"total amount: {sum(out.nValue for out in outputs) / COIN}\n  "
+                + f"remaining miner balance: {miner.getbalance()}"
+            )
+            self.journal.complete("funding")
 
-        fund_threads = [
-            threading.Thread(target=confirm_ln_balance, args=(self, ln_name))
-            for ln_name in channel_openers
-        ]
-        for thread in fund_threads:
-            thread.start()
+        self.log.info("Waiting for funds to be spendable by channel-openers")
+
+        def confirm_ln_balance(ln_name):
+            bal = self.lns[ln_name].walletbalance()
+            if bal < 0:
+                raise Exception(f"got balance {bal}")
+            self.log.info(f"LN node {ln_name} confirmed funds")
 
-        all(thread.join() is None for thread in fund_threads)
+        self.run_stage("wallet balances", confirm_ln_balance, channel_openers)
         self.log.info("All channel-opening LN nodes are funded")
 
         ##
@@ -173,26 +680,12 @@ class LNInit(Commander):
         self.log.info("Getting URIs for all LN nodes...")
         ln_uris = {}
 
-        def get_ln_uri(self, ln):
-            while True:
-                try:
-                    uri = ln.uri()
-                    ln_uris[ln.name] = uri
-                    self.log.info(f"LN node {ln.name} has URI {uri}")
-                    break
-                except Exception as e:
-                    self.log.info(
-                        f"Couldn't get URI from {ln.name} because {e}, retrying in 5 seconds..."
-                    )
-                    sleep(5)
-
-        uri_threads = [
-            threading.Thread(target=get_ln_uri, args=(self, ln)) for ln in self.lns.values()
-        ]
-        for thread in uri_threads:
-            thread.start()
+        def get_ln_uri(ln):
+            uri = ln.uri()
+            ln_uris[ln.name] = uri
+            self.log.info(f"LN node {ln.name} has URI {uri}")
 
-        all(thread.join() is None for thread in uri_threads)
+        self.runner.run("URIs", get_ln_uri, self.lns.values(), describe=lambda ln: ln.name)
         self.log.info("Got URIs from all LN nodes")
 
         ##
@@ -215,40 +708,24 @@ class LNInit(Commander):
             if (src, tgt) not in connections and (tgt, src) not in connections:
                 connections.append((src, tgt))
 
-        def connect_ln(self, pair):
-            while True:
-                try:
-                    res = pair[0].connect(ln_uris[pair[1].name])
-                    if res == {}:
-                        self.log.info(f"Connected LN nodes {pair[0].name} -> {pair[1].name}")
-                        break
-                    if "message" in res:
-                        if "already connected" in res["message"]:
-                            self.log.info(
-                                f"Already connected LN nodes {pair[0].name} -> {pair[1].name}"
-                            )
-                            break
-                        if "process of starting" in res["message"]:
-                            self.log.info(
-                                f"{pair[0].name} not ready for connections yet, wait and retry..."
-                            )
-                            sleep(5)
-                        else:
-                            raise Exception(res)
-                except Exception as e:
-                    self.log.info(
-                        f"Couldn't connect {pair[0].name} -> {pair[1].name} because {e}, retrying in 5 seconds..."
-                    )
-                    sleep(5)
-
-        p2p_threads = [
-            threading.Thread(target=connect_ln, args=(self, pair)) for pair in connections
-        ]
-        for thread in p2p_threads:
-            sleep(0.25)
-            thread.start()
-
-        all(thread.join() is None for thread in p2p_threads)
+        def connect_ln(pair):
+            res = pair[0].connect(ln_uris[pair[1].name])
+            if res == {}:
+                self.log.info(f"Connected LN nodes {pair[0].name} -> {pair[1].name}")
+                return
+            if "already connected" in res.get("message", ""):
+                self.log.info(f"Already connected LN nodes {pair[0].name} -> {pair[1].name}")
+                return
+            if "process of starting" in res.get("message", ""):
+                raise Exception(f"{pair[0].name} not ready for connections yet")
+            raise Exception(res)
+
+        self.run_stage(
+            "p2p connections",
+            connect_ln,
+            connections,
+            describe=lambda pair: f"{pair[0].name} -> {pair[1].name}",
+        )
         self.log.info("Established all LN p2p connections")
 
         ##
@@ -269,60 +746,92 @@ class LNInit(Commander):
         blocks = list(ch_by_block.keys())
         blocks = sorted(blocks)
 
+        def check_block(channels, block_hash):
+            block = self.nodes[0].getblock(block_hash)
+            block_txs = block["tx"]
+            block_height = block["height"]
+            for ch in channels:
+                assert ch["txid"] != "N/A", f"Channel:{ch} did not receive txid"
+                assert ch["id"]["block"] == block_height, f"Actual block:{block_height}\n{ch}"
+                assert block_txs[ch["id"]["index"]] == ch["txid"], (
+                    f"Actual txid:{block_txs[ch['id']['index']]}\n{ch}"
+                )
+
+        first_block = True
         for target_block in blocks:
+            channels = sorted(ch_by_block[target_block], key=lambda ch: ch["id"]["index"])
             # First make sure the target block is the next block
             current_height = self.nodes[0].getblockcount()
             need = target_block - current_height
             if need < 1:
-                raise Exception("Blockchain too long for deterministic channel ID")
+                # Unless an earlier run already opened all its channels in it
+                if not all(self.journal.channel(ch) for ch in channels):
+                    raise Exception("Blockchain too long for deterministic channel ID")
+                for ch in channels:
+                    ch.update(self.journal.channel(ch))
+                check_block(channels, self.nodes[0].getblockhash(target_block))
+                self.log.info(f"Channel opens in block {target_block} match the journal")
+                continue
             if need > 1:
                 gen(need - 1)
 
-            def open_channel(self, ch, fee_rate):
+            def open_channel(job):
+                ch, fee_rate = job
                 src = self.lns[ch["source"]]
                 tgt_uri = ln_uris[ch["target"]]
                 tgt_pk, _ = tgt_uri.split("@")
                 log = f"  {ch['source']} -> {ch['target']}\n  {ch['id']} fee: {fee_rate}"
-                while True:
-                    self.log.info(f"Sending channel open:\n{log}")
-                    try:
-                        res = src.channel(
-                            pk=tgt_pk,
-                            capacity=ch["capacity"],
-                            push_amt=ch["push_amt"],
-                            fee_rate=fee_rate,
-                        )
-                        ch["txid"] = res["txid"]
-                        ch["outpoint"] = res["outpoint"]
-                        self.log.info(
-                            f"Channel open success:\n{log}\n  outpoint: {res['outpoint']}"
-                        )
-                        break
-                    except Exception as e:
-                        self.log.info(
-                            f"Couldn't open channel:\n{log}\n  {e}\n  Retrying in 5 seconds..."
-                        )
-                        sleep(5)
+                self.log.info(f"Sending channel open:\n{log}")
+                res = src.channel(
+                    pk=tgt_pk,
+                    capacity=ch["capacity"],
+                    push_amt=ch["push_amt"],
+                    fee_rate=fee_rate,
+                )
+                ch["txid"] = res["txid"]
+                ch["outpoint"] = res["outpoint"]
+                self.journal.record_channel(ch)
+                self.log.info(f"Channel open success:\n{log}\n  outpoint: {res['outpoint']}")
 
-            channels = sorted(ch_by_block[target_block], key=lambda ch: ch["id"]["index"])
             if len(channels) > CHANNEL_OPENS_PER_BLOCK:
                 raise Exception(
                     f"Too many channels in block {target_block}: {len(channels)} / Maximum: {CHANNEL_OPENS_PER_BLOCK}"
                 )
+            # Channels opened by an earlier run count only if their open is still waiting
+            # in the mempool, otherwise they are opened again
+            mempool = set(self.nodes[0].getrawmempool())
             index = 0
-            fee_rate = MAX_FEE_RATE
-            ch_threads = []
+            ch_jobs = []
             for ch in channels:
                 index += 1  # noqa
-                fee_rate -= FEE_RATE_DECREMENT
+                fee_rate = channel_fee_rate(index)
                 assert index == ch["id"]["index"], "Channel ID indexes are not consecutive"
                 assert fee_rate >= 1, "Too many TXs in block, out of fee range"
-                t = threading.Thread(target=open_channel, args=(self, ch, fee_rate))
-                sleep(0.25)
-                t.start()
-                ch_threads.append(t)
-
-            all(thread.join() is None for thread in ch_threads)
+                record = self.journal.channel(ch)
+                if record and record["txid"] in mempool:
+                    ch.update(record)
+                else:
+                    if record:
+                        self.log.info(f"Channel open {record['txid']} is gone, opening again")
+                    ch_jobs.append((ch, fee_rate))
+            # The journal saves channel opens every FLUSH_INTERVAL seconds, so a killed run
+            # may have sent opens it never recorded. Earlier blocks are mined by now, so
+            # only the first block this run opens channels in can have them. Adopt those
+            # still in the mempool instead of funding the channel twice.
+            unrecorded = mempool - {ch["txid"] for ch in channels if "txid" in ch}
+            if first_block and ch_jobs and unrecorded:
+                ch_jobs = self.adopt_pending_opens(target_block, ch_jobs, unrecorded, ln_uris)
+            first_block = False
+
+            try:
+                self.runner.run(
+                    f"channel opens in block {target_block}",
+                    open_channel,
+                    ch_jobs,
+                    describe=lambda job: f"{job[0]['source']} -> {job[0]['target']}",
+                )
+            finally:
+                self.journal.flush()
             for ch in channels:
                 if ch["outpoint"][-2:] != ":0":
                     self.log.error(f"Channel open outpoint not tx output index 0\n  {ch}")
@@ -336,50 +845,41 @@ class LNInit(Commander):
             block_hash = gen(1)[0]
             self.log.info(f"Confirmed {len(channels)} channel opens in block {target_block}")
             self.log.info("Checking deterministic channel IDs in block...")
-            block = self.nodes[0].getblock(block_hash)
-            block_txs = block["tx"]
-            block_height = block["height"]
-            for ch in channels:
-                assert ch["txid"] != "N/A", f"Channel:{ch} did not receive txid"
-                assert ch["id"]["block"] == block_height, f"Actual block:{block_height}\n{ch}"
-                assert block_txs[ch["id"]["index"]] == ch["txid"], (
-                    f"Actual txid:{block_txs[ch['id']['index']]}\n{ch}"
-                )
+            check_block(channels, block_hash)
             self.log.info("👍")
 
-        gen(5)
+        if not self.journal.done("channel confirmations"):
+            gen(5)
+            self.journal.complete("channel confirmations")
         self.log.info(f"Confirmed {len(self.channels)} total channel opens")
 
         self.log.info("Waiting for channel announcement gossip...")
 
-        def ln_all_chs(self, ln):
-            expected = len(self.channels)
-            actual = 0
-            while actual != expected:
-                try:
-                    actual = len(ln.graph()["edges"])
-                    if actual == expected:
-                        self.log.info(f"LN {ln.name} has graph with all {expected} channels")
-                        break
-                    else:
-                        self.log.info(
-                            f"LN {ln.name} graph is incomplete - {actual} of {expected} channels, checking again in 5 seconds..."
-                        )
-                        sleep(5)
-                except Exception as e:
-                    self.log.info(
-                        f"Couldn't check graph from {ln.name} because {e}, retrying in 5 seconds..."
-                    )
-                    sleep(5)
-
-        ch_ann_threads = [
-            threading.Thread(target=ln_all_chs, args=(self, ln)) for ln in self.lns.values()
-        ]
-        for thread in ch_ann_threads:
-            sleep(0.25)
-            thread.start()
+        gossip = GossipTracker(self.channels, self.log)
+        last_seen = {}
 
-        all(thread.join() is None for thread in ch_ann_threads)
+        def wait_for_gossip(ln, policies):
+            expected = len(self.channels)
+            actual = gossip.check(ln, policies)
+            what = "channel policies" if policies else "channels"
+            if actual == expected:
+                self.log.info(f"LN {ln.name} has graph with all {expected} {what}")
+                return
+            progressed = actual > last_seen.get((ln.name, policies), 0)
+            last_seen[(ln.name, policies)] = actual
+            # Poll again soon while gossip is arriving, and back off (up to --max-backoff)
+            # once it stalls: describegraph is expensive on a large graph, and a stalled
+            # node is usually waiting on its peers' next gossip flush
+            error = Progressing if progressed else Exception
+            raise error(f"graph has {actual} of {expected} {what}")
+
+        self.run_stage(
+            "channel announcements",
+            lambda ln: wait_for_gossip(ln, False),
+            self.lns.values(),
+            describe=lambda ln: ln.name,
+            status=lambda: gossip.convergence(False),
+        )
         self.log.info("All LN nodes have complete graph")
 
         ##
@@ -387,126 +887,44 @@ class LNInit(Commander):
         ##
         self.log.info("Updating channel policies...")
 
-        def update_policy(self, ln, txid_hex, policy, capacity):
+        def update_policy(update):
+            ln, txid_hex, policy, capacity = update
             self.log.info(f"Sending update from {ln.name} for channel with outpoint: {txid_hex}:0")
-            res = None
-            while res is None:
-                try:
-                    res = ln.update(txid_hex, policy, capacity)
-                    if len(res["failed_updates"]) != 0:
-                        self.log.info(
-                            f" Failed updates: {res['failed_updates']}\n txid: {txid_hex}\n policy:{policy}\n retrying in 5 seconds..."
-                        )
-                        sleep(5)
-                        continue
-                    break
-                except Exception as e:
-                    self.log.info(
-                        f"Couldn't update channel policy for {ln.name} because {e}, retrying in 5 seconds..."
-                    )
-                    sleep(5)
+            res = ln.update(txid_hex, policy, capacity)
+            if len(res["failed_updates"]) != 0:
+                raise Exception(
+                    f"Failed updates: {res['failed_updates']}\n txid: {txid_hex}\n policy:{policy}"
+                )
 
-        update_threads = []
+        updates = []
         for ch in self.channels:
             if "source_policy" in ch:
-                ts = threading.Thread(
-                    target=update_policy,
-                    args=(
-                        self,
-                        self.lns[ch["source"]],
-                        ch["txid"],
-                        ch["source_policy"],
-                        ch["capacity"],
-                    ),
+                updates.append(
+                    (self.lns[ch["source"]], ch["txid"], ch["source_policy"], ch["capacity"])
                 )
-                sleep(0.25)
-                ts.start()
-                update_threads.append(ts)
             if "target_policy" in ch:
-                tt = threading.Thread(
-                    target=update_policy,
-                    args=(
-                        self,
-                        self.lns[ch["target"]],
-                        ch["txid"],
-                        ch["target_policy"],
-                        ch["capacity"],
-                    ),
+                updates.append(
+                    (self.lns[ch["target"]], ch["txid"], ch["target_policy"], ch["capacity"])
                 )
-                sleep(0.25)
-                tt.start()
-                update_threads.append(tt)
-        count = len(update_threads)
+        count = len(updates)
 
-        all(thread.join() is None for thread in update_threads)
+        self.run_stage(
+            "channel policy updates",
+            update_policy,
+            updates,
+            describe=lambda update: f"{update[0].name} {update[1]}:0",
+        )
         self.log.info(f"Sent {count} channel policy updates")
 
         self.log.info("Waiting for all channel policy gossip to synchronize...")
 
-        def policy_equal(pol1, pol2, capacity):
-            return pol1.to_lnd_chanpolicy(capacity) == pol2.to_lnd_chanpolicy(capacity)
-
-        def matching_graph(self, expected, ln):
-            done = False
-            while not done:
-                try:
-                    actual = ln.graph()["edges"]
-                except Exception as e:
-                    self.log.info(
-                        f"Couldn't get graph from {ln.name} because {e}, retrying in 5 seconds..."
-                    )
-                    sleep(5)
-                    continue
-
-                self.log.debug(f"LN {ln.name} channel graph edges: {actual}")
-                if len(actual) > 0:
-                    done = True
-                    assert len(expected) == len(actual), (
-                        f"Expected edges {len(expected)}, actual edges {len(actual)}\n{actual}"
-                    )
-                for i, actual_ch in enumerate(actual):
-                    expected_ch = expected[i]
-                    capacity = expected_ch["capacity"]
-                    # We assert this because it isn't updated as part of policy.
-                    # If this fails we have a bigger issue
-                    assert int(actual_ch["capacity"]) == capacity, (
-                        f"LN {ln.name} graph capacity mismatch:\n actual: {actual_ch['capacity']}\n expected: {capacity}"
-                    )
-
-                    # Policies were not defined in network.yaml
-                    if "source_policy" not in expected_ch or "target_policy" not in expected_ch:
-                        continue
-
-                    # policy actual/expected source/target
-                    polas = Policy.from_lnd_describegraph(actual_ch["node1_policy"])
-                    polat = Policy.from_lnd_describegraph(actual_ch["node2_policy"])
-                    poles = Policy(**expected_ch["source_policy"])
-                    polet = Policy(**expected_ch["target_policy"])
-                    # Allow policy swap when comparing channels
-                    if policy_equal(polas, poles, capacity) and policy_equal(
-                        polat, polet, capacity
-                    ):
-                        continue
-                    if policy_equal(polas, polet, capacity) and policy_equal(
-                        polat, poles, capacity
-                    ):
-                        continue
-                    done = False
-                if done:
-                    self.log.info(f"LN {ln.name} graph channel policies all match expected source")
-                else:
-                    sleep(5)
-
-        expected = sorted(self.channels, key=lambda ch: (ch["id"]["block"], ch["id"]["index"]))
-        policy_threads = [
-            threading.Thread(target=matching_graph, args=(self, expected, ln))
-            for ln in self.lns.values()
-        ]
-        for thread in policy_threads:
-            sleep(0.25)
-            thread.start()
-
-        all(thread.join() is None for thread in policy_threads)
+        self.run_stage(
+            "channel policy gossip",
+            lambda ln: wait_for_gossip(ln, True),
+            self.lns.values(),
+            describe=lambda ln: ln.name,
+            status=lambda: gossip.convergence(True),
+        )
         self.log.info("All LN nodes have matching graph!")
 
 
@@ -1,16 +1,28 @@
 #!/usr/bin/env python3
 
-from time import sleep
+import random
+from time import monotonic, sleep
 
+import yaml
 from commander import Commander
 
 
+def pool_hashrates(network_file, tank_names):
+    """Read the `hashrate` field of each tank's metadata in a network.yaml (as written by
+    generate_pool_network.py). Tanks without one get no hashrate."""
+    with open(network_file) as f:
+        network = yaml.safe_load(f)
+    metadata = {node["name"]: node.get("metadata") or {} for node in network["nodes"]}
+    return {name: float(metadata.get(name, {}).get("hashrate", 0)) for name in tank_names}
+
+
 class Miner:
-    def __init__(self, node, mature):
+    def __init__(self, node, mature, hashrate=1):
         self.node = node
         self.wallet = Commander.ensure_miner(self.node)
         self.addr = self.wallet.getnewaddress()
         self.mature = mature
+        self.hashrate = hashrate
 
 
 class MinerStd(Commander):
@@ -18,6 +30,7 @@ class MinerStd(Commander):
         # This is just a minimum
         self.num_nodes = 0
         self.miners = []
+        self.rng = random.Random()
 
     def add_options(self, parser):
         parser.description = "Generate blocks over time"
@@ -47,30 +60,83 @@ class MinerStd(Commander):
             type=str,
             help="Select one tank by name as the only miner",
         )
+        parser.add_argument(
+            "--schedule",
+            dest="schedule",
+            default="sequential",
+            choices=["sequential", "hashrate"],
+            help="sequential: each miner mines a block in turn, --interval apart. hashrate: "
+            "block times are exponentially distributed with mean --interval across the whole "
+            "network, and each block goes to a miner drawn by hashrate share (default sequential)",
+        )
+        parser.add_argument(
+            "--network-file",
+            dest="network_file",
+            default=None,
+            type=str,
+            help="network.yaml whose per-tank metadata `hashrate` sets the miners and their "
+            "shares for --schedule hashrate (default every miner gets an equal share)",
+        )
+
+    def mine(self, miner):
+        num = 1
+        if miner.mature:
+            num = 101
+            miner.mature = False
+        try:
+            self.generatetoaddress(miner.node, num, miner.addr, sync_fun=self.no_op)
+            height = miner.node.getblockcount()
+            self.log.info(
+                f"generated {num} block(s) from node {miner.node.index}. New chain height: {height}"
+            )
+        except Exception as e:
+            self.log.error(f"node {miner.node.index} error: {e}")
+
+    def run_hashrate_schedule(self):
+        """Mine like a network of competing miners: block arrivals are a Poisson process
+        with mean interval --interval, and each block is found by a miner drawn in proportion
+        to its hashrate. Miners on different tanks can find blocks before the previous one
+        reached them, so short intervals produce natural forks."""
+        for miner in self.miners:
+            if miner.mature:
+                self.mine(miner)
+        total = sum(miner.hashrate for miner in self.miners)
+        for miner in self.miners:
+            self.log.info(
+                f"node {miner.node.index} ({miner.node.tank}) has {miner.hashrate / total:.1%} "
+                "of the hashrate"
+            )
+        weights = [miner.hashrate for miner in self.miners]
+        next_at = monotonic()
+        while True:
+            # Schedule against a deadline so slow RPCs don't stretch the mean interval; a
+            # block that's overdue is mined right away.
+            next_at += self.rng.expovariate(1 / self.options.interval)
+            sleep(max(0, next_at - monotonic()))
+            self.mine(self.rng.choices(self.miners, weights=weights)[0])
 
     def run_test(self):
         self.log.info("Starting miners.")
+        self.rng = random.Random(self.options.randomseed)
         if self.options.tank:
             self.miners = [Miner(self.tanks[self.options.tank], self.options.mature)]
+        elif self.options.schedule == "hashrate" and self.options.network_file:
+            hashrates = pool_hashrates(self.options.network_file, [n.tank for n in self.nodes])
+            for node in self.nodes:
+                if hashrates[node.tank] > 0:
+                    self.miners.append(Miner(node, self.options.mature, hashrates[node.tank]))
+            assert self.miners, f"no tank has a hashrate in {self.options.network_file}"
         else:
             max_miners = len(self.nodes) if self.options.allnodes else 1
             for index in range(max_miners):
                 self.miners.append(Miner(self.nodes[index], self.options.mature))
 
+        if self.options.schedule == "hashrate":
+            self.run_hashrate_schedule()
+
         while True:
             for miner in self.miners:
-                num = 1
-                if miner.mature:
-                    num = 101
-                    miner.mature = False
-                try:
-                    self.generatetoaddress(miner.node, num, miner.addr, sync_fun=self.no_op)
-                    height = miner.node.getblockcount()
-                    self.log.info(
-                        f"generated {num} block(s) from node {miner.node.index}. New chain height: {height}"
-                    )
-                except Exception as e:
-                    self.log.error(f"node {miner.node.index} error: {e}")
+                self.mine(miner)
                 sleep(self.options.interval)
 
 
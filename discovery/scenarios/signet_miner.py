@@ -25,6 +25,7 @@ import subprocess
 from test_framework.blocktools import get_witness_script, script_BIP34_coinbase_height # noqa: E402
 from test_framework.messages import CBlock, CBlockHeader, COutPoint, CTransaction, CTxIn, CTxInWitness, CTxOut, from_binary, from_hex, ser_string, ser_uint256, tx_from_hex # noqa: E402
 from test_framework.psbt import PSBT, PSBTMap, PSBT_GLOBAL_UNSIGNED_TX, PSBT_IN_FINAL_SCRIPTSIG, PSBT_IN_FINAL_SCRIPTWITNESS, PSBT_IN_NON_WITNESS_UTXO, PSBT_IN_SIGHASH_TYPE # noqa: E402
+from test_framework.reward_cache import RewardCache # noqa: E402
 from test_framework.script import CScriptOp # noqa: E402
 
 logging.basicConfig(
@@ -50,12 +51,21 @@ class SignetMinerScenario(Commander):
             type=int,
             help="Index of tank with wallet loaded for block signing",
         )
+        parser.add_argument(
+            "--signers",
+            dest="signers",
+            type=str,
+            default=None,
+            help="Comma-separated indices of more tanks whose wallets sign blocks along with --tank (for multisig signet challenges)",
+        )
         get_args(parser)
 
 
     def run_test(self):
         args = self.options
         args.bcli = lambda method, *args, **kwargs: self.nodes[self.options.tank].__getattr__(method)(*args, **kwargs)
+        if args.signers:
+            args.signer_nodes = [self.nodes[args.tank]] + [self.nodes[int(i)] for i in args.signers.split(",")]
         return do_generate(args)
 
 
@@ -166,41 +176,15 @@ def generate_psbt(tmpl, reward_spk, *, blocktime=None):
 
     return do_createpsbt(block, signme, spendme)
 
-def get_reward_address(args, height):
-    if args.address is not None:
-        return args.address
-
-    if '*' not in args.descriptor:
-        addr = args.bcli("deriveaddresses", args.descriptor)[0]
-        args.address = addr
-        return addr
-
-    remove = [k for k in args.derived_addresses.keys() if k+20 <= height]
-    for k in remove:
-        del args.derived_addresses[k]
-
-    addr = args.derived_addresses.get(height, None)
-    if addr is None:
-        addrs = args.bcli("deriveaddresses", args.descriptor, "[%d,%d]" % (height, height+20))
-        addr = addrs[0]
-        for k, a in enumerate(addrs):
-            args.derived_addresses[height+k] = a
-
-    return addr
-
 def get_reward_addr_spk(args, height):
     assert args.address is not None or args.descriptor is not None
 
-    if hasattr(args, "reward_spk"):
-        return args.address, args.reward_spk
+    # Resolves the address or descriptor locally where it can, and derives ranged
+    # descriptors ahead of the height, so most blocks need no RPC for this
+    if not hasattr(args, "reward_cache"):
+        args.reward_cache = RewardCache(args.bcli, address=args.address, descriptor=args.descriptor)
 
-    reward_addr = get_reward_address(args, height)
-    reward_spk = bytes.fromhex(args.bcli("getaddressinfo", reward_addr)["scriptPubKey"])
-    if args.address is not None:
-        # will always be the same, so cache
-        args.reward_spk = reward_spk
-
-    return reward_addr, reward_spk
+    return args.reward_cache.get(height)
 
 def do_genpsbt(args):
     tmpl = json.load(sys.stdin)
@@ -435,7 +419,12 @@ def do_generate(args):
         logging.debug("Mining block delta=%s start=%s mine=%s", seconds_to_hms(mine_time-bestheader["time"]), mine_time, is_mine)
         mined_blocks += 1
         psbt = generate_psbt(tmpl, reward_spk, blocktime=mine_time)
-        psbt_signed = args.bcli("walletprocesspsbt", psbt=psbt, sign=True, sighashtype="ALL")
+        if getattr(args, "signer_nodes", None):
+            # Sign with all the signers at once and combine their signatures locally
+            signed = Commander.sign_psbt(args.signer_nodes, psbt)
+            psbt_signed = {"complete": signed is not None, "psbt": signed.to_base64() if signed else None}
+        else:
+            psbt_signed = args.bcli("walletprocesspsbt", psbt=psbt, sign=True, sighashtype="ALL")
         if not psbt_signed.get("complete",False):
             logging.debug("Generated PSBT: %s" % (psbt,))
             sys.stderr.write("PSBT signing failed\n")
@@ -551,7 +540,6 @@ def get_args(parser):
         elif args.address is not None and args.descriptor is not None:
             sys.stderr.write("Only specify one of --address or --descriptor\n")
             return 1
-        args.derived_addresses = {}
 
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -3,9 +3,21 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Helper routines relevant for compact block filters (BIP158).
+
+Besides the helpers for hashing single elements, this contains a complete Golomb-coded set
+(GCS) implementation: BlockFilter builds the basic filter of a block from its elements,
+parses serialized filters, and matches watchlists of scripts against them.
 """
+from io import BytesIO
+import unittest
+
+from .messages import deser_compact_size, hash256, ser_compact_size
 from .siphash import siphash
 
+# BIP158 basic filter parameters
+BASIC_FILTER_P = 19
+BASIC_FILTER_M = 784931
+
 
 def bip158_basic_element_hash(script_pub_key, N, block_hash):
     """ Calculates the ranged hash of a filter element as defined in BIP158:
@@ -21,11 +33,18 @@ def bip158_basic_element_hash(script_pub_key, N, block_hash):
     little-endian representation) of the block for which the filter is constructed. This
     ensures the key is deterministic while still varying from block to block.'
     """
-    M = 784931
+    return bip158_element_hashes([script_pub_key], N, block_hash)[0]
+
+
+def bip158_element_hashes(elements, N, block_hash):
+    """ Calculates the ranged hashes of many filter elements at once, deriving the SipHash
+    key from the block hash only once.
+    """
     block_hash_bytes = bytes.fromhex(block_hash)[::-1]
     k0 = int.from_bytes(block_hash_bytes[0:8], 'little')
     k1 = int.from_bytes(block_hash_bytes[8:16], 'little')
-    return (siphash(k0, k1, script_pub_key) * (N * M)) >> 64
+    F = N * BASIC_FILTER_M
+    return [(siphash(k0, k1, element) * F) >> 64 for element in elements]
 
 
 def bip158_relevant_scriptpubkeys(node, block_hash):
@@ -47,3 +66,136 @@ def bip158_relevant_scriptpubkeys(node, block_hash):
             if o['scriptPubKey']['type'] != 'nulldata':
                 spks.add(bytes.fromhex(o['scriptPubKey']['hex']))
     return spks
+
+
+def golomb_rice_encode(sorted_values, P):
+    """Golomb-Rice encode the differences between consecutive sorted values.
+
+    Each difference is written as its quotient by 2^P in unary (ones terminated by a zero)
+    followed by the P-bit remainder, most significant bit first. The bit stream is padded
+    with zeros to a whole number of bytes."""
+    chunks = []
+    last = 0
+    remainder_format = f"0{P}b"
+    for value in sorted_values:
+        delta = value - last
+        last = value
+        chunks.append("1" * (delta >> P) + "0" + format(delta & ((1 << P) - 1), remainder_format))
+    bits = "".join(chunks)
+    if not bits:
+        return b""
+    nbytes = (len(bits) + 7) // 8
+    return int(bits.ljust(nbytes * 8, "0"), 2).to_bytes(nbytes, 'big')
+
+
+def golomb_rice_decode(data, N, P):
+    """Decode N Golomb-Rice coded differences and return the (sorted) values."""
+    bits = format(int.from_bytes(data, 'big'), f"0{len(data) * 8}b") if data else ""
+    values = []
+    pos = 0
+    last = 0
+    for _ in range(N):
+        # Quotient in unary: count the ones up to the terminating zero
+        end = bits.index("0", pos)
+        last += ((end - pos) << P) + int(bits[end + 1:end + 1 + P], 2)
+        values.append(last)
+        pos = end + 1 + P
+    return values
+
+
+class BlockFilter:
+    """A BIP158 basic block filter.
+
+    Elements are the scriptPubKeys a block spends and creates (see
+    bip158_relevant_scriptpubkeys), without duplicates and without empty scripts."""
+
+    def __init__(self, block_hash, elements=()):
+        self.block_hash = block_hash
+        elements = {e for e in elements if len(e) > 0}
+        self.N = len(elements)
+        self.encoded = golomb_rice_encode(sorted(bip158_element_hashes(elements, self.N, block_hash)), BASIC_FILTER_P)
+        self._hashes = None
+
+    @classmethod
+    def from_bytes(cls, block_hash, filter_bytes):
+        """Parse a serialized filter (as in cfilter messages or getblockfilter's "filter")."""
+        f = BytesIO(filter_bytes)
+        obj = cls(block_hash)
+        obj.N = deser_compact_size(f)
+        obj.encoded = f.read()
+        return obj
+
+    def serialize(self):
+        return ser_compact_size(self.N) + self.encoded
+
+    def hash(self):
+        """Return the filter hash, as hex."""
+        return hash256(self.serialize())[::-1].hex()
+
+    def header(self, prev_header):
+        """Return the filter header, given the previous block's filter header (both as hex)."""
+        return hash256(hash256(self.serialize()) + bytes.fromhex(prev_header)[::-1])[::-1].hex()
+
+    def hashes(self):
+        """Return the sorted ranged hashes in the filter, decoding it on first use."""
+        if self._hashes is None:
+            self._hashes = golomb_rice_decode(self.encoded, self.N, BASIC_FILTER_P)
+        return self._hashes
+
+    def match(self, element):
+        return self.match_any([element])
+
+    def match_any(self, elements):
+        """Check whether any of the given elements is (probably) in the filter.
+
+        The watchlist is hashed and sorted once and then merged with the filter's sorted
+        hashes, so matching costs one pass over both lists however long the watchlist is."""
+        if self.N == 0:
+            return False
+        queries = sorted(bip158_element_hashes(elements, self.N, self.block_hash))
+        hashes = self.hashes()
+        i = j = 0
+        while i < len(queries) and j < len(hashes):
+            if queries[i] == hashes[j]:
+                return True
+            if queries[i] < hashes[j]:
+                i += 1
+            else:
+                j += 1
+        return False
+
+
+def bip158_basic_filter(node, block_hash):
+    """ Builds the basic filter of a block from its relevant scriptPubKeys. """
+    return BlockFilter(block_hash, bip158_relevant_scriptpubkeys(node, block_hash))
+
+
+class TestFrameworkBlockFilter(unittest.TestCase):
+    def test_golomb_rice(self):
+        values = sorted({(i * 2654435761) % (1000 * BASIC_FILTER_M) for i in range(1000)})
+        self.assertEqual(golomb_rice_decode(golomb_rice_encode(values, BASIC_FILTER_P), len(values), BASIC_FILTER_P), values)
+        self.assertEqual(golomb_rice_encode([], BASIC_FILTER_P), b"")
+
+    def test_basic_filter(self):
+        # Test vector from BIP158 (testnet genesis block)
+        block_hash = "000000000933ea01ad0ee984209779baaec3ced90fa3f408719526f8d77f4943"
+        genesis_spk = bytes.fromhex("4104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac")
+        block_filter = BlockFilter(block_hash, [genesis_spk])
+        self.assertEqual(block_filter.serialize().hex(), "019dfca8")
+        self.assertEqual(block_filter.header("00" * 32), "21584579b7eb08997773e5aeff3a7f932700042d0ed2a6129012b7d7ae81b750")
+
+        parsed = BlockFilter.from_bytes(block_hash, bytes.fromhex("019dfca8"))
+        self.assertTrue(parsed.match(genesis_spk))
+        self.assertFalse(parsed.match(b"\x51"))
+
+    def test_match_any(self):
+        block_hash = "11" * 32
+        elements = [bytes([0x51, i & 0xff, i >> 8]) for i in range(500)]
+        block_filter = BlockFilter(block_hash, elements)
+        self.assertEqual(block_filter.N, 500)
+        parsed = BlockFilter.from_bytes(block_hash, block_filter.serialize())
+        for element in elements[::50]:
+            self.assertTrue(parsed.match_any([b"\x00" * 20, element]))
+        # With M = 784931 false positives are rare enough that this doesn't hit any.
+        self.assertFalse(parsed.match_any([bytes([0x52, i]) for i in range(100)]))
+        self.assertFalse(BlockFilter(block_hash).match_any(elements))
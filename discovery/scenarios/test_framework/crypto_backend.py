@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Registry of faster implementations for the test framework's crypto primitives.
+
+The pure Python implementations in ripemd160.py, siphash.py, muhash.py and secp256k1.py are
+easy to audit, but slow. Each of those modules passes its own implementation to select() at
+import time, which returns the first faster candidate from CANDIDATES that can be loaded and
+that agrees with the pure Python reference on the SELF_TEST inputs, or else the reference
+itself. Callers keep using the same functions, so nothing changes for them.
+
+Candidates come from the standard library (hashlib) or from optional packages that are used
+only when installed. Set BITCOIN_TEST_PURE_PYTHON_CRYPTO=1 to always use the references.
+
+Exports:
+* select(primitive, reference): pick the implementation to use for a primitive
+* active_backends(): map every selected primitive to the name of its backend
+"""
+
+import hashlib
+import importlib
+import os
+import random
+import unittest
+
+
+def _hashlib_ripemd160():
+    # Raises ValueError when the linked OpenSSL doesn't provide RIPEMD160 (e.g. OpenSSL 3
+    # without the legacy provider).
+    hashlib.new("ripemd160")
+    return lambda data: hashlib.new("ripemd160", data).digest()
+
+
+def _siphash24_siphash():
+    siphash24 = importlib.import_module("siphash24")
+
+    def siphash(k0, k1, data):
+        assert type(data) is bytes
+        key = k0.to_bytes(8, 'little') + k1.to_bytes(8, 'little')
+        return siphash24.siphash24(data, key=key).intdigest()
+    return siphash
+
+
+def _cryptography_chacha20():
+    ciphers = importlib.import_module("cryptography.hazmat.primitives.ciphers")
+
+    def chacha20_32_to_384(key32):
+        # A 16-byte all-zero nonce means block counter 0 and IV 0, like the reference.
+        encryptor = ciphers.Cipher(ciphers.algorithms.ChaCha20(bytes(key32), bytes(16)), mode=None).encryptor()
+        return encryptor.update(bytes(384))
+    return chacha20_32_to_384
+
+
+def _coincurve_pubkey():
+    coincurve = importlib.import_module("coincurve")
+    return lambda seckey: coincurve.PublicKey.from_secret(seckey).format(compressed=False)
+
+
+def _secp256k1_pubkey():
+    # The "secp256k1" package on PyPI (libsecp256k1 bindings), not test_framework.secp256k1
+    secp256k1 = importlib.import_module("secp256k1")
+    return lambda seckey: secp256k1.PrivateKey(seckey, raw=True).pubkey.serialize(compressed=False)
+
+
+# Faster candidates for every primitive, in order of preference. Each primitive has a fixed
+# interface, which the pure Python reference passed to select() implements as well:
+# * ripemd160(data) -> 20-byte digest
+# * siphash(k0, k1, data) -> 64-bit integer (SipHash-2-4 with key k0, k1)
+# * chacha20(key32) -> first 384 bytes of the ChaCha20 keystream for key32, with IV 0
+# * secp256k1(seckey) -> 65-byte uncompressed encoding of seckey * G, for 32-byte seckey
+CANDIDATES = {
+    "ripemd160": [("hashlib", _hashlib_ripemd160)],
+    "siphash": [("siphash24", _siphash24_siphash)],
+    "chacha20": [("cryptography", _cryptography_chacha20)],
+    "secp256k1": [("coincurve", _coincurve_pubkey), ("secp256k1", _secp256k1_pubkey)],
+}
+
+# Argument tuples on which a candidate must match the reference before it gets used
+SELF_TEST = {
+    "ripemd160": [(b"",), (b"abc",), (bytes(range(256)) * 3,)],
+    "siphash": [(0, 0, b""), (0x0706050403020100, 0x0f0e0d0c0b0a0908, bytes(range(15))),
+                (2**64 - 1, 1, bytes(range(64)))],
+    "chacha20": [(bytes(32),), (bytes(range(32)),)],
+    "secp256k1": [((1).to_bytes(32, 'big'),), (bytes(range(1, 33)),), (b"\x7f" + b"\xff" * 31,)],
+}
+
+# Selected implementations: primitive -> (backend name, implementation, reference)
+_ACTIVE = {}
+
+
+def select(primitive, reference):
+    """Return the implementation to use for a primitive, falling back to the given reference.
+
+    The choice is made on the first call for a primitive, and reused afterwards."""
+    if primitive not in _ACTIVE:
+        _ACTIVE[primitive] = ("python", reference, reference)
+        if not os.environ.get("BITCOIN_TEST_PURE_PYTHON_CRYPTO"):
+            for name, load in CANDIDATES.get(primitive, []):
+                try:
+                    impl = load()
+                    if all(impl(*args) == reference(*args) for args in SELF_TEST[primitive]):
+                        _ACTIVE[primitive] = (name, impl, reference)
+                        break
+                except Exception:
+                    # Not installed, not supported by this build, or an incompatible API
+                    continue
+    return _ACTIVE[primitive][1]
+
+
+def active_backends():
+    """Return a dict mapping every primitive selected so far to the name of its backend."""
+    return {primitive: name for primitive, (name, _, _) in _ACTIVE.items()}
+
+
+class TestFrameworkCryptoBackend(unittest.TestCase):
+    def test_backends_match_reference(self):
+        """Check every selected backend against its reference on random inputs."""
+        # Importing these modules registers all primitives.
+        from test_framework import muhash, ripemd160, secp256k1, siphash  # noqa: F401
+        self.assertEqual(set(active_backends()), set(CANDIDATES))
+        inputs = {
+            "ripemd160": lambda: (random.randbytes(random.randrange(200)),),
+            "siphash": lambda: (random.getrandbits(64), random.getrandbits(64), random.randbytes(random.randrange(100))),
+            "chacha20": lambda: (random.randbytes(32),),
+            "secp256k1": lambda: (random.randrange(1, secp256k1.GE.ORDER).to_bytes(32, 'big'),),
+        }
+        for primitive, (_, impl, reference) in _ACTIVE.items():
+            for _ in range(5):
+                args = inputs[primitive]()
+                self.assertEqual(impl(*args), reference(*args))
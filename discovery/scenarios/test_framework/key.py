@@ -264,6 +264,74 @@ def verify_schnorr(key, sig, msg):
         return False
     return True
 
+def verify_schnorr_batch(items):
+    """Verify a batch of Schnorr signatures (see BIP 340, "Batch Verification").
+
+    - items is a sequence of (key, sig, msg) tuples, as accepted by verify_schnorr.
+
+    All signature equations s*G = R + e*P are combined into a single multi-scalar
+    multiplication using random weights, which holds (except with negligible probability)
+    only if every signature in the batch is valid. If the combined check fails, the batch
+    is split in halves recursively to pinpoint the invalid signatures.
+
+    Returns (all_valid, results), with results[i] telling whether items[i] is valid.
+    """
+    items = list(items)
+    results = [True] * len(items)
+    # Decode every item into (key, R, s, e), or mark it invalid right away.
+    parsed = []
+    for i, (key, sig, msg) in enumerate(items):
+        assert len(key) == 32
+        assert len(msg) == 32
+        assert len(sig) == 64
+        P = secp256k1.GE.from_bytes_xonly(key)
+        R = secp256k1.GE.from_bytes_xonly(sig[0:32])
+        s = int.from_bytes(sig[32:64], 'big')
+        if P is None or R is None or s >= ORDER:
+            results[i] = False
+            continue
+        e = int.from_bytes(TaggedHash("BIP0340/challenge", sig[0:32] + key + msg), 'big') % ORDER
+        parsed.append((i, key, P, R, s, e))
+
+    def batch_valid(batch):
+        # Check sum(a_i*s_i)*G - sum(a_i*R_i) - sum(a_i*e_i*P_i) == infinity, with a_1 = 1 and
+        # 128-bit random a_i otherwise. Terms for repeated public keys are merged.
+        s_sum = 0
+        r_terms = []
+        p_terms = {}
+        for n, (_, key, P, R, s, e) in enumerate(batch):
+            a = 1 if n == 0 else random.randrange(1, 2**128)
+            s_sum += a * s
+            r_terms.append((-a, R))
+            p_scalar, _ = p_terms.get(key, (0, P))
+            p_terms[key] = (p_scalar - a * e, P)
+        return secp256k1.GE.mul((s_sum, secp256k1.G), *r_terms, *p_terms.values()).infinity
+
+    def find_invalid(batch):
+        if batch_valid(batch):
+            return
+        if len(batch) == 1:
+            results[batch[0][0]] = False
+            return
+        mid = len(batch) // 2
+        find_invalid(batch[:mid])
+        find_invalid(batch[mid:])
+
+    if parsed:
+        find_invalid(parsed)
+    return all(results), results
+
+def verify_ecdsa_batch(items, low_s=True):
+    """Verify a batch of ECDSA signatures, with the same interface as verify_schnorr_batch.
+
+    - items is a sequence of (pubkey, sig, msg) tuples, with pubkey an ECPubKey.
+
+    ECDSA signatures only commit to the x coordinate of R, so unlike Schnorr signatures they
+    cannot be folded into one equation, and each of them is verified on its own.
+    """
+    results = [pubkey.verify_ecdsa(sig, msg, low_s) for pubkey, sig, msg in items]
+    return all(results), results
+
 def sign_schnorr(key, msg, aux=None, flip_p=False, flip_r=False):
     """Create a Schnorr signature (see BIP 340)."""
 
@@ -349,3 +417,36 @@ class TestFrameworkKey(unittest.TestCase):
                     self.assertEqual(result, result_actual, "BIP340 test vector %i (%s): verification succeeded unexpectedly" % (i, comment))
                 num_tests += 1
         self.assertTrue(num_tests >= 15) # expect at least 15 test vectors
+
+    def test_batch_verification(self):
+        """Test batch verification of Schnorr and ECDSA signatures."""
+        self.assertEqual(verify_schnorr_batch([]), (True, []))
+        self.assertEqual(verify_ecdsa_batch([]), (True, []))
+        privkeys = [generate_privkey() for _ in range(4)]
+        schnorr_items = []
+        ecdsa_items = []
+        for i in range(12):
+            # Reuse keys so that merging of repeated public key terms gets exercised too.
+            privkey = ECKey()
+            privkey.set(privkeys[i % len(privkeys)], compressed=True)
+            msg = random.randbytes(32)
+            xonly = compute_xonly_pubkey(privkey.get_bytes())[0]
+            schnorr_items.append((xonly, sign_schnorr(privkey.get_bytes(), msg), msg))
+            ecdsa_items.append((privkey.get_pubkey(), privkey.sign_ecdsa(msg), msg))
+        self.assertEqual(verify_schnorr_batch(schnorr_items), (True, [True] * 12))
+        self.assertEqual(verify_ecdsa_batch(ecdsa_items), (True, [True] * 12))
+
+        # Damage a few signatures and make sure exactly those are pinpointed.
+        bad = {1, 6, 7}
+        for i in bad:
+            key, sig, msg = schnorr_items[i]
+            schnorr_items[i] = (key, sig, bytes([msg[0] ^ 1]) + msg[1:])
+            pubkey, sig, msg = ecdsa_items[i]
+            ecdsa_items[i] = (pubkey, sig, bytes([msg[0] ^ 1]) + msg[1:])
+        # An R that isn't on the curve fails without taking part in the batch.
+        key, sig, msg = schnorr_items[9]
+        schnorr_items[9] = (key, (5).to_bytes(32, 'big') + sig[32:], msg)
+        expected = [i not in bad | {9} for i in range(12)]
+        self.assertEqual(verify_schnorr_batch(schnorr_items), (False, expected))
+        self.assertEqual(verify_schnorr_batch(schnorr_items), (False, [verify_schnorr(*item) for item in schnorr_items]))
+        self.assertEqual(verify_ecdsa_batch(ecdsa_items), (False, [i not in bad for i in range(12)]))
@@ -6,6 +6,8 @@
 import hashlib
 import unittest
 
+from . import crypto_backend
+
 def rot32(v, bits):
     """Rotate the 32-bit value v left by bits bits."""
     bits %= 32  # Make sure the term below does not throw an exception
@@ -56,6 +58,9 @@ def chacha20_32_to_384(key32):
             out.extend(((s[i] + init[i]) & 0xffffffff).to_bytes(4, 'little'))
     return bytes(out)
 
+# Use a native ChaCha20 instead when one is installed (see crypto_backend.py).
+chacha20_32_to_384 = crypto_backend.select("chacha20", chacha20_32_to_384)
+
 def data_to_num3072(data):
     """Hash a 32-byte array data to a 3072-bit number using 6 Chacha20 operations."""
     bytes384 = chacha20_32_to_384(data)
@@ -4,12 +4,27 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
 import base64
+import unittest
 
+from .key import ECKey
 from .messages import (
+    COutPoint,
     CTransaction,
+    CTxIn,
+    CTxOut,
     deser_string,
     from_binary,
     ser_compact_size,
+    ser_string,
+)
+from .script import (
+    CScript,
+    CScriptOp,
+    LegacySignatureHash,
+    OP_CHECKMULTISIG,
+    OP_CHECKSIG,
+    SIGHASH_ALL,
+    hash160,
 )
 
 
@@ -138,3 +153,107 @@ class PSBT:
     @classmethod
     def from_base64(cls, b64psbt):
         return from_binary(cls, base64.b64decode(b64psbt))
+
+
+def combine_psbts(psbts):
+    """Combine PSBTs for the same transaction into a new one (BIP 174 Combiner).
+
+    Fields present in several PSBTs are taken from the first one that has them."""
+    combined = from_binary(PSBT, psbts[0].serialize())
+    for other in psbts[1:]:
+        assert other.g.map[PSBT_GLOBAL_UNSIGNED_TX] == combined.g.map[PSBT_GLOBAL_UNSIGNED_TX]
+        for mine, theirs in zip([combined.g] + combined.i + combined.o, [other.g] + other.i + other.o):
+            for k, v in theirs.map.items():
+                mine.map.setdefault(k, v)
+    return combined
+
+
+def _satisfy(script, sigs):
+    """Return the stack satisfying a pk() or multi() script with the given {pubkey: sig}
+    signatures, or None if there aren't enough of them."""
+    ops = list(CScript(script))
+    if len(ops) == 2 and ops[1] == OP_CHECKSIG and isinstance(ops[0], bytes):
+        return [sigs[ops[0]]] if ops[0] in sigs else None
+    # CScript iteration turns OP_1..OP_16 into plain ints
+    if len(ops) >= 4 and ops[-1] == OP_CHECKMULTISIG and type(ops[0]) is int:
+        required = ops[0]
+        # Signatures have to be in the same order as the keys
+        chosen = [sigs[key] for key in ops[1:-2] if key in sigs][:required]
+        return [b""] + chosen if len(chosen) == required else None
+    return None
+
+
+def finalize_input(psbt, index):
+    """Finalize an input from its partial signatures (BIP 174 Input Finalizer), for
+    bare pk()/multi(), P2WPKH and P2WSH pk()/multi() outputs. Returns whether the input
+    is final."""
+    m = psbt.i[index].map
+    if PSBT_IN_FINAL_SCRIPTSIG in m or PSBT_IN_FINAL_SCRIPTWITNESS in m:
+        return True
+    sigs = {k[1:]: v for k, v in m.items() if isinstance(k, bytes) and k[0] == PSBT_IN_PARTIAL_SIG}
+    if PSBT_IN_WITNESS_UTXO in m:
+        spk = from_binary(CTxOut, m[PSBT_IN_WITNESS_UTXO]).scriptPubKey
+    else:
+        prev_tx = from_binary(CTransaction, m[PSBT_IN_NON_WITNESS_UTXO])
+        spk = prev_tx.vout[psbt.tx.vin[index].prevout.n].scriptPubKey
+    spk = bytes(spk)
+    script_sig = b""
+    witness = None
+    if len(spk) == 22 and spk[:2] == b"\x00\x14":
+        witness = [[sig, key] for key, sig in sigs.items() if hash160(key) == spk[2:]]
+        witness = witness[0] if witness else None
+        if witness is None:
+            return False
+    elif len(spk) == 34 and spk[:2] == b"\x00\x20":
+        witness_script = m.get(PSBT_IN_WITNESS_SCRIPT)
+        stack = _satisfy(witness_script, sigs) if witness_script else None
+        if stack is None:
+            return False
+        witness = stack + [witness_script]
+    else:
+        stack = _satisfy(spk, sigs)
+        if stack is None:
+            return False
+        script_sig = bytes(CScript(stack))
+    for k in list(m):
+        if k not in (PSBT_IN_NON_WITNESS_UTXO, PSBT_IN_WITNESS_UTXO) and not (isinstance(k, bytes) and k[0] == PSBT_IN_PROPRIETARY):
+            del m[k]
+    if script_sig:
+        m[PSBT_IN_FINAL_SCRIPTSIG] = script_sig
+    if witness is not None:
+        m[PSBT_IN_FINAL_SCRIPTWITNESS] = ser_compact_size(len(witness)) + b"".join(ser_string(x) for x in witness)
+    return True
+
+
+class TestFrameworkPSBT(unittest.TestCase):
+    def test_combine_and_finalize_multisig(self):
+        keys = [ECKey() for _ in range(3)]
+        for key in keys:
+            key.generate()
+        pubkeys = [key.get_pubkey().get_bytes() for key in keys]
+        challenge = CScript([CScriptOp.encode_op_n(2)] + pubkeys + [CScriptOp.encode_op_n(3), OP_CHECKMULTISIG])
+        prev_tx = CTransaction()
+        prev_tx.vin = [CTxIn(COutPoint(0, 0xffffffff))]
+        prev_tx.vout = [CTxOut(0, challenge)]
+        prev_tx.rehash()
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(prev_tx.sha256, 0))]
+        tx.vout = [CTxOut(0, b"\x6a")]
+        sighash, _ = LegacySignatureHash(challenge, tx, 0, SIGHASH_ALL)
+
+        signed = []
+        # Sign with the last two keys, in the opposite order of their pubkeys
+        for key, pubkey in [(keys[2], pubkeys[2]), (keys[1], pubkeys[1])]:
+            psbt = PSBT(g=PSBTMap({PSBT_GLOBAL_UNSIGNED_TX: tx.serialize()}),
+                        i=[PSBTMap({PSBT_IN_NON_WITNESS_UTXO: prev_tx.serialize()})], o=[PSBTMap()])
+            psbt.i[0].map[bytes([PSBT_IN_PARTIAL_SIG]) + pubkey] = key.sign_ecdsa(sighash) + bytes([SIGHASH_ALL])
+            signed.append(from_binary(PSBT, psbt.serialize()))
+
+        self.assertFalse(finalize_input(from_binary(PSBT, signed[0].serialize()), 0))
+        combined = combine_psbts(signed)
+        self.assertTrue(finalize_input(combined, 0))
+        script_sig = list(CScript(combined.i[0].map[PSBT_IN_FINAL_SCRIPTSIG]))
+        self.assertEqual(script_sig[0], b"")
+        for sig, key in zip(script_sig[1:], keys[1:]):
+            self.assertTrue(key.get_pubkey().verify_ecdsa(sig[:-1], sighash))
+        self.assertEqual(set(combined.i[0].map), {PSBT_IN_NON_WITNESS_UTXO, PSBT_IN_FINAL_SCRIPTSIG})
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""Block reward destinations resolved without per-block RPCs.
+
+Miners pay the coinbase to a fixed address, or to a descriptor that may be ranged over the
+block height. RewardCache turns either into (address, scriptPubKey) pairs:
+
+* addresses are decoded locally with address_to_scriptpubkey
+* descriptors are derived locally for the common single-key forms (addr, raw, pkh, wpkh,
+  sh(wpkh), tr with a key path only), with xpub/tpub keys and non-hardened steps, or any
+  steps for xprv/tprv keys
+* anything else falls back to the node's deriveaddresses and getaddressinfo, once per
+  address for fixed destinations and in batches of `lookahead` heights for ranged ones
+
+Ranged descriptors are derived `lookahead` heights ahead of the height asked for, so mining
+consecutive blocks doesn't hit the node at all.
+"""
+
+from functools import lru_cache
+import hashlib
+import hmac
+import re
+import unittest
+
+from . import secp256k1
+from .address import address_to_scriptpubkey, base58_to_byte, byte_to_base58
+from .script import taproot_construct
+from .script_util import (
+    key_to_p2pkh_script,
+    key_to_p2wpkh_script,
+    script_to_p2sh_script,
+)
+from .segwit_addr import encode_segwit_address
+
+HARDENED = 0x80000000
+# BIP32 extended key version bytes: (is private, is mainnet)
+EXTKEY_VERSIONS = {
+    bytes.fromhex("0488b21e"): (False, True),   # xpub
+    bytes.fromhex("0488ade4"): (True, True),    # xprv
+    bytes.fromhex("043587cf"): (False, False),  # tpub
+    bytes.fromhex("04358394"): (True, False),   # tprv
+}
+CHAIN_HRP = {"main": "bc", "regtest": "bcrt"}
+
+
+def decode_extkey(extkey):
+    """Return (private, chaincode, key) for a base58 BIP32 extended key, where key is an int
+    for private keys and a compressed pubkey for public ones."""
+    payload, version = base58_to_byte(extkey)
+    data = bytes([version]) + payload
+    if len(data) != 78 or data[:4] not in EXTKEY_VERSIONS:
+        raise ValueError(f"not an extended key: {extkey}")
+    private, _ = EXTKEY_VERSIONS[data[:4]]
+    chaincode = data[13:45]
+    if private:
+        return True, chaincode, int.from_bytes(data[46:78], 'big')
+    return False, chaincode, data[45:78]
+
+
+def ckd(private, chaincode, key, index):
+    """BIP32 child key derivation, for a private (int) or public (compressed bytes) key."""
+    if index >= HARDENED:
+        if not private:
+            raise ValueError("hardened derivation needs a private key")
+        data = b"\x00" + key.to_bytes(32, 'big')
+    else:
+        data = (key * secp256k1.G).to_bytes_compressed() if private else key
+    digest = hmac.new(chaincode, data + index.to_bytes(4, 'big'), hashlib.sha512).digest()
+    tweak = int.from_bytes(digest[:32], 'big')
+    if tweak >= secp256k1.GE.ORDER:
+        raise ValueError("invalid child key")
+    if private:
+        child = (tweak + key) % secp256k1.GE.ORDER
+    else:
+        child = (tweak * secp256k1.G + secp256k1.GE.from_bytes(key)).to_bytes_compressed()
+    return child, digest[32:]
+
+
+@lru_cache(maxsize=64)
+def derive_extkey(extkey, path):
+    """Derive an extended key along a tuple of child indices. Cached, so the shared prefix
+    of a ranged descriptor is derived once."""
+    private, chaincode, key = decode_extkey(extkey)
+    for index in path:
+        key, chaincode = ckd(private, chaincode, key, index)
+    return private, chaincode, key
+
+
+def key_expression_pubkey(expr, index):
+    """Return the compressed (or, for tr, xonly) pubkey of a descriptor key expression."""
+    expr = re.sub(r"^\[[^\]]*\]", "", expr)  # key origin
+    if re.fullmatch(r"[0-9a-fA-F]{64}|0[23][0-9a-fA-F]{64}", expr):
+        return bytes.fromhex(expr)
+    extkey, *steps = expr.split("/")
+    path = []
+    for step in steps:
+        hardened = step[-1:] in ("h", "'", "H")
+        step = step.rstrip("h'H")
+        if step == "*":
+            if index is None:
+                raise ValueError("ranged descriptor needs an index")
+            step = index
+        path.append(int(step) + (HARDENED if hardened else 0))
+    if path and "*" in steps[-1]:
+        # Keep the wildcard step out of the cached prefix
+        private, chaincode, key = derive_extkey(extkey, tuple(path[:-1]))
+        key, _ = ckd(private, chaincode, key, path[-1])
+    else:
+        private, _, key = derive_extkey(extkey, tuple(path))
+    return (key * secp256k1.G).to_bytes_compressed() if private else key
+
+
+def descriptor_scriptpubkey(descriptor, index=None):
+    """Return the scriptPubKey of a single-key descriptor at a ranged index.
+
+    Raises ValueError for descriptors that aren't supported here."""
+    descriptor = descriptor.split("#")[0].strip()
+    match = re.fullmatch(r"(\w+)\((.*)\)", descriptor)
+    if match is None:
+        raise ValueError(f"can't parse descriptor: {descriptor}")
+    func, arg = match.groups()
+    if func == "addr":
+        return address_to_scriptpubkey(arg)
+    if func == "raw":
+        return bytes.fromhex(arg)
+    if func == "sh" and arg.startswith("wpkh("):
+        return script_to_p2sh_script(descriptor_scriptpubkey(arg, index))
+    if "(" in arg or "," in arg:
+        raise ValueError(f"unsupported descriptor: {descriptor}")
+    if func == "pkh":
+        return key_to_p2pkh_script(key_expression_pubkey(arg, index))
+    if func == "wpkh":
+        return key_to_p2wpkh_script(key_expression_pubkey(arg, index))
+    if func == "tr":
+        pubkey = key_expression_pubkey(arg, index)
+        return bytes(taproot_construct(pubkey[-32:]).scriptPubKey)
+    raise ValueError(f"unsupported descriptor: {descriptor}")
+
+
+def scriptpubkey_to_address(spk, chain):
+    """Encode a standard output script as an address for the given chain name."""
+    if len(spk) == 25 and spk[:3] == b"\x76\xa9\x14" and spk[23:] == b"\x88\xac":
+        return byte_to_base58(spk[3:23], 0 if chain == "main" else 111)
+    if len(spk) == 23 and spk[:2] == b"\xa9\x14" and spk[22] == 0x87:
+        return byte_to_base58(spk[2:22], 5 if chain == "main" else 196)
+    if 4 <= len(spk) <= 42 and (spk[0] == 0 or 0x51 <= spk[0] <= 0x60) and spk[1] == len(spk) - 2:
+        version = spk[0] - 0x50 if spk[0] else 0
+        return encode_segwit_address(CHAIN_HRP.get(chain, "tb"), version, spk[2:])
+    return None
+
+
+class RewardCache:
+    """Maps block heights to the (address, scriptPubKey) that the block reward pays.
+
+    `rpc(method, *args)` calls the node and is only used for destinations that can't be
+    resolved locally."""
+
+    def __init__(self, rpc, *, address=None, descriptor=None, chain="signet", lookahead=100):
+        assert (address is None) != (descriptor is None), "give one of address or descriptor"
+        self.rpc = rpc
+        self.address = address
+        self.descriptor = descriptor
+        self.chain = chain
+        self.lookahead = lookahead
+        self.ranged = descriptor is not None and "*" in descriptor
+        self.fixed = None
+        # height -> (address, scriptPubKey), for ranged descriptors
+        self.derived = {}
+
+    def address_scriptpubkey(self, address):
+        try:
+            return address, bytes(address_to_scriptpubkey(address))
+        except (AssertionError, ValueError):
+            return address, bytes.fromhex(self.rpc("getaddressinfo", address)["scriptPubKey"])
+
+    def derive(self, start, end):
+        """Derive the destinations at heights start..end (inclusive)."""
+        try:
+            for height in range(start, end + 1):
+                spk = descriptor_scriptpubkey(self.descriptor, height)
+                self.derived[height] = (scriptpubkey_to_address(spk, self.chain), spk)
+        except (AssertionError, ValueError):
+            addrs = self.rpc("deriveaddresses", self.descriptor, [start, end])
+            for height, addr in enumerate(addrs, start):
+                self.derived[height] = self.address_scriptpubkey(addr)
+
+    def get(self, height):
+        if not self.ranged:
+            if self.fixed is None:
+                if self.address is not None:
+                    self.fixed = self.address_scriptpubkey(self.address)
+                else:
+                    try:
+                        spk = descriptor_scriptpubkey(self.descriptor)
+                        self.fixed = (scriptpubkey_to_address(spk, self.chain), spk)
+                    except (AssertionError, ValueError):
+                        addr = self.rpc("deriveaddresses", self.descriptor)[0]
+                        self.fixed = self.address_scriptpubkey(addr)
+            return self.fixed
+        for stale in [h for h in self.derived if h < height]:
+            del self.derived[stale]
+        if height not in self.derived:
+            self.derive(height, height + self.lookahead)
+        return self.derived[height]
+
+
+class TestFrameworkRewardCache(unittest.TestCase):
+    # BIP32 test vector 1
+    XPRV = "xprv9s21ZrQH143K3QTDL4LXw2F7HEK3wJUD2nW2nRk4stbPy6cq3jPPqjiChkVvvNKmPGJxWUtg6LnF5kejMRNNU3TGtRBeJgk33yuGBxrMPHi"
+    XPUB_0H = "xpub68Gmy5EdvgibQVfPdqkBBCHxA5htiqg55crXYuXoQRKfDBFA1WEjWgP6LHhwBZeNK1VTsfTFUHCdrfp1bgwQ9xv5ski8PX9rL2dZXvgGDnw"
+    PUBKEY_0H_1 = "03501e454bf00751f24b1b489aa925215d66af2234e3891c3b21a52bedb3cd711c"
+
+    def test_bip32(self):
+        self.assertEqual(key_expression_pubkey(self.XPRV + "/0h/1", None).hex(), self.PUBKEY_0H_1)
+        self.assertEqual(key_expression_pubkey(self.XPUB_0H + "/1", None).hex(), self.PUBKEY_0H_1)
+        self.assertEqual(key_expression_pubkey("[deadbeef/0h]" + self.XPUB_0H + "/*", 1).hex(), self.PUBKEY_0H_1)
+        with self.assertRaises(ValueError):
+            key_expression_pubkey(self.XPUB_0H + "/1h", None)
+
+    def test_descriptors(self):
+        pubkey = bytes.fromhex(self.PUBKEY_0H_1)
+        desc = f"wpkh({self.XPRV}/0'/*)"
+        self.assertEqual(descriptor_scriptpubkey(desc, 1), key_to_p2wpkh_script(pubkey))
+        self.assertEqual(descriptor_scriptpubkey(f"sh(wpkh({self.PUBKEY_0H_1}))"),
+                         script_to_p2sh_script(key_to_p2wpkh_script(pubkey)))
+        self.assertEqual(descriptor_scriptpubkey(f"pkh({self.PUBKEY_0H_1})#00000000"), key_to_p2pkh_script(pubkey))
+        self.assertEqual(descriptor_scriptpubkey(f"tr({self.PUBKEY_0H_1})"),
+                         bytes(taproot_construct(pubkey[1:]).scriptPubKey))
+        with self.assertRaises(ValueError):
+            descriptor_scriptpubkey(f"wsh(multi(1,{self.PUBKEY_0H_1}))")
+
+    def test_cache(self):
+        calls = []
+
+        def rpc(method, *args):
+            calls.append(method)
+            if method == "deriveaddresses" and len(args) == 1:
+                return [scriptpubkey_to_address(bytes([0x51, 0x20]) + bytes(32), "signet")]
+            if method == "deriveaddresses":
+                start, end = args[1]
+                return [scriptpubkey_to_address(bytes([0x51, 0x20]) + h.to_bytes(32, 'big'), "signet")
+                        for h in range(start, end + 1)]
+            raise AssertionError(method)
+
+        ranged = RewardCache(rpc, descriptor=f"wpkh({self.XPUB_0H}/*)", lookahead=3)
+        addr, spk = ranged.get(1)
+        self.assertEqual(spk, key_to_p2wpkh_script(bytes.fromhex(self.PUBKEY_0H_1)))
+        self.assertTrue(addr.startswith("tb1q"))
+        self.assertEqual(sorted(ranged.derived), [1, 2, 3, 4])
+        ranged.get(3)
+        self.assertEqual(sorted(ranged.derived), [3, 4])
+
+        # An unsupported descriptor is derived by the node, lookahead+1 heights at a time
+        remote = RewardCache(rpc, descriptor="wsh(multi(1,xpub/*))", lookahead=3)
+        for height in range(10, 18):
+            addr, spk = remote.get(height)
+            self.assertEqual(spk[2:], height.to_bytes(32, 'big'))
+            self.assertEqual(address_to_scriptpubkey(addr), spk)
+        self.assertEqual(calls, ["deriveaddresses"] * 2)
+
+        fixed = RewardCache(rpc, address=addr)
+        self.assertEqual(fixed.get(1), (addr, spk))
+        self.assertEqual(len(calls), 2)
+
+        # Keys and addresses the local parser rejects with an assertion are left to the node too
+        uncompressed = "04" + "79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798" \
+            + "483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8"
+        for desc in (f"pkh({uncompressed})", "addr(1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2)"):
+            self.assertEqual(RewardCache(rpc, descriptor=desc).get(1)[1], bytes([0x51, 0x20]) + bytes(32))
+        self.assertEqual(calls[2:], ["deriveaddresses"] * 2)
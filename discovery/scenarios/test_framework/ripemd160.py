@@ -5,6 +5,8 @@
 
 import unittest
 
+from . import crypto_backend
+
 # Message schedule indexes for the left path.
 ML = [
     0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
@@ -109,6 +111,10 @@ def ripemd160(data):
     return b"".join((h & 0xffffffff).to_bytes(4, 'little') for h in state)
 
 
+# Use hashlib's RIPEMD160 instead when the linked OpenSSL provides it (see crypto_backend.py).
+ripemd160 = crypto_backend.select("ripemd160", ripemd160)
+
+
 class TestFrameworkKey(unittest.TestCase):
     def test_ripemd160(self):
         """RIPEMD-160 test vectors."""
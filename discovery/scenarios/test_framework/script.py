@@ -15,7 +15,9 @@ from typing import List, Dict
 from .key import TaggedHash, tweak_add_pubkey, compute_xonly_pubkey
 
 from .messages import (
+    COutPoint,
     CTransaction,
+    CTxIn,
     CTxOut,
     hash256,
     ser_string,
@@ -699,42 +701,60 @@ def sign_input_legacy(tx, input_index, input_scriptpubkey, privkey, sighash_type
     tx.vin[input_index].scriptSig = bytes(CScript([der_sig + bytes([sighash_type])])) + tx.vin[input_index].scriptSig
     tx.rehash()
 
-def sign_input_segwitv0(tx, input_index, input_scriptpubkey, input_amount, privkey, sighash_type=SIGHASH_ALL):
+def sign_input_segwitv0(tx, input_index, input_scriptpubkey, input_amount, privkey, sighash_type=SIGHASH_ALL, txdata=None):
     """Add segwitv0 ECDSA signature for a given transaction input. Note that the signature
        is inserted at the bottom of the witness stack, i.e. additional witness data
-       needed (e.g. pubkey for P2WPKH) can already be set before."""
-    sighash = SegwitV0SignatureHash(input_scriptpubkey, tx, input_index, sighash_type, input_amount)
+       needed (e.g. pubkey for P2WPKH) can already be set before.
+
+       When signing many inputs of the same transaction, pass the same
+       PrecomputedTransactionData as txdata for all of them."""
+    sighash = SegwitV0SignatureHash(input_scriptpubkey, tx, input_index, sighash_type, input_amount, txdata=txdata)
     der_sig = privkey.sign_ecdsa(sighash)
     tx.wit.vtxinwit[input_index].scriptWitness.stack.insert(0, der_sig + bytes([sighash_type]))
     tx.rehash()
 
-# TODO: Allow cached hashPrevouts/hashSequence/hashOutputs to be provided.
-# Performance optimization probably not necessary for python tests, however.
+class PrecomputedTransactionData:
+    """Hashes of a transaction's prevouts, sequences and outputs that all its signature
+    hashes share, like Bitcoin Core's PrecomputedTransactionData.
+
+    Without it, every BIP143 or BIP341 signature hash rehashes all inputs and outputs, which
+    makes signing all inputs of a transaction quadratic in its size. Only valid as long as
+    the transaction's inputs (other than their scriptSig and witness) and outputs don't
+    change. spent_utxos (the CTxOuts spent by every input) is only needed for taproot."""
+
+    def __init__(self, txTo, spent_utxos=None):
+        # Single SHA256 hashes, used directly by BIP341 and hashed again for BIP143
+        self.sha_prevouts = BIP341_sha_prevouts(txTo)
+        self.sha_sequences = BIP341_sha_sequences(txTo)
+        self.sha_outputs = BIP341_sha_outputs(txTo)
+        self.hashPrevouts = uint256_from_str(sha256(self.sha_prevouts))
+        self.hashSequence = uint256_from_str(sha256(self.sha_sequences))
+        self.hashOutputs = uint256_from_str(sha256(self.sha_outputs))
+        self.sha_amounts = None
+        self.sha_scriptpubkeys = None
+        if spent_utxos is not None:
+            assert len(txTo.vin) == len(spent_utxos)
+            self.sha_amounts = BIP341_sha_amounts(spent_utxos)
+            self.sha_scriptpubkeys = BIP341_sha_scriptpubkeys(spent_utxos)
+
 # Note that this corresponds to sigversion == 1 in EvalScript, which is used
 # for version 0 witnesses.
-def SegwitV0SignatureMsg(script, txTo, inIdx, hashtype, amount):
+def SegwitV0SignatureMsg(script, txTo, inIdx, hashtype, amount, txdata=None):
+    if txdata is None:
+        txdata = PrecomputedTransactionData(txTo)
 
     hashPrevouts = 0
     hashSequence = 0
     hashOutputs = 0
 
     if not (hashtype & SIGHASH_ANYONECANPAY):
-        serialize_prevouts = bytes()
-        for i in txTo.vin:
-            serialize_prevouts += i.prevout.serialize()
-        hashPrevouts = uint256_from_str(hash256(serialize_prevouts))
+        hashPrevouts = txdata.hashPrevouts
 
     if (not (hashtype & SIGHASH_ANYONECANPAY) and (hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_sequence = bytes()
-        for i in txTo.vin:
-            serialize_sequence += struct.pack("<I", i.nSequence)
-        hashSequence = uint256_from_str(hash256(serialize_sequence))
+        hashSequence = txdata.hashSequence
 
     if ((hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_outputs = bytes()
-        for o in txTo.vout:
-            serialize_outputs += o.serialize()
-        hashOutputs = uint256_from_str(hash256(serialize_outputs))
+        hashOutputs = txdata.hashOutputs
     elif ((hashtype & 0x1f) == SIGHASH_SINGLE and inIdx < len(txTo.vout)):
         serialize_outputs = txTo.vout[inIdx].serialize()
         hashOutputs = uint256_from_str(hash256(serialize_outputs))
@@ -783,6 +803,24 @@ class TestFrameworkScript(unittest.TestCase):
         for value in values:
             self.assertEqual(CScriptNum.decode(CScriptNum.encode(CScriptNum(value))), value)
 
+    def test_precomputed_transaction_data(self):
+        # Signature hashes with a shared PrecomputedTransactionData must match the uncached ones
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i + 1, i), nSequence=i) for i in range(5)]
+        tx.vout = [CTxOut(1000 * i, CScript([OP_TRUE, i])) for i in range(3)]
+        spent_utxos = [CTxOut(5000 + i, CScript([OP_1, bytes([i]) * 32])) for i in range(5)]
+        script = CScript([OP_TRUE])
+        txdata = PrecomputedTransactionData(tx, spent_utxos)
+        for hashtype in (SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE, SIGHASH_ALL | SIGHASH_ANYONECANPAY, SIGHASH_SINGLE | SIGHASH_ANYONECANPAY):
+            for i in range(len(tx.vin)):
+                self.assertEqual(SegwitV0SignatureHash(script, tx, i, hashtype, 5000 + i, txdata=txdata),
+                                 SegwitV0SignatureHash(script, tx, i, hashtype, 5000 + i))
+                self.assertEqual(TaprootSignatureHash(tx, spent_utxos, hashtype, i, txdata=txdata),
+                                 TaprootSignatureHash(tx, spent_utxos, hashtype, i))
+        # Without spent_utxos, the data can't be used for taproot
+        with self.assertRaises(AssertionError):
+            TaprootSignatureHash(tx, spent_utxos, SIGHASH_ALL, 0, txdata=PrecomputedTransactionData(tx))
+
 def BIP341_sha_prevouts(txTo):
     return sha256(b"".join(i.prevout.serialize() for i in txTo.vin))
 
@@ -798,9 +836,12 @@ def BIP341_sha_sequences(txTo):
 def BIP341_sha_outputs(txTo):
     return sha256(b"".join(o.serialize() for o in txTo.vout))
 
-def TaprootSignatureMsg(txTo, spent_utxos, hash_type, input_index = 0, scriptpath = False, script = CScript(), codeseparator_pos = -1, annex = None, leaf_ver = LEAF_VERSION_TAPSCRIPT):
+def TaprootSignatureMsg(txTo, spent_utxos, hash_type, input_index = 0, scriptpath = False, script = CScript(), codeseparator_pos = -1, annex = None, leaf_ver = LEAF_VERSION_TAPSCRIPT, txdata = None):
     assert (len(txTo.vin) == len(spent_utxos))
     assert (input_index < len(txTo.vin))
+    if txdata is None:
+        txdata = PrecomputedTransactionData(txTo, spent_utxos)
+    assert txdata.sha_amounts is not None, "taproot signature hashes need a PrecomputedTransactionData with spent_utxos"
     out_type = SIGHASH_ALL if hash_type == 0 else hash_type & 3
     in_type = hash_type & SIGHASH_ANYONECANPAY
     spk = spent_utxos[input_index].scriptPubKey
@@ -808,12 +849,12 @@ def TaprootSignatureMsg(txTo, spent_utxos, hash_type, input_index = 0, scriptpat
     ss += struct.pack("<i", txTo.nVersion)
     ss += struct.pack("<I", txTo.nLockTime)
     if in_type != SIGHASH_ANYONECANPAY:
-        ss += BIP341_sha_prevouts(txTo)
-        ss += BIP341_sha_amounts(spent_utxos)
-        ss += BIP341_sha_scriptpubkeys(spent_utxos)
-        ss += BIP341_sha_sequences(txTo)
+        ss += txdata.sha_prevouts
+        ss += txdata.sha_amounts
+        ss += txdata.sha_scriptpubkeys
+        ss += txdata.sha_sequences
     if out_type == SIGHASH_ALL:
-        ss += BIP341_sha_outputs(txTo)
+        ss += txdata.sha_outputs
     spend_type = 0
     if annex is not None:
         spend_type |= 1
@@ -4,7 +4,8 @@
 
 """Test-only implementation of low-level secp256k1 field and group arithmetic
 
-It is designed for ease of understanding, not performance.
+It is designed for ease of understanding. Only scalar multiplication takes shortcuts for
+performance (Jacobian coordinates, wNAF recoding and precomputed tables).
 
 WARNING: This code is slow and trivially vulnerable to side channel attacks. Do not use for
 anything but tests.
@@ -15,6 +16,11 @@ Exports:
 * G: the secp256k1 generator point
 """
 
+import random
+import unittest
+
+from . import crypto_backend
+
 
 class FE:
     """Objects of this class represent elements of the field GF(2**256 - 2**32 - 977).
@@ -209,25 +215,52 @@ class GE:
         """Compute a (batch) scalar group element multiplication.
 
         GE.mul((a1, p1), (a2, p2), (a3, p3)) is identical to a1*p1 + a2*p2 + a3*p3,
-        but more efficient."""
-        # Reduce all the scalars modulo order first (so we can deal with negatives etc).
-        naps = [(a % GE.ORDER, p) for a, p in aps]
+        but more efficient.
+
+        This uses Strauss' algorithm: every scalar is recoded in width-w NAF form, a small
+        table of odd multiples is built for each point, and a single chain of doublings is
+        shared by all terms. Intermediate results are kept in Jacobian coordinates, and all
+        tables are converted to affine form together using one modular inversion."""
+        tables = []
+        terms = []
+        for a, p in aps:
+            # Reduce all the scalars modulo order first (so we can deal with negatives etc).
+            a %= GE.ORDER
+            if a == 0 or p.infinity:
+                continue
+            if p is G:
+                terms.append((_wnaf(a, G_WNAF_WINDOW), G_ODD_MULTIPLES))
+            else:
+                terms.append((_wnaf(a, WNAF_WINDOW), len(tables)))
+                tables.append(_jac_odd_multiples((int(p.x), int(p.y), 1), WNAF_WINDOW))
+        # Normalize all freshly built tables with a single inversion.
+        flat = _jac_to_affine_batch([q for table in tables for q in table])
+        size = 1 << (WNAF_WINDOW - 2)
+        # For every digit position, list the table entries to add (or subtract) there, so the
+        # main loop only visits nonzero digits.
+        schedule = [[] for _ in range(max((len(digits) for digits, _ in terms), default=0))]
+        for digits, t in terms:
+            table = flat[t * size:(t + 1) * size] if isinstance(t, int) else t
+            for i, d in enumerate(digits):
+                if d > 0:
+                    schedule[i].append(table[d >> 1])
+                elif d < 0:
+                    x, y = table[-d >> 1]
+                    schedule[i].append((x, FE.SIZE - y))
         # Start with point at infinity.
-        r = GE()
-        # Iterate over all bit positions, from high to low.
-        for i in range(255, -1, -1):
-            # Double what we have so far.
-            r = r + r
-            # Add then add the points for which the corresponding scalar bit is set.
-            for (a, p) in naps:
-                if (a >> i) & 1:
-                    r += p
-        return r
+        r = _JAC_INFINITY
+        # Iterate over all digit positions, from high to low.
+        for adds in reversed(schedule):
+            # Double what we have so far, then add the entries for this position.
+            r = _jac_double(r)
+            for q in adds:
+                r = _jac_add_affine(r, q)
+        return _jac_to_ge(r)
 
     def __rmul__(self, a):
         """Multiply an integer with a group element."""
         if self == G:
-            return FAST_G.mul(a)
+            return mul_g(a)
         return GE.mul((a, self))
 
     def __neg__(self):
@@ -316,31 +349,241 @@ class GE:
 G = GE.lift_x(0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798)
 
 
+# Jacobian coordinate arithmetic, used internally to speed up scalar multiplication.
+#
+# A Jacobian point is a tuple (X, Y, Z) of integers modulo FE.SIZE, representing the affine
+# point (X/Z^2, Y/Z^3), or infinity when Z == 0. Unlike affine addition, Jacobian addition
+# needs no modular inversion, and plain integers avoid the overhead of FE objects. Affine
+# points are (x, y) tuples of integers.
+
+_JAC_INFINITY = (0, 1, 0)
+
+# Window size of the wNAF tables built on the fly for arbitrary points in GE.mul
+WNAF_WINDOW = 5
+
+
+def _jac_double(p):
+    """Double a Jacobian point (dbl-2009-l from the Explicit-Formulas Database, for a = 0)."""
+    x, y, z = p
+    if z == 0 or y == 0:
+        return _JAC_INFINITY
+    m = FE.SIZE
+    a = x * x % m
+    b = y * y % m
+    c = b * b % m
+    d = 2 * ((x + b) * (x + b) - a - c) % m
+    e = 3 * a
+    x3 = (e * e - 2 * d) % m
+    return (x3, (e * (d - x3) - 8 * c) % m, 2 * y * z % m)
+
+
+def _jac_add(p, q):
+    """Add two Jacobian points."""
+    x1, y1, z1 = p
+    x2, y2, z2 = q
+    if z1 == 0:
+        return q
+    if z2 == 0:
+        return p
+    m = FE.SIZE
+    z1z1 = z1 * z1 % m
+    z2z2 = z2 * z2 % m
+    u1 = x1 * z2z2 % m
+    u2 = x2 * z1z1 % m
+    s1 = y1 * z2 * z2z2 % m
+    s2 = y2 * z1 * z1z1 % m
+    if u1 == u2:
+        # Same x coordinate: either the same point (so double it) or its negation.
+        return _jac_double(p) if s1 == s2 else _JAC_INFINITY
+    h = u2 - u1
+    r = s2 - s1
+    hh = h * h % m
+    hhh = h * hh % m
+    v = u1 * hh % m
+    x3 = (r * r - hhh - 2 * v) % m
+    return (x3, (r * (v - x3) - s1 * hhh) % m, z1 * z2 * h % m)
+
+
+def _jac_add_affine(p, q):
+    """Add a Jacobian point p and a non-infinite affine point q (cheaper than _jac_add)."""
+    x1, y1, z1 = p
+    if z1 == 0:
+        return (q[0], q[1], 1)
+    m = FE.SIZE
+    z1z1 = z1 * z1 % m
+    u2 = q[0] * z1z1 % m
+    s2 = q[1] * z1 * z1z1 % m
+    if x1 == u2:
+        return _jac_double(p) if y1 == s2 else _JAC_INFINITY
+    h = u2 - x1
+    r = s2 - y1
+    hh = h * h % m
+    hhh = h * hh % m
+    v = x1 * hh % m
+    x3 = (r * r - hhh - 2 * v) % m
+    return (x3, (r * (v - x3) - y1 * hhh) % m, z1 * h % m)
+
+
+def _jac_to_affine_batch(points):
+    """Convert a list of non-infinite Jacobian points to affine (x, y) tuples.
+
+    Montgomery's trick is used to invert all Z coordinates with a single modular inversion."""
+    m = FE.SIZE
+    prefix = []
+    acc = 1
+    for _, _, z in points:
+        prefix.append(acc)
+        acc = acc * z % m
+    inv = pow(acc, -1, m)
+    result = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        x, y, z = points[i]
+        zi = inv * prefix[i] % m
+        inv = inv * z % m
+        zi2 = zi * zi % m
+        result[i] = (x * zi2 % m, y * zi2 * zi % m)
+    return result
+
+
+def _jac_to_ge(p):
+    """Convert a Jacobian point to a group element."""
+    if p[2] == 0:
+        return GE()
+    (x, y), = _jac_to_affine_batch([p])
+    return GE(x, y)
+
+
+def _jac_odd_multiples(p, w):
+    """Compute [p, 3*p, 5*p, ..., (2^(w-1) - 1)*p] in Jacobian coordinates."""
+    p2 = _jac_double(p)
+    table = [p]
+    for _ in range((1 << (w - 2)) - 1):
+        table.append(_jac_add(table[-1], p2))
+    return table
+
+
+def _wnaf(a, w):
+    """Compute the width-w non-adjacent form of a non-negative integer, lowest digit first.
+
+    Every digit is zero or odd with absolute value below 2^(w-1), and nonzero digits are at
+    least w positions apart, so on average only 1 in w+1 digits needs a point addition."""
+    digits = []
+    while a:
+        # Skip over a run of zero bits at once.
+        zeros = (a & -a).bit_length() - 1
+        digits.extend([0] * zeros)
+        a >>= zeros
+        d = a & ((1 << w) - 1)
+        if d >= 1 << (w - 1):
+            d -= 1 << w
+        a = (a - d) >> 1
+        digits.append(d)
+    return digits
+
+
+# G gets a wider wNAF window than other points, as its table is only built once
+G_WNAF_WINDOW = 8
+G_ODD_MULTIPLES = _jac_to_affine_batch(_jac_odd_multiples((int(G.x), int(G.y), 1), G_WNAF_WINDOW))
+
+
 class FastGEMul:
     """Table for fast multiplication with a constant group element.
 
     Speed up scalar multiplication with a fixed point P by using a precomputed lookup table with
-    its powers of 2:
+    the multiples of P for every 4-bit window value at every window position:
 
-        table = [P, 2*P, 4*P, (2^3)*P, (2^4)*P, ..., (2^255)*P]
+        table[i][j] = (j * 16^i) * P    for i in 0..63 and j in 1..15
 
-    During multiplication, the points corresponding to each bit set in the scalar are added up,
-    i.e. on average ~128 point additions take place.
+    During multiplication the scalar is split into 64 4-bit digits, and the table entries for the
+    nonzero digits are added up, i.e. at most 64 point additions and no doublings take place.
+    The table is stored in affine form (normalized with a single inversion), so every addition is
+    a cheap mixed Jacobian/affine addition and only the final result needs an inversion.
     """
 
+    WINDOW = 4
+
     def __init__(self, p):
-        self.table = [p]  # table[i] = (2^i) * p
-        for _ in range(255):
-            p = p + p
-            self.table.append(p)
+        assert not p.infinity
+        rows = []
+        base = (int(p.x), int(p.y), 1)
+        for _ in range(256 // self.WINDOW):
+            row = [base]
+            for _ in range((1 << self.WINDOW) - 2):
+                row.append(_jac_add(row[-1], base))
+            rows.append(row)
+            base = _jac_add(row[-1], base)
+        flat = _jac_to_affine_batch([q for row in rows for q in row])
+        size = (1 << self.WINDOW) - 1
+        # table[i][0] is a placeholder, so that window values can be used as indices directly.
+        self.table = [[None] + flat[i * size:(i + 1) * size] for i in range(len(rows))]
 
     def mul(self, a):
-        result = GE()
         a = a % GE.ORDER
-        for bit in range(a.bit_length()):
-            if a & (1 << bit):
-                result += self.table[bit]
-        return result
+        mask = (1 << self.WINDOW) - 1
+        result = _JAC_INFINITY
+        for row in self.table:
+            if a == 0:
+                break
+            if a & mask:
+                result = _jac_add_affine(result, row[a & mask])
+            a >>= self.WINDOW
+        return _jac_to_ge(result)
 
 # Precomputed table with multiples of G for fast multiplication
 FAST_G = FastGEMul(G)
+
+
+def _python_pubkey(seckey):
+    return FAST_G.mul(int.from_bytes(seckey, 'big')).to_bytes_uncompressed()
+
+# Multiplications with G (key generation, signing) can use libsecp256k1 instead, when
+# bindings for it are installed (see crypto_backend.py).
+_pubkey = crypto_backend.select("secp256k1", _python_pubkey)
+
+
+def mul_g(a):
+    """Multiply an integer with G."""
+    a %= GE.ORDER
+    if a == 0 or _pubkey is _python_pubkey:
+        return FAST_G.mul(a)
+    pub = _pubkey(a.to_bytes(32, 'big'))
+    return GE(int.from_bytes(pub[1:33], 'big'), int.from_bytes(pub[33:], 'big'))
+
+
+class TestFrameworkSecp256k1(unittest.TestCase):
+    @staticmethod
+    def reference_mul(a, p):
+        """Plain affine double-and-add, to check the optimized multiplication code against."""
+        a %= GE.ORDER
+        r = GE()
+        for i in range(255, -1, -1):
+            r = r + r
+            if (a >> i) & 1:
+                r += p
+        return r
+
+    def assert_same_ge(self, p1, p2):
+        self.assertEqual(p1.infinity, p2.infinity)
+        if not p1.infinity:
+            self.assertEqual(p1.x, p2.x)
+            self.assertEqual(p1.y, p2.y)
+
+    def test_mul(self):
+        """Check FastGEMul and GE.mul against double-and-add."""
+        P = self.reference_mul(random.randrange(1, GE.ORDER), G)
+        scalars = [0, 1, 2, 3, GE.ORDER - 1, GE.ORDER, GE.ORDER + 1, -1, 2**255, 2**256 - 1]
+        scalars += [random.randrange(0, 2**256) for _ in range(8)]
+        for a in scalars:
+            expected_g = self.reference_mul(a, G)
+            expected_p = self.reference_mul(a, P)
+            self.assert_same_ge(FAST_G.mul(a), expected_g)
+            self.assert_same_ge(a * G, expected_g)
+            self.assert_same_ge(a * P, expected_p)
+            self.assert_same_ge(GE.mul((a, G)), expected_g)
+            self.assert_same_ge(GE.mul((a, P)), expected_p)
+            b = random.randrange(0, GE.ORDER)
+            self.assert_same_ge(GE.mul((a, G), (b, P), (-a, P)), expected_g + self.reference_mul(b - a, P))
+        # Terms that cancel out, infinite points and no terms at all
+        self.assertTrue(GE.mul((5, P), (-5, P)).infinity)
+        self.assertTrue(GE.mul((1, P), (1, -P), (7, GE())).infinity)
+        self.assertTrue(GE.mul().infinity)
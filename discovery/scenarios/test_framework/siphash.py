@@ -8,6 +8,9 @@ This implements SipHash-2-4. For convenience, an interface taking 256-bit
 integers is provided in addition to the one accepting generic data.
 """
 
+from . import crypto_backend
+
+
 def rotl64(n, b):
     return n >> (64 - b) | (n & ((1 << (64 - b)) - 1)) << b
 
@@ -60,6 +63,10 @@ def siphash(k0, k1, data):
     return v0 ^ v1 ^ v2 ^ v3
 
 
+# Use a native SipHash instead when one is installed (see crypto_backend.py).
+siphash = crypto_backend.select("siphash", siphash)
+
+
 def siphash256(k0, k1, num):
     assert type(num) is int
     return siphash(k0, k1, num.to_bytes(32, 'little'))
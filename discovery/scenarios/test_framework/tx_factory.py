@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""Offline generation of large numbers of valid MiniWallet transactions.
+
+BulkTxFactory builds the same anyone-can-spend transactions as
+MiniWallet.create_self_transfer_multi and create_self_transfer_chain (in the
+ADDRESS_OP_TRUE or RAW_OP_TRUE modes, so there is nothing to sign), but
+without going through CTransaction objects or any RPC. Inputs and outputs are
+serialized from precomputed templates, only the txid is hashed up front, and
+the full serialization, wtxid and hex are built only when asked for.
+
+Shapes:
+* chain(): a chain of 1-in-1-out transactions, each spending its parent
+* fan_out(): a tree where every transaction spends one output of its parent
+  and creates `width` new ones. Subtrees can be built in a process pool.
+* spend_each(): one independent transaction per given utxo
+
+Fee rates are in BTC/kvB, like MiniWallet's. Either a single rate or a list of
+rates, which every transaction draws one from (so repeating a rate in the list
+weights it).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+import random
+import struct
+import unittest
+
+from .address import address_to_scriptpubkey, create_deterministic_address_bcrt1_p2tr_op_true
+from .messages import (
+    COIN,
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxInWitness,
+    CTxOut,
+    hash256,
+    ser_compact_size,
+    ser_string,
+)
+from .script import CScript, LEAF_VERSION_TAPSCRIPT, OP_NOP, OP_TRUE
+from .wallet import MiniWalletMode
+
+TX_VERSION = struct.pack("<i", 2)
+
+
+class BulkTx:
+    """A transaction built by BulkTxFactory."""
+    __slots__ = ("hash", "vsize", "fee", "values", "_stripped", "_witness")
+
+    def __init__(self, stripped, witness, vsize, fee, values):
+        self._stripped = stripped
+        self._witness = witness
+        self.vsize = vsize
+        self.fee = fee
+        self.values = values
+        # Little endian, as it appears in the outpoints of child transactions
+        self.hash = hash256(stripped)
+
+    @property
+    def txid(self):
+        return self.hash[::-1].hex()
+
+    @property
+    def wtxid(self):
+        return hash256(self.serialize())[::-1].hex() if self._witness else self.txid
+
+    def serialize(self):
+        if not self._witness:
+            return self._stripped
+        return self._stripped[:4] + b"\x00\x01" + self._stripped[4:-4] + self._witness + self._stripped[-4:]
+
+    @property
+    def hex(self):
+        return self.serialize().hex()
+
+    def p2p_message(self, magic_bytes):
+        """Return the transaction framed as a `tx` P2P message (see P2PConnection.build_message)."""
+        data = self.serialize()
+        return magic_bytes + b"tx" + b"\x00" * 10 + struct.pack("<I", len(data)) + hash256(data)[:4] + data
+
+    @property
+    def new_utxos(self):
+        """The outputs as MiniWallet utxo dicts, e.g. to hand back to MiniWallet."""
+        txid = self.txid
+        return [{"txid": txid, "vout": n, "value": Decimal(value) / COIN, "height": 0, "coinbase": False, "confirmations": 0}
+                for n, value in enumerate(self.values)]
+
+    def outputs(self):
+        return [(self.hash, n, value) for n, value in enumerate(self.values)]
+
+
+def _fan_out_subtree(factory, utxo, width, depth, seed):
+    factory.rng = random.Random(seed)
+    txs = []
+    factory._fan_out(utxo, width, depth, txs)
+    return txs
+
+
+class BulkTxFactory:
+    def __init__(self, *, mode=MiniWalletMode.ADDRESS_OP_TRUE, fee_rate=Decimal("0.003"), sequence=0, locktime=0, seed=None):
+        if mode == MiniWalletMode.ADDRESS_OP_TRUE:
+            address, internal_key = create_deterministic_address_bcrt1_p2tr_op_true()
+            script_pub_key = address_to_scriptpubkey(address)
+            script_sig = b""
+            # Script path spend: the OP_TRUE leaf and the control block
+            self._input_witness = (ser_compact_size(2) + ser_string(bytes(CScript([OP_TRUE])))
+                                   + ser_string(bytes([LEAF_VERSION_TAPSCRIPT]) + internal_key))
+        elif mode == MiniWalletMode.RAW_OP_TRUE:
+            script_pub_key = bytes(CScript([OP_TRUE]))
+            script_sig = bytes(CScript([OP_NOP] * 43))  # pad to identical size, like MiniWallet
+            self._input_witness = b""
+        else:
+            assert False, "BulkTxFactory can't sign, use an OP_TRUE mode"
+        self.script_pub_key = script_pub_key
+        self._input_tail = ser_string(script_sig) + struct.pack("<I", sequence)
+        self._output_tail = ser_string(script_pub_key)
+        self._locktime = struct.pack("<I", locktime)
+        rates = fee_rate if isinstance(fee_rate, (list, tuple)) else [fee_rate]
+        self._fee_rates = [int(rate * COIN) for rate in rates]  # sat/kvB
+        self.rng = random.Random(seed)
+
+    @staticmethod
+    def utxo(utxo):
+        """Convert a MiniWallet utxo dict to the (hash, vout, value in sat) tuples used here."""
+        return (bytes.fromhex(utxo["txid"])[::-1], utxo["vout"], int(utxo["value"] * COIN))
+
+    def spend(self, utxos, num_outputs=1):
+        """Build one transaction spending the given (hash, vout, value) utxos into num_outputs
+        equal outputs, at a fee rate drawn from the factory's fee rates."""
+        vin = ser_compact_size(len(utxos)) + b"".join(h + struct.pack("<I", n) + self._input_tail for h, n, _ in utxos)
+        # The size only depends on the number of inputs and outputs, so compute it before the amounts
+        stripped_size = 4 + len(vin) + len(ser_compact_size(num_outputs)) + num_outputs * (8 + len(self._output_tail)) + 4
+        witness_size = (2 + len(utxos) * len(self._input_witness)) if self._input_witness else 0
+        vsize = (4 * stripped_size + witness_size + 3) // 4
+        fee_rate = self._fee_rates[0] if len(self._fee_rates) == 1 else self.rng.choice(self._fee_rates)
+        total = sum(value for _, _, value in utxos)
+        amount = (total - (vsize * fee_rate + 999) // 1000) // num_outputs
+        assert amount > 0, "utxos too small for the number of outputs and fee rate"
+        vout = ser_compact_size(num_outputs) + (struct.pack("<q", amount) + self._output_tail) * num_outputs
+        return BulkTx(TX_VERSION + vin + vout + self._locktime, self._input_witness * len(utxos), vsize,
+                      total - amount * num_outputs, [amount] * num_outputs)
+
+    def chain(self, utxo, length):
+        """Return a chain of `length` transactions, starting by spending the MiniWallet utxo."""
+        txs = []
+        tip = self.utxo(utxo)
+        for _ in range(length):
+            tx = self.spend([tip])
+            tip = (tx.hash, 0, tx.values[0])
+            txs.append(tx)
+        return txs
+
+    def spend_each(self, utxos, num_outputs=1):
+        """Return one independent transaction for each MiniWallet utxo."""
+        return [self.spend([self.utxo(u)], num_outputs) for u in utxos]
+
+    def _fan_out(self, utxo, width, depth, txs):
+        tx = self.spend([utxo], width)
+        txs.append(tx)
+        if depth > 1:
+            for output in tx.outputs():
+                self._fan_out(output, width, depth - 1, txs)
+
+    def fan_out(self, utxo, *, width, depth, processes=1):
+        """Return a tree of transactions spending the MiniWallet utxo, in an order that can be
+        submitted to a mempool (parents first). The root creates `width` outputs, and each of
+        them is spent by a transaction creating `width` outputs of its own, `depth` levels deep
+        (so sum(width**i for i in range(depth)) transactions). With processes > 1, the
+        subtrees under the root are built in a process pool."""
+        root = self.spend([self.utxo(utxo)], width)
+        if depth == 1:
+            return [root]
+        txs = [root]
+        if processes > 1:
+            seeds = [self.rng.getrandbits(64) for _ in range(width)]
+            with ProcessPoolExecutor(processes) as executor:
+                for subtree in executor.map(_fan_out_subtree, [self] * width, root.outputs(), [width] * width, [depth - 1] * width, seeds):
+                    txs.extend(subtree)
+        else:
+            for output in root.outputs():
+                self._fan_out(output, width, depth - 1, txs)
+        return txs
+
+
+class TestFrameworkTxFactory(unittest.TestCase):
+    UTXO = {"txid": "ab" * 32, "vout": 3, "value": Decimal("50")}
+
+    def reference_tx(self, factory, mode, utxos, amounts):
+        """Build the same transaction through CTransaction, as MiniWallet would."""
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(int(u["txid"], 16), u["vout"])) for u in utxos]
+        tx.vout = [CTxOut(amount, factory.script_pub_key) for amount in amounts]
+        if mode == MiniWalletMode.RAW_OP_TRUE:
+            for txin in tx.vin:
+                txin.scriptSig = CScript([OP_NOP] * 43)
+        else:
+            tx.wit.vtxinwit = [CTxInWitness() for _ in tx.vin]
+            for wit in tx.wit.vtxinwit:
+                wit.scriptWitness.stack = [CScript([OP_TRUE]), bytes([LEAF_VERSION_TAPSCRIPT]) + (1).to_bytes(32, 'big')]
+        tx.rehash()
+        return tx
+
+    def test_matches_ctransaction(self):
+        for mode in (MiniWalletMode.ADDRESS_OP_TRUE, MiniWalletMode.RAW_OP_TRUE):
+            factory = BulkTxFactory(mode=mode)
+            chain = factory.chain(self.UTXO, 3)
+            parent = self.UTXO
+            for tx in chain:
+                ref = self.reference_tx(factory, mode, [parent], tx.values)
+                self.assertEqual(tx.hex, ref.serialize().hex())
+                self.assertEqual(tx.txid, ref.hash)
+                self.assertEqual(tx.wtxid, ref.getwtxid())
+                self.assertEqual(tx.vsize, ref.get_vsize())
+                self.assertEqual(tx.fee, (tx.vsize * 300000 + 999) // 1000)
+                parent = tx.new_utxos[0]
+
+    def test_fan_out(self):
+        factory = BulkTxFactory(fee_rate=[Decimal("0.0001"), Decimal("0.0005")], seed=1)
+        txs = factory.fan_out(self.UTXO, width=3, depth=3)
+        self.assertEqual(len(txs), 1 + 3 + 9)
+        # Every transaction spends an output of one that comes before it
+        created = {(self.UTXO["txid"], self.UTXO["vout"])}
+        for tx in txs:
+            raw = tx.serialize()
+            prevout = (raw[7:39][::-1].hex(), struct.unpack("<I", raw[39:43])[0])
+            self.assertIn(prevout, created)
+            created.update((tx.txid, n) for n in range(len(tx.values)))
+            # The remainder of splitting the amount between the outputs goes to the fee
+            self.assertTrue(any(0 <= tx.fee - (tx.vsize * rate + 999) // 1000 < 3 for rate in (10000, 50000)))
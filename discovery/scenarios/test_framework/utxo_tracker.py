@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Incremental MuHash3072 commitment to a node's UTXO set.
+
+UTXOSetTracker follows a node's active chain one block at a time, using getblock with
+verbosity 3 (which includes the spent prevouts), and keeps the same MuHash that
+`gettxoutsetinfo muhash` reports, without the node ever hashing its chainstate.
+
+Every block's created and spent coins are combined into one MuHash3072 delta, so applying
+or reverting a block costs a single modular inverse, however many coins it spends. Reorgs
+are followed by reverting blocks down to the fork point and connecting the new branch.
+"""
+
+import unittest
+
+from .messages import COIN, COutPoint, CTxOut
+from .muhash import MuHash3072
+
+# Outputs that can never be spent are not added to the UTXO set (CScript::IsUnspendable)
+OP_RETURN = 0x6a
+MAX_SCRIPT_SIZE = 10000
+
+
+def coin_data(txid, n, height, coinbase, value, script_pub_key):
+    """Serialize a coin the way Bitcoin Core's TxOutSer does for the UTXO set MuHash."""
+    data = COutPoint(int(txid, 16), n).serialize()
+    data += (height * 2 + coinbase).to_bytes(4, 'little')
+    data += CTxOut(value, script_pub_key).serialize()
+    return data
+
+
+def is_unspendable(script_pub_key):
+    return (len(script_pub_key) > 0 and script_pub_key[0] == OP_RETURN) or len(script_pub_key) > MAX_SCRIPT_SIZE
+
+
+def block_delta(block):
+    """Return a MuHash3072 with the coins a block creates inserted and the coins it spends removed.
+
+    `block` is the result of getblock with verbosity 3."""
+    delta = MuHash3072()
+    if block["height"] == 0:
+        # The genesis block's outputs are not part of the UTXO set.
+        return delta
+    for i, tx in enumerate(block["tx"]):
+        for txin in tx["vin"]:
+            if "coinbase" in txin:
+                continue
+            prevout = txin["prevout"]
+            delta.remove(coin_data(txin["txid"], txin["vout"], prevout["height"], prevout["generated"],
+                                   round(prevout["value"] * COIN), bytes.fromhex(prevout["scriptPubKey"]["hex"])))
+        for txout in tx["vout"]:
+            script_pub_key = bytes.fromhex(txout["scriptPubKey"]["hex"])
+            if is_unspendable(script_pub_key):
+                continue
+            delta.insert(coin_data(tx["txid"], txout["n"], block["height"], i == 0,
+                                   round(txout["value"] * COIN), script_pub_key))
+    return delta
+
+
+class UTXOSetTracker:
+    """Running MuHash of the UTXO set at the tip of the chain of blocks connected so far.
+
+    The set is kept as a single reduced number, so finalizing a digest needs no inverse."""
+
+    MODULUS = MuHash3072.MODULUS
+
+    def __init__(self):
+        self.value = 1
+        # (block hash, delta, digest) for every connected block, genesis first
+        self.blocks = []
+
+    @property
+    def height(self):
+        return len(self.blocks) - 1
+
+    @property
+    def tip(self):
+        return self.blocks[-1][0] if self.blocks else None
+
+    def digest(self):
+        """Return the MuHash of the current UTXO set, as hex in gettxoutsetinfo's byte order."""
+        muhash = MuHash3072()
+        muhash.numerator = self.value
+        return muhash.digest()[::-1].hex()
+
+    def digest_at(self, block_hash):
+        """Return the digest after the given connected block, or None if it isn't connected."""
+        for hash, _, digest in reversed(self.blocks):
+            if hash == block_hash:
+                return digest
+        return None
+
+    def connect_block(self, block):
+        """Apply a getblock verbosity 3 result on top of the current tip."""
+        if self.blocks:
+            assert block["previousblockhash"] == self.tip, "block does not extend the current tip"
+        delta = block_delta(block)
+        self.value = self.value * delta.numerator * pow(delta.denominator, -1, self.MODULUS) % self.MODULUS
+        self.blocks.append((block["hash"], delta, self.digest()))
+
+    def disconnect_block(self):
+        """Revert the tip block, returning its hash."""
+        hash, delta, _ = self.blocks.pop()
+        self.value = self.value * delta.denominator * pow(delta.numerator, -1, self.MODULUS) % self.MODULUS
+        return hash
+
+    def sync(self, node):
+        """Follow the node's active chain, reverting blocks that it no longer has.
+
+        Returns the (disconnected, connected) block counts."""
+        disconnected = connected = 0
+        while True:
+            best_height = node.getblockcount()
+            while self.height > best_height:
+                self.disconnect_block()
+                disconnected += 1
+            # Walk back to the fork point
+            while self.blocks and node.getblockhash(self.height) != self.tip:
+                self.disconnect_block()
+                disconnected += 1
+            try:
+                for height in range(self.height + 1, best_height + 1):
+                    block = node.getblock(blockhash=node.getblockhash(height), verbosity=3)
+                    self.connect_block(block)
+                    connected += 1
+                return disconnected, connected
+            except AssertionError:
+                # The node reorged while we were catching up; find the new fork point.
+                continue
+
+
+class TestFrameworkUTXOTracker(unittest.TestCase):
+    class FakeNode:
+        """Serves getblock verbosity 3 results for an in-memory chain."""
+
+        def __init__(self, blocks):
+            self.blocks = blocks
+
+        def getblockcount(self):
+            return len(self.blocks) - 1
+
+        def getblockhash(self, height):
+            return self.blocks[height]["hash"]
+
+        def getblock(self, blockhash, verbosity):
+            assert verbosity == 3
+            return next(b for b in self.blocks if b["hash"] == blockhash)
+
+    @staticmethod
+    def make_block(height, prev, tag, spent_coinbase=None):
+        """Build a minimal getblock verbosity 3 result: a coinbase with an OP_RETURN output,
+        plus a transaction spending the previous block's coinbase output."""
+        def txout(n, value, spk):
+            return {"n": n, "value": value, "scriptPubKey": {"hex": spk.hex()}}
+
+        def txid(i):
+            return f"{tag:02x}{height:04x}{i:02x}".ljust(64, "0")
+
+        txs = [{"txid": txid(0), "vin": [{"coinbase": "00"}],
+                "vout": [txout(0, 50, bytes([0x51, height, tag])), txout(1, 0, bytes([OP_RETURN, 0x01]))]}]
+        if spent_coinbase is not None:
+            prevout = {"height": height - 1, "generated": True, "value": 50,
+                       "scriptPubKey": spent_coinbase["vout"][0]["scriptPubKey"]}
+            txs.append({"txid": txid(1), "vin": [{"txid": spent_coinbase["txid"], "vout": 0, "prevout": prevout}],
+                        "vout": [txout(0, 20, bytes([0x52, tag])), txout(1, 30, bytes([0x53, height]))]})
+        return {"hash": txid(0xff), "height": height, "previousblockhash": prev, "tx": txs}
+
+    def build_chain(self, length, tag, base=None):
+        """Build a chain where every block spends the previous block's coinbase, and return it with its UTXO set."""
+        blocks = list(base or [self.make_block(0, None, tag=0)])
+        while len(blocks) <= length:
+            prev = blocks[-1]
+            spent = prev["tx"][0] if prev["height"] > 0 else None
+            blocks.append(self.make_block(len(blocks), prev["hash"], tag, spent))
+        utxos = {}
+        for block in blocks[1:]:
+            self.apply(utxos, block)
+        return blocks, utxos
+
+    @staticmethod
+    def apply(utxos, block):
+        for i, tx in enumerate(block["tx"]):
+            for txin in tx["vin"]:
+                if "coinbase" not in txin:
+                    del utxos[(txin["txid"], txin["vout"])]
+            for txout in tx["vout"]:
+                spk = bytes.fromhex(txout["scriptPubKey"]["hex"])
+                if not is_unspendable(spk):
+                    utxos[(tx["txid"], txout["n"])] = (block["height"], i == 0, txout["value"] * COIN, spk)
+
+    @staticmethod
+    def reference_digest(utxos):
+        muhash = MuHash3072()
+        for (txid, n), (height, coinbase, value, spk) in utxos.items():
+            muhash.insert(coin_data(txid, n, height, coinbase, value, spk))
+        return muhash.digest()[::-1].hex()
+
+    def test_connect_and_reorg(self):
+        chain_a, utxos_a = self.build_chain(6, tag=1)
+        tracker = UTXOSetTracker()
+        self.assertEqual(tracker.sync(self.FakeNode(chain_a)), (0, 7))
+        self.assertEqual(tracker.digest(), self.reference_digest(utxos_a))
+        digest_a3 = tracker.digest_at(chain_a[3]["hash"])
+
+        # Reorg to a longer branch forking off after block 3
+        chain_b, utxos_b = self.build_chain(8, tag=2, base=chain_a[:4])
+        self.assertEqual(tracker.sync(self.FakeNode(chain_b)), (3, 5))
+        self.assertEqual(tracker.tip, chain_b[-1]["hash"])
+        self.assertEqual(tracker.digest(), self.reference_digest(utxos_b))
+        self.assertEqual(tracker.digest_at(chain_b[3]["hash"]), digest_a3)
+        self.assertIsNone(tracker.digest_at(chain_a[4]["hash"]))
+
+        # And back to the (now shorter) original branch
+        self.assertEqual(tracker.sync(self.FakeNode(chain_a)), (5, 3))
+        self.assertEqual(tracker.digest(), self.reference_digest(utxos_a))
@@ -4,11 +4,10 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """A limited-functionality wallet, which may replace a real wallet in tests"""
 
-from copy import deepcopy
 from decimal import Decimal
 from enum import Enum
+import heapq
 from typing import (
-    Any,
     List,
     Optional,
 )
@@ -37,10 +36,11 @@ from test_framework.messages import (
 from test_framework.script import (
     CScript,
     LEAF_VERSION_TAPSCRIPT,
+    LegacySignatureHash,
     OP_NOP,
     OP_RETURN,
     OP_TRUE,
-    sign_input_legacy,
+    SIGHASH_ALL,
     taproot_construct,
 )
 from test_framework.script_util import (
@@ -57,6 +57,9 @@ from test_framework.wallet_util import generate_keypair
 
 DEFAULT_FEE = Decimal("0.0001")
 
+# Number of getrawtransaction calls rescan_utxos sends in one JSON-RPC batch
+RESCAN_BATCH_SIZE = 1000
+
 class MiniWalletMode(Enum):
     """Determines the transaction type the MiniWallet is creating and spending.
 
@@ -80,10 +83,118 @@ class MiniWalletMode(Enum):
     RAW_P2PK = 3
 
 
+class UTXOPool:
+    """The MiniWallet's utxos, indexed for fast lookups and spends.
+
+    Utxos are stored in a dict by outpoint (plus the vouts of every txid), and mature
+    utxos in a max-heap by value so that the largest one is found in O(log n). Coinbase
+    outputs wait in a separate heap by height until set_tip_height reaches the height they
+    mature at. Heap entries of utxos that were removed are skipped lazily."""
+
+    def __init__(self):
+        self.clear(tip_height=0)
+
+    def clear(self, *, tip_height):
+        self._by_outpoint = {}
+        self._vouts = {}
+        self._mature = []
+        self._immature = []
+        self._seq = 0
+        self.tip_height = tip_height
+
+    def __len__(self):
+        return len(self._by_outpoint)
+
+    def __iter__(self):
+        return iter(self._by_outpoint.values())
+
+    def _is_mature(self, utxo):
+        return not utxo['coinbase'] or COINBASE_MATURITY - 1 <= self.tip_height - utxo['height']
+
+    def _is_live(self, utxo):
+        return self._by_outpoint.get((utxo['txid'], utxo['vout'])) is utxo
+
+    def _push_mature(self, utxo):
+        # Largest value first, then lowest height. seq keeps the dicts from being compared.
+        self._seq += 1
+        heapq.heappush(self._mature, (-utxo['value'], utxo['height'], self._seq, utxo))
+
+    def add(self, utxo):
+        key = (utxo['txid'], utxo['vout'])
+        self._by_outpoint[key] = utxo
+        self._vouts.setdefault(utxo['txid'], set()).add(utxo['vout'])
+        if self._is_mature(utxo):
+            self._push_mature(utxo)
+        else:
+            self._seq += 1
+            heapq.heappush(self._immature, (utxo['height'], self._seq, utxo))
+
+    def remove(self, utxo):
+        del self._by_outpoint[(utxo['txid'], utxo['vout'])]
+        vouts = self._vouts[utxo['txid']]
+        vouts.discard(utxo['vout'])
+        if not vouts:
+            del self._vouts[utxo['txid']]
+        # Rebuild the heaps once they are mostly made up of stale entries
+        if len(self._mature) + len(self._immature) > 2 * len(self._by_outpoint) + 1000:
+            utxos = list(self._by_outpoint.values())
+            self._mature = []
+            self._immature = []
+            self._by_outpoint = {}
+            for utxo in utxos:
+                self.add(utxo)
+
+    def set_tip_height(self, tip_height):
+        self.tip_height = tip_height
+        while self._immature and self._is_mature(self._immature[0][2]):
+            utxo = heapq.heappop(self._immature)[2]
+            if self._is_live(utxo):
+                self._push_mature(utxo)
+
+    def find(self, txid, vout=None, confirmed_only=False):
+        """Return the utxo for an outpoint, or the smallest utxo of a txid if vout is None.
+        Raises StopIteration if there is none."""
+        if vout is not None:
+            candidates = [self._by_outpoint.get((txid, vout))]
+        else:
+            candidates = [self._by_outpoint[(txid, n)] for n in self._vouts.get(txid, ())]
+        candidates = [u for u in candidates if u is not None and (u['confirmations'] > 0 or not confirmed_only)]
+        if not candidates:
+            raise StopIteration
+        return min(candidates, key=lambda u: (u['value'], -u['height']))
+
+    def largest(self, confirmed_only=False):
+        """Return the largest mature utxo. Raises StopIteration if there is none."""
+        skipped = []
+        try:
+            while self._mature:
+                entry = self._mature[0]
+                if not self._is_live(entry[3]):
+                    heapq.heappop(self._mature)
+                elif not self._is_mature(entry[3]):
+                    # The tip went back (a reorg) since the utxo matured
+                    heapq.heappop(self._mature)
+                    self._seq += 1
+                    heapq.heappush(self._immature, (entry[3]['height'], self._seq, entry[3]))
+                elif confirmed_only and entry[3]['confirmations'] <= 0:
+                    skipped.append(heapq.heappop(self._mature))
+                else:
+                    return entry[3]
+            raise StopIteration
+        finally:
+            for entry in skipped:
+                heapq.heappush(self._mature, entry)
+
+    def mature(self):
+        return (u for u in self._by_outpoint.values() if self._is_mature(u))
+
+
 class MiniWallet:
     def __init__(self, test_node, *, mode=MiniWalletMode.ADDRESS_OP_TRUE):
         self._test_node = test_node
-        self._utxos = []
+        self._utxos = UTXOPool()
+        # Decoded mempool transactions, so rescans only fetch the ones they haven't seen yet
+        self._mempool_txs = {}
         self._mode = mode
 
         assert isinstance(mode, MiniWalletMode)
@@ -126,11 +237,12 @@ class MiniWallet:
 
     def rescan_utxos(self, *, include_mempool=True):
         """Drop all utxos and rescan the utxo set"""
-        self._utxos = []
         res = self._test_node.scantxoutset(action="start", scanobjects=[self.get_descriptor()])
         assert_equal(True, res['success'])
+        # The tip height is cached here (and so on generate) to tell mature coinbase outputs apart
+        self._utxos.clear(tip_height=res['height'])
         for utxo in res['unspents']:
-            self._utxos.append(
+            self._utxos.add(
                 self._create_utxo(txid=utxo["txid"],
                                   vout=utxo["vout"],
                                   value=utxo["amount"],
@@ -139,10 +251,19 @@ class MiniWallet:
                                   confirmations=res["height"] - utxo["height"] + 1))
         if include_mempool:
             mempool = self._test_node.getrawmempool(verbose=True)
+            self._mempool_txs = {txid: tx for txid, tx in self._mempool_txs.items() if txid in mempool}
+            missing = [txid for txid in mempool if txid not in self._mempool_txs]
+            for i in range(0, len(missing), RESCAN_BATCH_SIZE):
+                requests = [self._test_node.getrawtransaction.get_request(txid=txid, verbose=True) for txid in missing[i:i + RESCAN_BATCH_SIZE]]
+                for response in self._test_node.batch(requests):
+                    # Skip transactions that were mined or evicted since getrawmempool
+                    if response.get('error') is None:
+                        self._mempool_txs[response['result']['txid']] = response['result']
             # Sort tx by ancestor count. See BlockAssembler::SortForBlock in src/node/miner.cpp
             sorted_mempool = sorted(mempool.items(), key=lambda item: (item[1]["ancestorcount"], int(item[0], 16)))
             for txid, _ in sorted_mempool:
-                self.scan_tx(self._test_node.getrawtransaction(txid=txid, verbose=True))
+                if txid in self._mempool_txs:
+                    self.scan_tx(self._mempool_txs[txid])
 
     def scan_tx(self, tx):
         """Scan the tx and adjust the internal list of owned utxos"""
@@ -157,7 +278,7 @@ class MiniWallet:
                 pass
         for out in tx['vout']:
             if out['scriptPubKey']['hex'] == self._scriptPubKey.hex():
-                self._utxos.append(self._create_utxo(txid=tx["txid"], vout=out["n"], value=out["value"], height=0, coinbase=False, confirmations=0))
+                self._utxos.add(self._create_utxo(txid=tx["txid"], vout=out["n"], value=out["value"], height=0, coinbase=False, confirmations=0))
 
     def scan_txs(self, txs):
         for tx in txs:
@@ -169,12 +290,16 @@ class MiniWallet:
             # 65 bytes: high-R val (33 bytes) + low-S val (32 bytes)
             # with the DER header/skeleton data of 6 bytes added, plus 2 bytes scriptSig overhead
             # (OP_PUSHn and SIGHASH_ALL), this leads to a scriptSig target size of 73 bytes
-            tx.vin[0].scriptSig = b''
-            while not len(tx.vin[0].scriptSig) == 73:
-                tx.vin[0].scriptSig = b''
-                sign_input_legacy(tx, 0, self._scriptPubKey, self._priv_key)
-                if not fixed_length:
+            # The signature hash doesn't cover the scriptSig, so compute it once and only
+            # redo the signature until it has the right size.
+            (sighash, err) = LegacySignatureHash(self._scriptPubKey, tx, 0, SIGHASH_ALL)
+            assert err is None
+            while True:
+                der_sig = self._priv_key.sign_ecdsa(sighash)
+                tx.vin[0].scriptSig = CScript([der_sig + bytes([SIGHASH_ALL])])
+                if len(tx.vin[0].scriptSig) == 73 or not fixed_length:
                     break
+            tx.rehash()
         elif self._mode == MiniWalletMode.RAW_OP_TRUE:
             for i in tx.vin:
                 i.scriptSig = CScript([OP_NOP] * 43)  # pad to identical size
@@ -208,6 +333,10 @@ class MiniWallet:
         assert_equal(self._mode, MiniWalletMode.ADDRESS_OP_TRUE)
         return self._address
 
+    def _update_tip_height(self):
+        """Judge coinbase maturity at the current tip, which blocks mined elsewhere may have moved"""
+        self._utxos.set_tip_height(self._test_node.getblockchaininfo()['blocks'])
+
     def get_utxo(self, *, txid: str = '', vout: Optional[int] = None, mark_as_spent=True, confirmed_only=False) -> dict:
         """
         Returns a utxo and marks it as spent (pops it from the internal list)
@@ -215,35 +344,31 @@ class MiniWallet:
         Args:
         txid: get the first utxo we find from a specific transaction
         """
-        self._utxos = sorted(self._utxos, key=lambda k: (k['value'], -k['height']))  # Put the largest utxo last
-        blocks_height = self._test_node.getblockchaininfo()['blocks']
-        mature_coins = list(filter(lambda utxo: not utxo['coinbase'] or COINBASE_MATURITY - 1 <= blocks_height - utxo['height'], self._utxos))
+        self._update_tip_height()
         if txid:
-            utxo_filter: Any = filter(lambda utxo: txid == utxo['txid'], self._utxos)
+            utxo = self._utxos.find(txid, vout, confirmed_only)
         else:
-            utxo_filter = reversed(mature_coins)  # By default the largest utxo
-        if vout is not None:
-            utxo_filter = filter(lambda utxo: vout == utxo['vout'], utxo_filter)
-        if confirmed_only:
-            utxo_filter = filter(lambda utxo: utxo['confirmations'] > 0, utxo_filter)
-        index = self._utxos.index(next(utxo_filter))
+            utxo = self._utxos.largest(confirmed_only)  # By default the largest utxo
+            if vout is not None and utxo['vout'] != vout:
+                utxo = next(u for u in sorted(self._utxos.mature(), key=lambda u: (-u['value'], u['height']))
+                            if u['vout'] == vout and (u['confirmations'] > 0 or not confirmed_only))
         if mark_as_spent:
-            return self._utxos.pop(index)
-        else:
-            return self._utxos[index]
+            self._utxos.remove(utxo)
+        return utxo
 
     def get_utxos(self, *, include_immature_coinbase=False, mark_as_spent=True, confirmed_only=False):
         """Returns the list of all utxos and optionally mark them as spent"""
         if not include_immature_coinbase:
-            blocks_height = self._test_node.getblockchaininfo()['blocks']
-            utxo_filter = filter(lambda utxo: not utxo['coinbase'] or COINBASE_MATURITY - 1 <= blocks_height - utxo['height'], self._utxos)
+            self._update_tip_height()
+            utxo_filter = self._utxos.mature()
         else:
-            utxo_filter = self._utxos
+            utxo_filter = iter(self._utxos)
         if confirmed_only:
             utxo_filter = filter(lambda utxo: utxo['confirmations'] > 0, utxo_filter)
-        utxos = deepcopy(list(utxo_filter))
+        # Utxo dicts only hold immutable values, so a shallow copy of each is enough
+        utxos = [dict(utxo) for utxo in utxo_filter]
         if mark_as_spent:
-            self._utxos = []
+            self._utxos.clear(tip_height=self._utxos.tip_height)
         return utxos
 
     def send_self_transfer(self, *, from_node, **kwargs):
@@ -370,7 +495,9 @@ class MiniWallet:
 
     def sendrawtransaction(self, *, from_node, tx_hex, maxfeerate=0, **kwargs):
         txid = from_node.sendrawtransaction(hexstring=tx_hex, maxfeerate=maxfeerate, **kwargs)
-        self.scan_tx(from_node.decoderawtransaction(tx_hex))
+        tx = from_node.decoderawtransaction(tx_hex)
+        self._mempool_txs[txid] = tx
+        self.scan_tx(tx)
         return txid
 
     def create_self_transfer_chain(self, *, chain_length, utxo_to_spend=None):
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import json
+import socket
+import threading
+from time import monotonic, sleep
+
+import yaml
+from commander import Commander
+from test_framework.p2p import P2PInterface, p2p_lock
+
+
+class AddrCrawler(P2PInterface):
+    """Connects to one tank, lets P2PInterface send getaddr after the handshake
+    and records every address the tank hands back.
+
+    The answer is best-effort: Bitcoin Core only answers the first getaddr of an
+    inbound connection, delays the reply by a random trickle of about 30 seconds,
+    never sends an empty one, and leaves out the private addresses tanks have on a
+    cluster network. Many tanks won't answer before --timeout."""
+
+    def __init__(self, node):
+        super().__init__(support_addrv2=True)
+        self.node = node
+        self.addrs = set()
+        self.responses = 0
+
+    def on_addr(self, message):
+        self.record(message.addrs)
+
+    def on_addrv2(self, message):
+        self.record(message.addrs)
+
+    def record(self, addrs):
+        for addr in addrs:
+            self.addrs.add(f"{addr.ip}:{addr.port}")
+        self.responses += 1
+
+
+class TopologyCrawler(Commander):
+    def set_test_params(self):
+        self.num_nodes = 0
+        self.crawlers = []
+        self.peers = {}
+
+    def add_options(self, parser):
+        parser.description = (
+            "Crawl every tank over p2p and RPC at once and export the live network topology"
+        )
+        parser.usage = "warnet run /path/to/topology_crawler.py [options]"
+        parser.add_argument(
+            "--timeout",
+            dest="timeout",
+            default=10,
+            type=int,
+            help="Seconds to wait for tanks to answer getaddr, which is best-effort: many "
+            "won't (default 10)",
+        )
+        parser.add_argument(
+            "--p2p-only",
+            dest="p2p_only",
+            action="store_true",
+            help="Skip getpeerinfo and build the graph from the best-effort getaddr replies "
+            "alone",
+        )
+        parser.add_argument(
+            "--network-file",
+            dest="network_file",
+            default=None,
+            type=str,
+            help="network.yaml whose addnode lists the live topology is compared against",
+        )
+        parser.add_argument(
+            "--output",
+            dest="output",
+            default="topology.json",
+            type=str,
+            help="Where to write the topology graph (default topology.json)",
+        )
+
+    def resolve_tank(self, addr, by_ip):
+        """Map a "host:port" peer address to a tank name, or None for outsiders.
+
+        Inbound peers show up by pod IP, outbound addnode peers by their
+        service hostname, which starts with the tank name."""
+        host = addr.rsplit(":", 1)[0].strip("[]")
+        if host in by_ip:
+            return by_ip[host]
+        name = host.split(".")[0]
+        if name in self.tanks:
+            return name
+        try:
+            return by_ip.get(socket.gethostbyname(host))
+        except OSError:
+            return None
+
+    def get_peers(self, node):
+        try:
+            self.peers[node.tank] = [peer["addr"] for peer in node.getpeerinfo()]
+        except Exception as e:
+            self.log.error(f"Couldn't get peers from {node.tank}: {e}")
+
+    def crawl(self):
+        """Open a p2p connection to every tank at once and wait for getaddr replies,
+        until all tanks answered or --timeout passed.
+
+        All connections share the one NetworkThread event loop, so the crawl
+        takes about as long as the slowest tank instead of the sum of all."""
+        start = monotonic()
+        for node in self.nodes:
+            host, port = self.p2p_target(node)
+            crawler = AddrCrawler(node)
+            crawler.peer_connect(dstaddr=host, dstport=port, net=node.chain, timeout_factor=1)()
+            self.crawlers.append(crawler)
+
+        if not self.options.p2p_only:
+            rpc_threads = [threading.Thread(target=self.get_peers, args=(n,)) for n in self.nodes]
+            for thread in rpc_threads:
+                thread.start()
+
+        deadline = start + self.options.timeout
+        while monotonic() < deadline:
+            with p2p_lock:
+                pending = sum(1 for c in self.crawlers if c.responses == 0)
+            if pending == 0:
+                break
+            sleep(0.1)
+
+        if not self.options.p2p_only:
+            for thread in rpc_threads:
+                thread.join()
+        self.log.info(f"Crawled {len(self.crawlers)} tanks in {monotonic() - start:.2f}s")
+
+        for crawler in self.crawlers:
+            crawler.peer_disconnect()
+
+    def expected_edges(self):
+        with open(self.options.network_file) as f:
+            network = yaml.safe_load(f)
+        edges = set()
+        for node in network["nodes"]:
+            for peer in node.get("addnode", []):
+                edges.add(tuple(sorted((node["name"], peer))))
+        return edges
+
+    def run_test(self):
+        by_ip = {node.rpchost: node.tank for node in self.nodes}
+        self.crawl()
+
+        graph = {"tanks": {}, "edges": {}}
+        addr_edges = set()
+        peer_edges = set()
+        with p2p_lock:
+            for crawler in self.crawlers:
+                name = crawler.node.tank
+                known = sorted(crawler.addrs)
+                graph["tanks"][name] = {
+                    "ip": crawler.node.rpchost,
+                    "answered_getaddr": crawler.responses > 0,
+                    "getaddr": known,
+                    "init_peers": crawler.node.init_peers,
+                }
+                for addr in known:
+                    other = self.resolve_tank(addr, by_ip)
+                    if other and other != name:
+                        addr_edges.add(tuple(sorted((name, other))))
+
+        for name, addrs in self.peers.items():
+            connected = sorted({self.resolve_tank(addr, by_ip) or addr for addr in addrs})
+            graph["tanks"][name]["peers"] = connected
+            for other in connected:
+                if other in self.tanks and other != name:
+                    peer_edges.add(tuple(sorted((name, other))))
+
+        silent = [name for name, tank in graph["tanks"].items() if not tank["answered_getaddr"]]
+        if silent:
+            # Expected for many tanks, see AddrCrawler
+            self.log.info(f"{len(silent)} of {len(graph['tanks'])} tanks did not answer getaddr")
+        graph["edges"]["getaddr"] = sorted(addr_edges)
+        self.log.info(f"getaddr revealed {len(addr_edges)} tank-to-tank edges")
+        # Live connections are the ground truth when we have them. getaddr only shows
+        # which tanks know about each other, as far as they answered (see AddrCrawler).
+        live_edges = peer_edges if not self.options.p2p_only else addr_edges
+        if not self.options.p2p_only:
+            graph["edges"]["getpeerinfo"] = sorted(peer_edges)
+            self.log.info(f"getpeerinfo revealed {len(peer_edges)} live tank-to-tank edges")
+
+        if self.options.network_file:
+            expected = self.expected_edges()
+            missing = sorted(expected - live_edges)
+            unexpected = sorted(live_edges - expected)
+            graph["edges"]["expected"] = sorted(expected)
+            graph["diff"] = {"missing": missing, "unexpected": unexpected}
+            self.log.info(
+                f"Compared against {len(expected)} addnode edges: "
+                f"{len(missing)} missing, {len(unexpected)} unexpected"
+            )
+            for a, b in missing:
+                self.log.warning(f"  missing {a} <-> {b}")
+
+        with open(self.options.output, "w") as f:
+            json.dump(graph, f, indent=2)
+        self.log.info(f"Wrote topology of {len(graph['tanks'])} tanks to {self.options.output}")
+
+
+def main():
+    TopologyCrawler().main()
+
+
+if __name__ == "__main__":
+    main()
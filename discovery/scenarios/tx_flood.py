@@ -1,21 +1,238 @@
 #!/usr/bin/env python3
 
+import json
+import queue
+import random
 import threading
-from random import choice, randrange
-from time import sleep
+from bisect import bisect
+from collections import Counter, deque
+from itertools import accumulate
+from math import ceil
+from time import monotonic, sleep, time
 
+import yaml
 from commander import Commander
+from test_framework.messages import COIN, CTransaction, CTxOut
+
+# Seconds a tank without enough balance sits out before it is asked to send again
+UNFUNDED_BACKOFF = 30
+# Weighted draws for a ready sender before falling back to a scan of all idle tanks
+SENDER_DRAWS = 8
+# Outputs per pre-split transaction, keeping each one well below the standard size limit
+MAX_SPLIT_OUTPUTS = 2000
+# Recent blocks' txids kept by the telemetry, so every tank doesn't fetch the same block
+BLOCK_CACHE_SIZE = 6
+# Blocks below a reorged-out tip the telemetry rescans on the new chain
+REORG_RESCAN_DEPTH = 6
+# Most blocks the telemetry walks back in one sample, after a long gap or a deep reorg
+MAX_MINED_SCAN = 144
+
+
+def arrivals(profile, rate, rng, *, ramp_to=None, ramp_duration=0):
+    """Yield the offsets (seconds from start) at which transactions are due.
+
+    constant: evenly spaced at `rate` tx/s
+    poisson: exponentially distributed gaps with mean 1/`rate`
+    ramp: evenly spaced, with the rate going linearly from `rate` to `ramp_to`
+          over `ramp_duration` seconds and staying there afterwards"""
+    t = 0.0
+    while True:
+        if profile == "ramp":
+            progress = min(t / ramp_duration, 1) if ramp_duration > 0 else 1
+            current = rate + (ramp_to - rate) * progress
+        else:
+            current = rate
+        if profile == "poisson":
+            t += rng.expovariate(current)
+        else:
+            t += 1 / current
+        yield t
+
+
+def economic_weights(network_file, tank_names, min_share):
+    """Read BCAP metadata from a network.yaml and return per-tank (send, receive) weights.
+
+    Tanks send in proportion to daily_volume_btc and receive in proportion to
+    daily_deposits_btc (falling back to daily_volume_btc). Tanks without metadata, like
+    constrained user nodes, get `min_share` of the average weight, so they send almost nothing."""
+    with open(network_file) as f:
+        network = yaml.safe_load(f)
+    metadata = {node["name"]: node.get("metadata") or {} for node in network["nodes"]}
+    send = {}
+    receive = {}
+    for name in tank_names:
+        meta = metadata.get(name, {})
+        volume = float(meta.get("daily_volume_btc", 0))
+        send[name] = volume
+        receive[name] = float(meta.get("daily_deposits_btc", volume))
+    for weights in (send, receive):
+        floor = min_share * (sum(weights.values()) / len(weights) if weights else 0) or 1
+        for name in weights:
+            weights[name] = max(weights[name], floor)
+    return send, receive
+
+
+class FloodStats:
+    """Counters shared by the scheduler and the workers, reset every report."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.due = 0
+        self.sent = 0
+        self.errors = 0
+        self.dropped = 0
+        self.delays = []
+        self.per_tank = Counter()
+
+    def snapshot(self):
+        with self.lock:
+            snap = dict(vars(self))
+            self.due = self.sent = self.errors = self.dropped = 0
+            self.delays = []
+            self.per_tank = Counter()
+        del snap["lock"]
+        return snap
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 3) if values else None
+
+
+class PropagationTelemetry:
+    """Follows flood transactions through the tanks' mempools.
+
+    Every sample takes one getrawmempool per tank and diffs it against the previous
+    sample, so the cost doesn't grow with the number of transactions sent. A transaction
+    that leaves a tank's mempool without being in a block on that tank's chain counts as
+    evicted there. First-seen times are only as precise as the sampling interval."""
+
+    def __init__(self, window):
+        self.lock = threading.Lock()
+        # Transactions are dropped once mined, or `window` seconds after being sent
+        self.window = window
+        # txid -> {"sent": monotonic time, "seen": {node index: first seen}}
+        self.txs = {}
+        # node index -> tracked txids in its mempool at the last sample
+        self.mempools = {}
+        # node index -> (best block hash, height) at the last sample
+        self.best_blocks = {}
+        # block hash -> (txids, previous block hash)
+        self.blocks = {}
+        self.sent = 0
+
+    def record(self, txid, sender, sent_at):
+        with self.lock:
+            self.txs[txid] = {"sent": sent_at, "seen": {sender: sent_at}}
+            self.sent += 1
+
+    def get_block(self, node, block_hash):
+        with self.lock:
+            cached = self.blocks.get(block_hash)
+        if cached is None:
+            block = node.getblock(block_hash)
+            cached = (block["tx"], block.get("previousblockhash"))
+            with self.lock:
+                self.blocks[block_hash] = cached
+                while len(self.blocks) > BLOCK_CACHE_SIZE:
+                    del self.blocks[next(iter(self.blocks))]
+        return cached
+
+    def mined_txids(self, node):
+        """Return the txids of the blocks the node connected since the last call for it.
+
+        The walk back from the tip stops at the height of the last block seen. If that
+        block was reorged out, the last REORG_RESCAN_DEPTH blocks below it are scanned
+        again on the new chain. No more than MAX_MINED_SCAN blocks are fetched either way."""
+        txids = set()
+        best = node.getbestblockhash()
+        last = self.best_blocks.get(node.index)
+        if last is not None and last[0] == best:
+            return txids
+        height = node.getblockheader(best)["height"]
+        if last is not None:
+            last_hash, stop_height = last
+            if node.getblockheader(last_hash)["confirmations"] == -1:
+                stop_height -= REORG_RESCAN_DEPTH
+            stop_height = max(stop_height, height - MAX_MINED_SCAN)
+            block_hash, block_height = best, height
+            while block_hash is not None and block_height > stop_height:
+                block_txids, block_hash = self.get_block(node, block_hash)
+                txids.update(block_txids)
+                block_height -= 1
+        self.best_blocks[node.index] = (best, height)
+        return txids
+
+    def sample(self, mempools, mined, now):
+        """Apply one round of getrawmempool results (node index -> txids), and the txids
+        each of those nodes saw mined since its last sample, and return a time-series
+        record."""
+        with self.lock:
+            mined_anywhere = set().union(*mined.values())
+            delays = []
+            evicted = Counter()
+            for index, raw in mempools.items():
+                current = {txid for txid in raw if txid in self.txs}
+                previous = self.mempools.get(index, set())
+                for txid in current - previous:
+                    tx = self.txs[txid]
+                    if index not in tx["seen"]:
+                        tx["seen"][index] = now
+                        delays.append(now - tx["sent"])
+                for txid in previous - current:
+                    if txid not in mined[index] and txid in self.txs:
+                        evicted[index] += 1
+                self.mempools[index] = current
+            confirmed = 0
+            for txid in list(self.txs):
+                if txid in mined_anywhere or now - self.txs[txid]["sent"] > self.window:
+                    confirmed += txid in mined_anywhere
+                    del self.txs[txid]
+            tanks = len(mempools) or 1
+            reach = [len(tx["seen"]) / tanks for tx in self.txs.values()]
+            record = {
+                "time": int(time()),
+                "sent": self.sent,
+                "tracked": len(self.txs),
+                "confirmed": confirmed,
+                "reach_mean": round(sum(reach) / len(reach), 3) if reach else None,
+                "reach_full": round(sum(r >= 1 for r in reach) / len(reach), 3) if reach else None,
+                "ttm_p50": percentile(delays, 0.5),
+                "ttm_p90": percentile(delays, 0.9),
+                "ttm_max": percentile(delays, 1),
+                "evicted": dict(evicted),
+                "in_mempool": {index: len(txids) for index, txids in self.mempools.items()},
+            }
+            self.sent = 0
+        return record
 
 
 class TXFlood(Commander):
     def set_test_params(self):
         self.num_nodes = 1
-        self.addrs = []
-        self.threads = []
+        self.addrs = {}
+        self.wallets = {}
+        # Pre-split coins by node index: deques of (txid, vout, value in sats)
+        self.coins = {}
+        self.split_txids = {}
+        self.stats = FloodStats()
+        self.work = queue.Queue()
+        # The token bucket: transactions that are due but wait for a tank to be ready
+        self.tokens = deque()
+        # Sender bookkeeping, all by node index and guarded by idle_lock. A tank is idle
+        # while it has fewer transactions in flight than slots.
+        self.idle = set()
+        self.idle_lock = threading.Lock()
+        self.telemetry = None
+        self.inflight = {}
+        self.slots = {}
+        self.ready_at = {}
+        self.rng = random.Random()
 
     def add_options(self, parser):
         parser.description = (
-            "Sends random transactions between all nodes with available balance in their wallet"
+            "Sends random transactions between all nodes with available balance in their wallet, "
+            "at a network-wide target rate"
         )
         parser.usage = "warnet run /path/to/tx_flood.py [options]"
         parser.add_argument(
@@ -23,48 +240,451 @@ class TXFlood(Commander):
             dest="interval",
             default=10,
             type=int,
-            help="Number of seconds between TX generation (default 10 seconds)",
+            help="Seconds between transactions per tank, used when --rate is not set (default 10)",
+        )
+        parser.add_argument(
+            "--rate",
+            dest="rate",
+            default=None,
+            type=float,
+            help="Network-wide target in transactions per second (default: tanks / interval)",
+        )
+        parser.add_argument(
+            "--profile",
+            dest="profile",
+            default="constant",
+            choices=["constant", "poisson", "ramp"],
+            help="How transactions are spread over time (default constant)",
+        )
+        parser.add_argument(
+            "--ramp-to",
+            dest="ramp_to",
+            default=None,
+            type=float,
+            help="Target tx/s at the end of the ramp profile (default: 10x --rate)",
+        )
+        parser.add_argument(
+            "--ramp-duration",
+            dest="ramp_duration",
+            default=600,
+            type=int,
+            help="Seconds the ramp profile takes to reach --ramp-to (default 600)",
+        )
+        parser.add_argument(
+            "--burst",
+            dest="burst",
+            default=None,
+            type=int,
+            help="Due transactions that may queue up while all tanks are busy before new ones are "
+            "dropped (default: 10 seconds worth at the target rate)",
+        )
+        parser.add_argument(
+            "--workers",
+            dest="workers",
+            default=16,
+            type=int,
+            help="Number of threads sending RPCs, independent of the number of tanks (default 16)",
+        )
+        parser.add_argument(
+            "--report-interval",
+            dest="report_interval",
+            default=10,
+            type=int,
+            help="Seconds between rate reports (default 10)",
+        )
+        parser.add_argument(
+            "--workload",
+            dest="workload",
+            default="uniform",
+            choices=["uniform", "economic"],
+            help="uniform: every tank sends alike; economic: tanks send and receive in proportion "
+            "to their BCAP volume metadata, read from --network-file (default uniform)",
+        )
+        parser.add_argument(
+            "--network-file",
+            dest="network_file",
+            default=None,
+            type=str,
+            help="network.yaml with the BCAP metadata used by --workload economic",
+        )
+        parser.add_argument(
+            "--min-share",
+            dest="min_share",
+            default=0.001,
+            type=float,
+            help="Weight of tanks without volume metadata, relative to the average tank "
+            "(default 0.001)",
+        )
+        parser.add_argument(
+            "--telemetry-file",
+            dest="telemetry_file",
+            default=None,
+            type=str,
+            help="Sample every tank's mempool and append propagation metrics (time-to-mempool, "
+            "reach, evictions) to this file as JSON lines",
+        )
+        parser.add_argument(
+            "--telemetry-interval",
+            dest="telemetry_interval",
+            default=2,
+            type=float,
+            help="Seconds between mempool samples, which bounds the time-to-mempool precision "
+            "(default 2)",
+        )
+        parser.add_argument(
+            "--telemetry-window",
+            dest="telemetry_window",
+            default=600,
+            type=int,
+            help="Seconds an unconfirmed transaction stays tracked (default 600)",
+        )
+        parser.add_argument(
+            "--presplit",
+            dest="presplit",
+            default=0,
+            type=int,
+            help="Before flooding, split each tank's balance into this many coins and spend "
+            "one coin per transaction (default 0: let the wallet select coins)",
+        )
+        parser.add_argument(
+            "--presplit-timeout",
+            dest="presplit_timeout",
+            default=600,
+            type=float,
+            help="Seconds to wait for the split transactions to confirm. Tanks whose splits "
+            "don't confirm in time let the wallet select coins instead (default 600)",
         )
 
-    def orders(self, node):
-        wallet = self.ensure_miner(node)
-        for address_type in ["legacy", "p2sh-segwit", "bech32", "bech32m"]:
-            self.addrs.append(wallet.getnewaddress(address_type=address_type))
+    def setup_wallet(self, node):
+        try:
+            wallet = self.ensure_miner(node)
+            self.addrs[node.index] = [
+                wallet.getnewaddress(address_type=address_type)
+                for address_type in ["legacy", "p2sh-segwit", "bech32", "bech32m"]
+            ]
+            self.wallets[node.index] = wallet
+            if self.options.presplit:
+                self.presplit(node)
+        except Exception as e:
+            self.log.error(f"node {node.index} wallet setup error: {e}")
+
+    def presplit(self, node):
+        """Fan a tank's balance out into --presplit equal coins in a few large transactions,
+        like ln_init's "helicopter" transaction, so the flood can spend independent coins
+        in parallel instead of chaining through the wallet's few utxos."""
+        wallet = self.wallets[node.index]
+        bal = wallet.getbalance()
+        if bal < 1:
+            self.log.info(f"node {node.index} has no balance to pre-split")
+            return
+        count = self.options.presplit
+        # Leave a tenth of the balance for the split transactions' fees
+        value = int(bal * COIN * 9 / 10) // count
+        spk = bytes.fromhex(wallet.getaddressinfo(self.addrs[node.index][-1])["scriptPubKey"])
+        coins = deque()
+        txids = []
+        for start in range(0, count, MAX_SPLIT_OUTPUTS):
+            num_out = min(MAX_SPLIT_OUTPUTS, count - start)
+            split = CTransaction()
+            split.vout = [CTxOut(value, spk) for _ in range(num_out)]
+            # Keep the outputs at 0..num_out-1 and the change after them
+            rawtx = wallet.fundrawtransaction(split.serialize().hex(), {"changePosition": num_out})
+            signed_tx = wallet.signrawtransactionwithwallet(rawtx["hex"])["hex"]
+            txid = wallet.sendrawtransaction(signed_tx)
+            # Keep sendmany's coin selection off the coins queued for the flood
+            wallet.lockunspent(False, [{"txid": txid, "vout": vout} for vout in range(num_out)])
+            coins.extend((txid, vout, value) for vout in range(num_out))
+            txids.append(txid)
+        self.coins[node.index] = coins
+        self.split_txids[node.index] = txids
+        self.log.info(
+            f"node {node.index} split {bal} BTC into {count} coins in {len(txids)} transactions"
+        )
+
+    def wait_for_presplit(self):
+        """Wait until every split transaction is confirmed, so spending the coins can't hit
+        mempool chain limits. Gives up on a tank's coins after --presplit-timeout."""
+        # Every split transaction is checked: they don't have to spend each other's change
+        pending = {(i, txid) for i, txids in self.split_txids.items() for txid in txids}
+        deadline = monotonic() + self.options.presplit_timeout
+        while pending:
+            for index, txid in sorted(pending):
+                try:
+                    if self.wallets[index].gettransaction(txid)["confirmations"] > 0:
+                        pending.discard((index, txid))
+                except Exception as e:
+                    self.log.warning(f"node {index} error checking split transaction: {e}")
+            if not pending:
+                break
+            tanks = sorted({index for index, _ in pending})
+            if monotonic() >= deadline:
+                self.log.warning(
+                    f"Split transactions of {len(tanks)} tanks did not confirm in "
+                    f"{self.options.presplit_timeout}s, their wallets will select coins instead"
+                )
+                for index in tanks:
+                    del self.coins[index]
+                    try:
+                        self.wallets[index].lockunspent(True)
+                    except Exception as e:
+                        self.log.warning(f"node {index} error unlocking split coins: {e}")
+                return
+            self.log.info(
+                f"Waiting for split transactions of {len(tanks)} tanks to confirm "
+                "(is a miner running?)"
+            )
+            sleep(5)
+
+    def set_weights(self, send, receive):
+        """Set how often each tank (by node index) sends, and how likely it is to be paid.
+
+        A tank's transaction values scale with the square root of its send weight relative
+        to the heaviest sender, and it may have transactions in flight in proportion to
+        its share of the flow."""
+        self.send_weight = send
+        self.senders = sorted(send)
+        self.send_cum = list(accumulate(send[i] for i in self.senders))
+        self.receivers = sorted(receive)
+        self.receive_cum = list(accumulate(receive[i] for i in self.receivers))
+        heaviest = max(send.values())
+        total = self.send_cum[-1]
+        self.value_scale = {i: (send[i] / heaviest) ** 0.5 for i in send}
+        for i in send:
+            self.slots[i] = max(1, ceil(self.options.workers * send[i] / total))
+            self.inflight[i] = 0
+            self.ready_at[i] = 0
+            self.idle.add(i)
+
+    @staticmethod
+    def draw(population, cum_weights, rng):
+        return population[bisect(cum_weights, rng.random() * cum_weights[-1])]
+
+    def release(self, index, delay=0):
+        """Return a tank's slot to the scheduler, usable again after `delay` seconds."""
+        with self.idle_lock:
+            self.inflight[index] -= 1
+            self.idle.add(index)
+            if delay:
+                self.ready_at[index] = monotonic() + delay
+
+    def send(self, node, rng):
+        """Send one transaction from a tank. Returns its txid, or None if it is not funded.
+
+        Spends the tank's next pre-split coin on its own when there is one left, otherwise
+        lets the wallet select coins from its balance. A pre-split coin stays locked in the
+        wallet while it is queued, and goes back to the queue if spending it fails."""
+        wallet = self.wallets[node.index]
+        try:
+            coin = self.coins[node.index].popleft()
+            txid, vout, value = coin
+            budget = value / 2
+        except (KeyError, IndexError):
+            txid = None
+            bal = wallet.getbalance()
+            if bal < 1:
+                return None
+            budget = float(bal / 20) * COIN
+        amounts = {}
+        num_out = rng.randrange(1, (len(self.nodes) // 2) + 1)
+        for _ in range(num_out):
+            sats = int(budget / num_out * self.value_scale[node.index])
+            receiver = self.draw(self.receivers, self.receive_cum, rng)
+            amounts[rng.choice(self.addrs[receiver])] = rng.randrange(sats // 4, sats) / COIN
+        if txid is None:
+            return wallet.sendmany(dummy="", amounts=amounts)
+        outpoint = {"txid": txid, "vout": vout}
+        options = {"inputs": [outpoint], "add_inputs": False}
+        try:
+            wallet.lockunspent(True, [outpoint])
+            return wallet.send(outputs=amounts, options=options)["txid"]
+        except Exception:
+            self.coins[node.index].append(coin)
+            wallet.lockunspent(False, [outpoint])
+            raise
+
+    def worker(self, rng):
         while True:
-            sleep(self.options.interval)
+            node, due_at = self.work.get()
+            started = monotonic()
+            backoff = 0
             try:
-                bal = wallet.getbalance()
-                if bal < 1:
-                    continue
-                amounts = {}
-                num_out = randrange(1, (len(self.nodes) // 2) + 1)
-                for _ in range(num_out):
-                    sats = int(float((bal / 20) / num_out) * 1e8)
-                    amounts[choice(self.addrs)] = randrange(sats // 4, sats) / 1e8
-                wallet.sendmany(dummy="", amounts=amounts)
-                self.log.info(f"node {node.index} sent tx with {num_out} outputs")
+                txid = self.send(node, rng)
+                if txid:
+                    if self.telemetry:
+                        self.telemetry.record(txid, node.index, monotonic())
+                    with self.stats.lock:
+                        self.stats.sent += 1
+                        self.stats.delays.append(started - due_at)
+                        self.stats.per_tank[node.index] += 1
+                else:
+                    # Hand the transaction back so another tank sends it
+                    self.tokens.appendleft(due_at)
+                    backoff = UNFUNDED_BACKOFF
             except Exception as e:
                 self.log.error(f"node {node.index} error: {e}")
+                with self.stats.lock:
+                    self.stats.errors += 1
+            self.release(node.index, backoff)
+
+    def next_tank(self, now):
+        """Take a slot of a ready tank, drawn by send weight, or return None if all are busy."""
+        with self.idle_lock:
+            index = None
+            for _ in range(SENDER_DRAWS):
+                drawn = self.draw(self.senders, self.send_cum, self.rng)
+                if drawn in self.idle and self.ready_at[drawn] <= now:
+                    index = drawn
+                    break
+            if index is None:
+                # Most tanks are busy or backing off: draw among the ones that aren't
+                ready = [i for i in self.idle if self.ready_at[i] <= now]
+                if not ready:
+                    return None
+                index = self.rng.choices(ready, weights=[self.send_weight[i] for i in ready])[0]
+            self.inflight[index] += 1
+            if self.inflight[index] >= self.slots[index]:
+                self.idle.discard(index)
+        return self.by_index[index]
+
+    def sample_mempool(self, node, mempools, mined):
+        try:
+            raw = node.getrawmempool()
+            # Look for mined transactions after the mempool was sampled, so anything that
+            # left it through a block is already in this node's new blocks
+            mined[node.index] = self.telemetry.mined_txids(node)
+            mempools[node.index] = raw
+        except Exception as e:
+            self.log.error(f"node {node.index} error sampling mempool: {e}")
+
+    def watch_propagation(self):
+        tanks = self.nodes
+        start = monotonic()
+        while True:
+            sleep(self.options.telemetry_interval)
+            mempools = {}
+            mined = {}
+            sample_threads = [
+                threading.Thread(target=self.sample_mempool, args=(node, mempools, mined))
+                for node in tanks
+            ]
+            for thread in sample_threads:
+                thread.start()
+            all(thread.join() is None for thread in sample_threads)
+            now = monotonic()
+            record = self.telemetry.sample(mempools, mined, now)
+            record["elapsed"] = round(now - start, 1)
+            record["evicted"] = {self.by_index[i].tank: n for i, n in record["evicted"].items()}
+            record["in_mempool"] = {
+                self.by_index[i].tank: n for i, n in record["in_mempool"].items()
+            }
+            with open(self.options.telemetry_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def report(self, target_rate):
+        last = monotonic()
+        while True:
+            sleep(self.options.report_interval)
+            now = monotonic()
+            window = now - last
+            last = now
+            snap = self.stats.snapshot()
+            attempts = snap["sent"] + snap["errors"]
+            delays = snap["delays"]
+            mean_delay = sum(delays) / len(delays) if delays else 0
+            self.log.info(
+                f"target {target_rate():.2f} tx/s, due {snap['due'] / window:.2f} tx/s, "
+                f"achieved {snap['sent'] / window:.2f} tx/s, "
+                f"queue delay mean {mean_delay:.2f}s max {max(delays, default=0):.2f}s, "
+                f"rpc errors {snap['errors']}/{attempts}"
+                f" ({100 * snap['errors'] / attempts if attempts else 0:.1f}%), "
+                f"dropped {snap['dropped']}, backlog {len(self.tokens)}"
+            )
+            if self.options.workload == "economic" and snap["sent"]:
+                total = self.send_cum[-1]
+                top = ", ".join(
+                    f"{self.by_index[i].tank} {n / snap['sent']:.0%} "
+                    f"(target {self.send_weight[i] / total:.0%})"
+                    for i, n in snap["per_tank"].most_common(5)
+                )
+                self.log.info(f"  top senders: {top}")
 
     def run_test(self):
-        self.log.info(f"Starting TX mess with {len(self.nodes)} threads")
-        for node in self.nodes:
-            sleep(1)  # stagger
-            t = threading.Thread(target=lambda n=node: self.orders(n))
-            t.daemon = False
-            t.start()
-            self.threads.append({"thread": t, "node": node})
-
-        while len(self.threads) > 0:
-            for thread in self.threads:
-                if not thread["thread"].is_alive():
-                    self.log.info(f"restarting thread for node {thread['node'].index}")
-                    thread["thread"] = threading.Thread(
-                        target=lambda n=thread["node"]: self.orders(n)
-                    )
-                    thread["thread"].daemon = False
-                    thread["thread"].start()
-            sleep(30)
+        setup_threads = [threading.Thread(target=self.setup_wallet, args=(n,)) for n in self.nodes]
+        for thread in setup_threads:
+            thread.start()
+        all(thread.join() is None for thread in setup_threads)
+        if self.options.presplit:
+            self.wait_for_presplit()
+
+        self.rng = random.Random(self.options.randomseed)
+        self.by_index = {node.index: node for node in self.nodes}
+        tanks = [node for node in self.nodes if node.index in self.wallets]
+        if not tanks:
+            raise Exception("No tank wallet could be set up to send transactions")
+        if self.options.workload == "economic":
+            assert self.options.network_file, "--workload economic needs --network-file"
+            send, receive = economic_weights(
+                self.options.network_file, [n.tank for n in tanks], self.options.min_share
+            )
+            self.set_weights(
+                {n.index: send[n.tank] for n in tanks}, {n.index: receive[n.tank] for n in tanks}
+            )
+        else:
+            self.set_weights({n.index: 1 for n in tanks}, {n.index: 1 for n in tanks})
+
+        rate = self.options.rate or len(self.nodes) / self.options.interval
+        ramp_to = self.options.ramp_to or 10 * rate
+        burst = self.options.burst or max(1, int(10 * max(rate, ramp_to if self.options.profile == "ramp" else 0)))
+        self.log.info(
+            f"Starting {self.options.workload} TX flood at {rate:.2f} tx/s ({self.options.profile}) "
+            f"across {len(self.wallets)} tanks with {self.options.workers} workers"
+        )
+
+        start = monotonic()
+
+        def target_rate():
+            if self.options.profile != "ramp":
+                return rate
+            ramp_duration = self.options.ramp_duration
+            progress = min((monotonic() - start) / ramp_duration, 1) if ramp_duration > 0 else 1
+            return rate + (ramp_to - rate) * progress
+
+        # Workers record every transaction they send, so the telemetry has to exist first
+        if self.options.telemetry_file:
+            self.telemetry = PropagationTelemetry(self.options.telemetry_window)
+        # The scheduler draws from self.rng, and every worker from its own generator seeded
+        # from it, so a --randomseed run draws the same numbers whatever the thread timing
+        for _ in range(self.options.workers):
+            rng = random.Random(self.rng.getrandbits(64))
+            threading.Thread(target=self.worker, args=(rng,), daemon=True).start()
+        threading.Thread(target=self.report, args=(target_rate,), daemon=True).start()
+        if self.telemetry:
+            threading.Thread(target=self.watch_propagation, daemon=True).start()
+
+        schedule = arrivals(
+            self.options.profile,
+            rate,
+            self.rng,
+            ramp_to=ramp_to,
+            ramp_duration=self.options.ramp_duration,
+        )
+        next_due = start + next(schedule)
+        while True:
+            now = monotonic()
+            while next_due <= now:
+                self.tokens.append(next_due)
+                with self.stats.lock:
+                    self.stats.due += 1
+                    if len(self.tokens) > burst:
+                        self.tokens.popleft()
+                        self.stats.dropped += 1
+                next_due = start + next(schedule)
+            while self.tokens:
+                node = self.next_tank(now)
+                if node is None:
+                    break
+                self.work.put((node, self.tokens.popleft()))
+            sleep(max(0, min(next_due - monotonic(), 0.05)))
 
 
 def main():
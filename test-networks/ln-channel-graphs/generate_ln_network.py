@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+"""
+Generate a large Lightning network (network.yaml) for ln_init.py
+
+Topologies:
+- scale-free:    Barabasi-Albert preferential attachment. Every new node opens
+                 --degree channels to existing nodes, picked in proportion to
+                 how many channels they already have.
+- hub-and-spoke: --hubs economic nodes (exchanges, payment processors) with
+                 channels between each other. Every other node opens --degree
+                 channels, mostly to hubs (bigger hubs more often) and
+                 sometimes to another spoke.
+
+Every channel gets the deterministic id.block/id.index that ln_init.py opens
+it at. Channels are packed CHANNEL_OPENS_PER_BLOCK to a block, starting at
+CHANNEL_OPEN_START_HEIGHT, so the fewest blocks are mined, and no block holds
+more channels than the MAX_FEE_RATE/FEE_RATE_DECREMENT fee ordering allows.
+
+The generator exits with an error, before writing anything, if funding the
+channels takes more than the regtest miner can spend when ln_init.py funds them.
+
+Generation takes time linear in the number of channels.
+"""
+
+import argparse
+import itertools
+import math
+import random
+import sys
+from pathlib import Path
+
+import yaml
+
+# Use the same limits as ln_init.py. ln_framework.params doesn't pull in ln.py's REST/HTTP
+# stack, but needs the in-tree test_framework, so put discovery/scenarios on sys.path.
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "discovery" / "scenarios"))
+from ln_framework.params import (  # noqa: E402
+    CHANNEL_OPEN_START_HEIGHT,
+    CHANNEL_OPENS_PER_BLOCK,
+    FEE_RATE_DECREMENT,
+    FUNDING_TIP_HEIGHT,
+    MAX_FEE_RATE,
+    channel_funding,
+    mature_regtest_subsidy,
+)
+from test_framework.messages import COIN  # noqa: E402
+
+# ln_init.py opens the channel at index i in a block at fee rate
+# MAX_FEE_RATE - i * FEE_RATE_DECREMENT, which has to stay at least 1
+MAX_INDEX = min(CHANNEL_OPENS_PER_BLOCK, (MAX_FEE_RATE - 1) // FEE_RATE_DECREMENT)
+
+# LND's limit on channel size without wumbo channels
+MIN_CAPACITY = 100_000
+MAX_CAPACITY = 16_777_215
+# ln_init.py sends the channel funding in standard transactions (MAX_STANDARD_TX_WEIGHT)
+# of at most this many taproot outputs, and keeps 1 BTC for the fee of each
+FUNDING_OUTPUTS_PER_TX = (400_000 - 1000) // (4 * 43)
+
+HUB_ROLES = ["major_exchange", "payment_processor"]
+# Chance that a spoke's channel goes to another spoke instead of a hub
+SPOKE_LINK_PROBABILITY = 0.2
+
+
+def scale_free_edges(num_nodes, degree, rng):
+    """Barabasi-Albert graph as (source, target) pairs, the source opening the channel"""
+    edges = []
+    # Both ends of every channel so far: a uniform pick from this list picks
+    # a node in proportion to its channel count, in constant time
+    ends = []
+    # Start from a complete graph of degree + 1 nodes
+    for node in range(min(degree + 1, num_nodes)):
+        for target in range(node):
+            edges.append((node, target))
+            ends += [node, target]
+    for node in range(degree + 1, num_nodes):
+        targets = set()
+        while len(targets) < degree:
+            targets.add(rng.choice(ends))
+        for target in sorted(targets):
+            edges.append((node, target))
+            ends += [node, target]
+    return edges
+
+
+def hub_and_spoke_edges(num_nodes, hubs, degree, rng):
+    """Hub-and-spoke graph as (source, target) pairs, the source opening the channel"""
+    hubs = min(hubs, num_nodes)
+    edges = [(node, target) for node in range(hubs) for target in range(node)]
+    # Hub sizes follow Zipf's law: the first hub is the biggest
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(hubs)))
+    for node in range(hubs, num_nodes):
+        targets = set()
+        while len(targets) < min(degree, node):
+            if node > hubs and rng.random() < SPOKE_LINK_PROBABILITY:
+                targets.add(rng.randrange(hubs, node))
+            else:
+                targets.add(rng.choices(range(hubs), cum_weights=cum_weights)[0])
+        edges.extend((node, target) for target in sorted(targets))
+    return edges
+
+
+def channel_capacity(rng, hub_channel):
+    """Log-uniform capacity in sats, from the upper half of the range for hub channels"""
+    low = math.log(MIN_CAPACITY)
+    high = math.log(MAX_CAPACITY)
+    if hub_channel:
+        low = (low + high) / 2
+    return min(MAX_CAPACITY, int(round(math.exp(rng.uniform(low, high)), -3)))
+
+
+def channel_policy(rng, capacity):
+    """Random channel_update policy, with the BOLT 7 field names ln_init.py expects"""
+    fee_rate = int(rng.lognormvariate(math.log(100), 1))
+    return {
+        "cltv_expiry_delta": rng.choice([40, 80, 144]),
+        "htlc_minimum_msat": 1000,
+        "fee_base_msat": rng.choice([0, 1000]),
+        "fee_proportional_millionths": min(5000, max(1, fee_rate)),
+        # Leave room for the channel reserve
+        "htlc_maximum_msat": capacity * 1000 * 99 // 100,
+    }
+
+
+def assign_channel_ids(channels, start_height):
+    """Give the channels consecutive indexes, starting a new block every MAX_INDEX channels"""
+    for n, ch in enumerate(channels):
+        ch["id"] = {"block": start_height + n // MAX_INDEX, "index": n % MAX_INDEX + 1}
+
+
+def funding_needed(opened_by):
+    """Sats ln_init.py takes from the miner: every channel opener gets one UTXO per
+    channel, each as big as its largest channel needs, plus the funding fees."""
+    total = 0
+    outputs = 0
+    for channels in opened_by.values():
+        if channels:
+            total += len(channels) * max(channel_funding(ch) for ch in channels)
+            outputs += len(channels)
+    return total + math.ceil(outputs / FUNDING_OUTPUTS_PER_TX) * COIN
+
+
+def tank_name(node):
+    return f"tank-{node:04d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=1000, help="Number of LN nodes (default 1000)")
+    parser.add_argument(
+        "--topology",
+        choices=["scale-free", "hub-and-spoke"],
+        default="scale-free",
+        help="Channel graph shape (default scale-free)",
+    )
+    parser.add_argument(
+        "--degree", type=int, default=2, help="Channels opened by every new node (default 2)"
+    )
+    parser.add_argument(
+        "--hubs", type=int, default=10, help="Number of hubs for hub-and-spoke (default 10)"
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default 42)")
+    parser.add_argument(
+        "--start-height",
+        type=int,
+        default=CHANNEL_OPEN_START_HEIGHT,
+        help=f"Block of the first channel opens (default {CHANNEL_OPEN_START_HEIGHT})",
+    )
+    parser.add_argument(
+        "--output", default="network.yaml", help="Output file (default network.yaml)"
+    )
+    args = parser.parse_args()
+    if args.degree < 1 or args.hubs < 1:
+        parser.error("--degree and --hubs must be at least 1")
+    # ln_init.py mines and funds the channels up to CHANNEL_OPEN_START_HEIGHT
+    if args.start_height < CHANNEL_OPEN_START_HEIGHT:
+        parser.error(f"--start-height must be at least {CHANNEL_OPEN_START_HEIGHT}")
+
+    rng = random.Random(args.seed)  # For reproducibility
+
+    if args.topology == "scale-free":
+        edges = scale_free_edges(args.nodes, args.degree, rng)
+        hubs = 0
+    else:
+        edges = hub_and_spoke_edges(args.nodes, args.hubs, args.degree, rng)
+        hubs = min(args.hubs, args.nodes)
+
+    # Channels opened by each node, in the order they go in blocks
+    channels = []
+    opened_by = {node: [] for node in range(args.nodes)}
+    for source, target in edges:
+        capacity = channel_capacity(rng, target < hubs)
+        ch = {
+            "target": f"{tank_name(target)}-ln",
+            "capacity": capacity,
+            "push_amt": capacity // 2 if rng.random() < 0.5 else 0,
+            "source_policy": channel_policy(rng, capacity),
+            "target_policy": channel_policy(rng, capacity),
+        }
+        channels.append(ch)
+        opened_by[source].append(ch)
+    assign_channel_ids(channels, args.start_height)
+
+    funding = funding_needed(opened_by)
+    available = mature_regtest_subsidy(FUNDING_TIP_HEIGHT)
+    if funding > available:
+        sys.exit(
+            f"Error: funding {len(channels)} channels takes {funding / COIN:.2f} BTC, but the "
+            f"miner can only spend {available / COIN:.2f} BTC of regtest block subsidy at "
+            f"height {FUNDING_TIP_HEIGHT}. Use fewer nodes or a lower --degree."
+        )
+
+    nodes = []
+    for node in range(args.nodes):
+        # L1 ring, plus one random chord to keep block propagation paths short
+        addnode = {(node + 1) % args.nodes, rng.randrange(args.nodes)} - {node}
+        config = {
+            "name": tank_name(node),
+            "addnode": [tank_name(n) for n in sorted(addnode)],
+            "ln": {"lnd": True},
+        }
+        if node < hubs:
+            config["metadata"] = {"role": HUB_ROLES[node % len(HUB_ROLES)]}
+        if opened_by[node]:
+            config["lnd"] = {"channels": opened_by[node]}
+        nodes.append(config)
+
+    # libyaml's dumper is much faster on thousands of channels, when it is available
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    with open(args.output, "w") as f:
+        yaml.dump({"nodes": nodes}, f, Dumper=dumper, default_flow_style=False, sort_keys=False)
+
+    last_block = channels[-1]["id"]["block"] if channels else args.start_height
+    print(f"Generated {args.topology} LN network:")
+    print(f"  - Nodes: {len(nodes)}")
+    print(f"  - Channels: {len(channels)}")
+    print(f"  - Channel open blocks: {args.start_height}-{last_block} ({MAX_INDEX} per block)")
+    print(
+        f"  - Miner funds needed by ln_init.py: {funding / COIN:.2f} BTC "
+        f"of {available / COIN:.2f} BTC"
+    )
+    print(f"\nSaved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()